@@ -1,4 +1,4 @@
-import { useCallback, useEffect, useMemo, useState } from 'react';
+import { useCallback, useEffect, useMemo, useRef, useState } from 'react';
 import { toast } from 'react-hot-toast';
 import useWebSocket from 'react-use-websocket';
 import { ConnectionPanel } from './ConnectionPanel';
@@ -6,23 +6,46 @@ import { Graph } from './Graph';
 import { TxRxConfigPanel } from './TxRxConfig';
 import { USConfigPanel } from './UsConfig';
 import { ConfigFilesPanel } from './ConfigFilesPanel';
+import { decodeBinaryMessage, WS_PROTOCOLS, type BModeImage, type FrameBatch, type FrameGap } from './frame-protocol';
 import type { DataFrame, Status, TxRxConfig, UsConfig, WulpusConfig } from './websocket-types';
 import { getInitialConfig } from './helper';
 
 export const LOCAL_KEY = 'wulpus-config-v1';
 export const CHANNEL_SIZE = 8;
+// Without filtered/envelope frames for this long the graph filters the raw frames itself
+const SERVER_DSP_TIMEOUT_MS = 1000;
 
-function App() {
+// Message that changes the filter band of the live stream (null = server default)
+const subscribeBand = (band: [number, number] | null) => ({
+  type: 'subscribe', low_hz: band ? band[0] : null, high_hz: band ? band[1] : null,
+});
 
-  const wsUrl = `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws`;
-  const { lastJsonMessage } = useWebSocket<Status | DataFrame>(wsUrl, {
-    shouldReconnect: () => true,
-  });
+function App() {
 
   const [status, setStatus] = useState<Status | null>(null);
   const [dataFrame, setDataFrame] = useState<DataFrame | null>(null);
+  const [filteredFrame, setFilteredFrame] = useState<DataFrame | null>(null);
+  const [envelopeFrame, setEnvelopeFrame] = useState<DataFrame | null>(null);
+  const lastServerDspRef = useRef(0);
+
+  // Filter band of the graph, sent to the server once the slider stopped moving
+  const [band, setBand] = useState<[number, number] | null>(null);
+  const [wsBand, setWsBand] = useState<[number, number] | null>(null);
+  useEffect(() => {
+    const timeout = setTimeout(() => setWsBand(band), 300);
+    return () => clearTimeout(timeout);
+  }, [band]);
+
+  // The plot is never wider than the screen, longer frames are min/max decimated by the server.
+  // Filter and envelope are computed by the server as well (see Graph for the fallback).
+  const plotWidth = Math.ceil(window.screen.width * window.devicePixelRatio);
+  const wsUrl = `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws`
+    + `?width=${plotWidth}&stream=raw&stream=filtered&stream=envelope&bmode=true`;
+  // The band is changed with a subscribe message, so it has to be sent again after reconnecting
+  const wsBandRef = useRef(wsBand);
+  wsBandRef.current = wsBand;
 
-  const [bmodeBuffer, setBmodeBuffer] = useState<number[][]>(Array.from({ length: CHANNEL_SIZE }, () => []));
+  const [bmodeImage, setBmodeImage] = useState<number[][]>([]);
 
   // WulpusConfig state
   const [txRxConfigs, setTxRxConfigs] = useState<TxRxConfig[]>(getInitialConfig().tx_rx_config);
@@ -53,27 +76,63 @@ function App() {
   }, [effectiveConfig, saveConfigToLocalStorage])
 
 
-  useEffect(() => {
-    if (lastJsonMessage) {
-      if ('status' in lastJsonMessage) {
-        setStatus(lastJsonMessage);
+  // Handle every message (several batches can arrive between two renders)
+  const handleMessage = useCallback((event: MessageEvent) => {
+    let message: Status | FrameBatch | FrameGap | BModeImage | null = null;
+    if (event.data instanceof ArrayBuffer) {
+      message = decodeBinaryMessage(event.data);
+    } else {
+      try {
+        message = JSON.parse(event.data);
+      } catch {
+        // plain text notifications
+        return;
+      }
+    }
+    if (!message) return;
+    if ('status' in message) {
+      setStatus(message);
+    }
+    else if (message.type === 'bmode') {
+      setBmodeImage(message.image);
+    }
+    else if (message.type === 'batch' && message.frames.length > 0) {
+      const frames = message.frames;
+      const latest = frames[frames.length - 1];
+      if (message.stream === 'filtered') {
+        lastServerDspRef.current = Date.now();
+        setFilteredFrame(latest);
+        return;
+      }
+      if (message.stream === 'envelope') {
+        lastServerDspRef.current = Date.now();
+        setEnvelopeFrame(latest);
+        return;
       }
-      else if ('data' in lastJsonMessage) {
-        setDataFrame(lastJsonMessage);
-        const rx_channel = lastJsonMessage.rx;
-        // push into bmode buffer
-        setBmodeBuffer((prev) => {
-          const next = [...prev];
-          const new_data = lastJsonMessage.data.slice()
-          for (const channel of rx_channel) {
-            if (channel >= CHANNEL_SIZE) break;
-            next[channel] = new_data;
-          }
-          return next;
-        });
+      // e.g. no sampling frequency known on the server
+      if (Date.now() - lastServerDspRef.current > SERVER_DSP_TIMEOUT_MS) {
+        setFilteredFrame(null);
+        setEnvelopeFrame(null);
       }
+      setDataFrame(latest);
     }
-  }, [lastJsonMessage, setStatus, setDataFrame]);
+  }, []);
+
+  const { sendJsonMessage } = useWebSocket(wsUrl, {
+    shouldReconnect: () => true,
+    // Frames arrive as binary messages if the server accepts the binary protocol
+    protocols: WS_PROTOCOLS,
+    onOpen: (event) => {
+      const ws = event.target as WebSocket;
+      ws.binaryType = 'arraybuffer';
+      if (wsBandRef.current) ws.send(JSON.stringify(subscribeBand(wsBandRef.current)));
+    },
+    onMessage: handleMessage,
+  });
+
+  useEffect(() => {
+    sendJsonMessage(subscribeBand(wsBand));
+  }, [wsBand, sendJsonMessage]);
 
   return (
     <div className="min-h-screen bg-gray-50 text-gray-900">
@@ -96,7 +155,8 @@ function App() {
 
         <div className="col-span-2 space-y-3">
           <div className="bg-white rounded-lg shadow">
-            <Graph dataFrame={dataFrame} bmodeBuffer={bmodeBuffer} usConfig={usConfig} />
+            <Graph dataFrame={dataFrame} filteredFrame={filteredFrame} envelopeFrame={envelopeFrame}
+              bmodeImage={bmodeImage} usConfig={usConfig} onBandChange={setBand} />
           </div>
 
           <div className="bg-white rounded-lg shadow">
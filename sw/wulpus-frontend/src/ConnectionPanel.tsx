@@ -1,6 +1,59 @@
 import { useEffect, useState } from "react";
-import { deactivateMock, getBTHConnections, postActivateMock, postConnect, postDisconnect, postStart, postStop, StatusLabel } from "./api";
-import type { Status, WulpusConfig } from "./websocket-types";
+import { toast } from 'react-hot-toast';
+import { controlReplay, deactivateMock, getBTHConnections, postActivateMock, postConnect, postDisconnect, postStart, postStop, StatusLabel } from "./api";
+import type { ReplayControl } from "./api";
+import type { ReplaySpeed, ReplayState, Status, WulpusConfig } from "./websocket-types";
+
+const REPLAY_SPEEDS: ReplaySpeed[] = [0.25, 0.5, 1, 2, 4, 'max'];
+
+function ReplayControls(props: { replay: ReplayState, progress: number }) {
+    const { replay, progress } = props;
+    // Frame index while the slider is dragged, the position is only sent on release
+    const [seekIndex, setSeekIndex] = useState<number | null>(null);
+    const position = seekIndex ?? Math.round(progress * replay.num_frames);
+
+    async function control(change: ReplayControl) {
+        try {
+            await controlReplay(change);
+        } catch (e) {
+            toast.error(`Replay control failed: ${e}`);
+        }
+    }
+
+    function commitSeek() {
+        if (seekIndex === null) return;
+        control({ seek_index: seekIndex }).finally(() => setSeekIndex(null));
+    }
+
+    return (
+        <div className="flex flex-row items-center gap-2 text-sm">
+            <button
+                onClick={() => control({ paused: !replay.paused })}
+                title={replay.paused ? 'Resume' : 'Pause'}
+                className="p-1 bg-gray-100 hover:bg-gray-200 flex items-center rounded"
+            >
+                <span className="material-symbols-rounded">{replay.paused ? 'play_arrow' : 'pause'}</span>
+            </button>
+            <input
+                type="range" className="grow"
+                min={0} max={replay.num_frames} step={1}
+                value={position}
+                onChange={(e) => setSeekIndex(Number(e.target.value))}
+                onPointerUp={commitSeek}
+                onKeyUp={commitSeek}
+            />
+            <select
+                className="border rounded px-1 py-0.5"
+                value={String(replay.speed)}
+                onChange={(e) => control({ speed: e.target.value === 'max' ? 'max' : Number(e.target.value) })}
+            >
+                {REPLAY_SPEEDS.map((speed) => (
+                    <option key={speed} value={String(speed)}>{speed === 'max' ? 'max' : `${speed}x`}</option>
+                ))}
+            </select>
+        </div>
+    );
+}
 
 export function ConnectionPanel(props: { effectiveConfig: WulpusConfig, status: Status | null }) {
     const { effectiveConfig, status } = props;
@@ -112,6 +165,7 @@ export function ConnectionPanel(props: { effectiveConfig: WulpusConfig, status:
                     )}
                 </div>
             </div>
+            {status?.replay && <ReplayControls replay={status.replay} progress={status.progress} />}
             <div className="text-xs text-gray-600">
                 Status: {status ? StatusLabel(status.status) : 'No Server/Backend'} · BT: {status?.bluetooth ?? '—'} · Progress: {Math.round((status?.progress ?? 0) * 100)}%
             </div>
@@ -1,13 +1,19 @@
 import type Plotly from 'plotly.js';
-import { useCallback, useEffect, useRef, useState } from "react";
+import { useCallback, useEffect, useMemo, useRef, useState } from "react";
 import Plot from 'react-plotly.js';
 import { bandpassFIR, hilbertEnvelope, toggleFullscreen } from './helper';
 import type { DataFrame, UsConfig } from './websocket-types';
 import RangeSlider from 'react-range-slider-input';
 
-export function Graph(props: { dataFrame: DataFrame | null, bmodeBuffer: number[][], usConfig: UsConfig }) {
-    const { dataFrame, bmodeBuffer, usConfig } = props;
+export function Graph(props: {
+    dataFrame: DataFrame | null, filteredFrame: DataFrame | null, envelopeFrame: DataFrame | null,
+    bmodeImage: number[][], usConfig: UsConfig, onBandChange: (band: [number, number] | null) => void
+}) {
+    const { dataFrame, filteredFrame, envelopeFrame, bmodeImage, usConfig, onBandChange } = props;
     const data = dataFrame?.data ?? []
+    // Decimated frames carry the sample index of every value
+    const xValues = (frame: DataFrame | null) => frame?.index ?? (frame?.data ?? []).map((_, i) => i)
+    const decimated = dataFrame?.index !== undefined
     const sampling_freq = usConfig.sampling_freq;
     const plotContainerRef = useRef<HTMLDivElement | null>(null);
     const [showBMode, setShowBMode] = useState<boolean>(false);
@@ -22,18 +28,28 @@ export function Graph(props: { dataFrame: DataFrame | null, bmodeBuffer: number[
         return () => document.removeEventListener('fullscreenchange', onFsChange);
     }, []);
 
-    // compute filter/envelope just-in-time before rendering
+    // filter and envelope are computed by the server for the selected band, or here if it doesn't send them
     const minLowCutHz = useCallback((sampling_freq: number) => sampling_freq / 2 * 0.1, []);
     const maxHighCutHz = useCallback((sampling_freq: number) => sampling_freq / 2 * 0.9, []);
     const [lowCutHz, setLowCutHz] = useState(minLowCutHz(sampling_freq));
     const [highCutHz, setHighCutHz] = useState(maxHighCutHz(sampling_freq));
-    const filteredFrame = data ? bandpassFIR(data, sampling_freq, lowCutHz, highCutHz, 31) : [];
-    const envelopeFrame = filteredFrame.length ? hilbertEnvelope(filteredFrame, 101) : [];
+
+    // Filtering needs uniformly sampled data, so it's not available for decimated frames
+    const localFilteredFrame = useMemo(() => filteredFrame || !dataFrame || decimated ? null
+        : { ...dataFrame, data: bandpassFIR(dataFrame.data, sampling_freq, lowCutHz, highCutHz, 31) },
+        [filteredFrame, dataFrame, decimated, sampling_freq, lowCutHz, highCutHz]);
+    const localEnvelopeFrame = useMemo(() => envelopeFrame || !localFilteredFrame ? null
+        : { ...localFilteredFrame, data: hilbertEnvelope(localFilteredFrame.data, 101) },
+        [envelopeFrame, localFilteredFrame]);
+    const shownFilteredFrame = filteredFrame ?? localFilteredFrame;
+    const shownEnvelopeFrame = envelopeFrame ?? localEnvelopeFrame;
 
     useEffect(() => {
         setLowCutHz(minLowCutHz(sampling_freq));
         setHighCutHz(maxHighCutHz(sampling_freq));
-    }, [sampling_freq, setHighCutHz, minLowCutHz, maxHighCutHz]);
+        // the server's default band is the same
+        onBandChange(null);
+    }, [sampling_freq, setHighCutHz, minLowCutHz, maxHighCutHz, onBandChange]);
 
     return (
         <div ref={plotContainerRef} className="bg-white p-4">
@@ -42,10 +58,11 @@ export function Graph(props: { dataFrame: DataFrame | null, bmodeBuffer: number[
                 {showBMode ? (
                     <Plot
                         data={[{
-                            z: bmodeBuffer.length ? bmodeBuffer : [[]],
+                            // log-compressed envelope per tx_rx_id, computed by the server
+                            z: bmodeImage.length ? bmodeImage : [[]],
                             type: 'heatmap',
-                            colorscale: 'Viridis',
-                            reversescale: true,
+                            colorscale: 'Greys',
+                            zmin: 0, zmax: 255,
                         }] as unknown as Plotly.Data[]}
                         useResizeHandler
                         style={{ width: "100%", height: "100%" }}
@@ -56,19 +73,19 @@ export function Graph(props: { dataFrame: DataFrame | null, bmodeBuffer: number[
                     <Plot
                         data={([
                             {
-                                x: data ? data.map((_, i) => i) : [],
-                                y: data ?? [],
+                                x: xValues(dataFrame),
+                                y: data,
                                 type: 'scatter', mode: 'lines', name: 'Raw', line: { color: 'blue' },
                             },
                             {
-                                x: data ? data.map((_, i) => i) : [],
-                                y: filteredFrame.length ? filteredFrame : [],
+                                x: xValues(shownFilteredFrame),
+                                y: shownFilteredFrame?.data ?? [],
                                 type: 'scatter', mode: 'lines', name: 'Filter', line: { color: 'green' },
                                 visible: 'legendonly',
                             },
                             {
-                                x: data ? data.map((_, i) => i) : [],
-                                y: envelopeFrame.length ? envelopeFrame : [],
+                                x: xValues(shownEnvelopeFrame),
+                                y: shownEnvelopeFrame?.data ?? [],
                                 type: 'scatter', mode: 'lines', name: 'Envelope', line: { color: 'red' },
                                 visible: 'legendonly',
                             },
@@ -113,6 +130,7 @@ export function Graph(props: { dataFrame: DataFrame | null, bmodeBuffer: number[
                                         const [low, high] = i;
                                         setLowCutHz(low);
                                         setHighCutHz(high);
+                                        onBandChange([low, high]);
                                     }}
                                 />
                             </div>
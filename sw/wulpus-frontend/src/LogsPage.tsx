@@ -1,23 +1,96 @@
+import type Plotly from 'plotly.js';
 import { useEffect, useState } from 'react';
+import Plot from 'react-plotly.js';
 import { useNavigate } from "react-router";
-import { BASE_URL, replayFile } from './api';
+import { getLogPreview, getLogs, replayFile } from './api';
+import type { LogPreview, LogsQuery, RecordingPage } from './api';
+
+const PAGE_SIZE = 100;
+
+function formatDuration(us: number | null) {
+    if (us === null) return '—';
+    const s = Math.round(us / 1e6);
+    const h = Math.floor(s / 3600);
+    const m = Math.floor((s % 3600) / 60);
+    return h > 0 ? `${h}h ${m}m` : `${m}m ${s % 60}s`;
+}
+
+function formatBytes(bytes: number) {
+    if (bytes >= 1e9) return `${(bytes / 1e9).toFixed(1)} GB`;
+    if (bytes >= 1e6) return `${(bytes / 1e6).toFixed(1)} MB`;
+    return `${(bytes / 1e3).toFixed(0)} kB`;
+}
+
+function PreviewHeatmap(props: { filename: string, tx_rx_ids: number[] }) {
+    const { filename, tx_rx_ids } = props;
+    const [txRxId, setTxRxId] = useState<number | undefined>(tx_rx_ids[0]);
+    const [preview, setPreview] = useState<LogPreview | null>(null);
+    const [error, setError] = useState<string | null>(null);
+
+    useEffect(() => {
+        let cancelled = false;
+        getLogPreview(filename, txRxId)
+            .then((data) => { if (!cancelled) setPreview(data); })
+            .catch((e) => { if (!cancelled) setError(String(e)); });
+        return () => { cancelled = true; };
+    }, [filename, txRxId]);
+
+    if (error) return <div className="text-red-600 text-sm">{error}</div>;
+    if (!preview) return <div className="text-gray-500 text-sm">Loading preview…</div>;
+
+    // peak amplitude per bin, rows = depth, columns = time
+    const depthBins = preview.min[0]?.length ?? 0;
+    const z = Array.from({ length: depthBins }, (_, d) =>
+        preview.min.map((row, t) => Math.max(Math.abs(row[d]), Math.abs(preview.max[t][d]))));
+    const x = preview.time.map((t) => new Date(t / 1e3));
+
+    return (
+        <div className="space-y-1">
+            {tx_rx_ids.length > 1 && (
+                <div className="flex gap-1 text-xs">
+                    {tx_rx_ids.map((id) => (
+                        <button
+                            key={id}
+                            className={`border rounded px-2 py-0.5 ${id === txRxId ? 'bg-gray-600 text-white' : 'hover:bg-gray-200'}`}
+                            onClick={() => setTxRxId(id)}
+                        >
+                            TX/RX {id}
+                        </button>
+                    ))}
+                </div>
+            )}
+            <div className="h-[200px]">
+                <Plot
+                    data={[{ z, x, type: 'heatmap', colorscale: 'Viridis' }] as unknown as Plotly.Data[]}
+                    useResizeHandler
+                    style={{ width: "100%", height: "100%" }}
+                    layout={{
+                        autosize: true, margin: { t: 10, r: 10, b: 30, l: 40 },
+                        yaxis: { title: { text: `depth (x${preview.samples_per_bin} samples)` } },
+                    }}
+                />
+            </div>
+        </div>
+    );
+}
 
 export function LogsPage() {
-    const [files, setFiles] = useState<string[] | null>(null);
+    const [page, setPage] = useState<RecordingPage | null>(null);
     const [error, setError] = useState<string | null>(null);
+    const [offset, setOffset] = useState(0);
+    const [sort, setSort] = useState<NonNullable<LogsQuery['sort']>>('filename');
+    const [order, setOrder] = useState<'asc' | 'desc'>('desc');
+    const [name, setName] = useState('');
+    const [previewFile, setPreviewFile] = useState<string | null>(null);
     const navigate = useNavigate();
 
     useEffect(() => {
         let cancelled = false;
-        fetch(`${BASE_URL}/logs`)
-            .then(async (res) => {
-                if (!res.ok) throw new Error(await res.text());
-                return res.json();
-            })
-            .then((data: string[]) => { if (!cancelled) setFiles(data); })
+        getLogs({ offset, limit: PAGE_SIZE, sort, order, name })
+            .then((data) => { if (!cancelled) setPage(data); })
             .catch((e) => { if (!cancelled) setError(String(e)); });
         return () => { cancelled = true; };
-    }, []);
+    }, [offset, sort, order, name]);
 
     const handleReplay = (filename: string) => {
         // Implement replay functionality here
@@ -30,6 +103,8 @@ export function LogsPage() {
             });
     };
 
+    const files = page?.items ?? null;
+
     return (
         <div className="min-h-screen bg-gray-50 text-gray-900">
             <main className="mx-auto max-w-5xl px-4 sm:px-6 lg:px-8 py-6 space-y-4">
@@ -38,6 +113,32 @@ export function LogsPage() {
                     <a href="/" className="text-blue-600 hover:underline">Back to Dashboard</a>
                 </header>
 
+                <div className="flex flex-wrap items-center gap-3 text-sm">
+                    <input
+                        className="border rounded px-2 py-1 grow"
+                        placeholder="Filter by name"
+                        value={name}
+                        onChange={(e) => { setName(e.target.value); setOffset(0); }}
+                    />
+                    <select
+                        className="border rounded px-2 py-1"
+                        value={sort}
+                        onChange={(e) => { setSort(e.target.value as NonNullable<LogsQuery['sort']>); setOffset(0); }}
+                    >
+                        <option value="filename">Name</option>
+                        <option value="start_time">Start time</option>
+                        <option value="duration">Duration</option>
+                        <option value="num_frames">Frames</option>
+                        <option value="bytes">Size</option>
+                    </select>
+                    <button
+                        className="border rounded px-2 py-1 hover:bg-gray-200"
+                        onClick={() => { setOrder(o => o === 'desc' ? 'asc' : 'desc'); setOffset(0); }}
+                    >
+                        {order === 'desc' ? 'Descending' : 'Ascending'}
+                    </button>
+                </div>
+
                 <div className="bg-white rounded-lg shadow">
                     <div className="p-4">
                         {error && (
@@ -50,27 +151,69 @@ export function LogsPage() {
                         ) : (
                             <ul className="divide-y divide-gray-200">
                                 {files.map((f) => (
-                                    <li key={f} className="flex items-center gap-3 py-2">
-                                        <span className="font-mono text-sm break-all grow">{f}</span>
-                                        <button
-                                            className="inline-flex items-center gap-2 rounded-md bg-blue-600 text-white text-sm px-3 py-1.5 hover:bg-blue-700"
-                                            onClick={() => handleReplay(f)}
-                                        >
-                                            Replay
-                                        </button>
-                                        <a
-                                            className="inline-flex items-center gap-2 rounded-md bg-gray-600 text-white text-sm px-3 py-1.5 hover:bg-gray-700"
-                                            href={`/logs/${encodeURIComponent(f)}`}
-                                            download
-                                        >
-                                            Download
-                                        </a>
+                                    <li key={f.filename} className="py-2">
+                                        <div className="flex items-center gap-3">
+                                            <div className="grow">
+                                                <div className="font-mono text-sm break-all">{f.filename}</div>
+                                                <div className="text-xs text-gray-500">
+                                                    {f.error
+                                                        ? <span className="text-red-600">{f.error}</span>
+                                                        : <>
+                                                            {formatDuration(f.duration)} · {f.num_frames ?? '—'} frames · {f.num_samples ?? '—'} samples · TX/RX {f.tx_rx_ids.join(', ')} · {formatBytes(f.bytes)}
+                                                        </>}
+                                                </div>
+                                            </div>
+                                            {!f.error && (
+                                                <button
+                                                    className="inline-flex items-center gap-2 rounded-md border border-gray-500 text-sm px-3 py-1.5 hover:bg-gray-200"
+                                                    onClick={() => setPreviewFile(p => p === f.filename ? null : f.filename)}
+                                                >
+                                                    Preview
+                                                </button>
+                                            )}
+                                            <button
+                                                className="inline-flex items-center gap-2 rounded-md bg-blue-600 text-white text-sm px-3 py-1.5 hover:bg-blue-700"
+                                                onClick={() => handleReplay(f.filename)}
+                                            >
+                                                Replay
+                                            </button>
+                                            <a
+                                                className="inline-flex items-center gap-2 rounded-md bg-gray-600 text-white text-sm px-3 py-1.5 hover:bg-gray-700"
+                                                href={`/logs/${encodeURIComponent(f.filename)}`}
+                                                download
+                                            >
+                                                Download
+                                            </a>
+                                        </div>
+                                        {previewFile === f.filename && (
+                                            <PreviewHeatmap filename={f.filename} tx_rx_ids={f.tx_rx_ids} />
+                                        )}
                                     </li>
                                 ))}
                             </ul>
                         )}
                     </div>
                 </div>
+
+                {page && page.total > PAGE_SIZE && (
+                    <div className="flex items-center justify-between text-sm">
+                        <button
+                            className="border rounded px-2 py-1 hover:bg-gray-200 disabled:opacity-50"
+                            disabled={offset === 0}
+                            onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}
+                        >
+                            Previous
+                        </button>
+                        <span>{offset + 1}–{Math.min(offset + PAGE_SIZE, page.total)} of {page.total}</span>
+                        <button
+                            className="border rounded px-2 py-1 hover:bg-gray-200 disabled:opacity-50"
+                            disabled={offset + PAGE_SIZE >= page.total}
+                            onClick={() => setOffset(offset + PAGE_SIZE)}
+                        >
+                            Next
+                        </button>
+                    </div>
+                )}
             </main>
         </div>
     );
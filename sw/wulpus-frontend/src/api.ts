@@ -1,4 +1,5 @@
 // Simple API client for the FastAPI backend
+import type { ReplaySpeed, ReplayState } from './websocket-types';
 
 export type ConnectResponse = { ok: string } | { [key: string]: string };
 
@@ -73,16 +74,89 @@ export async function deactivateMock(): Promise<ConnectResponse> {
     return res.json();
 }
 
-export async function replayFile(filename: string): Promise<void> {
-    const res = await fetch(`${BASE_URL}/replay/${encodeURIComponent(filename)}`, {
+export async function replayFile(filename: string, speed: ReplaySpeed = 1): Promise<void> {
+    const params = new URLSearchParams({ speed: String(speed) });
+    const res = await fetch(`${BASE_URL}/replay/${encodeURIComponent(filename)}?${params}`, {
         method: 'POST',
         headers: { "Content-Type": "application/json" },
     });
     if (!res.ok) throw new Error(await res.text());
 }
 
-export async function getLogs(): Promise<string[]> {
-    const res = await fetch(`${BASE_URL}/logs`);
+export type ReplayControl = {
+    speed?: ReplaySpeed;
+    paused?: boolean;
+    seek_index?: number;
+    seek_time?: number; // us since epoch
+};
+
+export async function controlReplay(control: ReplayControl): Promise<ReplayState & { position: number }> {
+    const params = new URLSearchParams();
+    for (const [key, value] of Object.entries(control)) {
+        if (value !== undefined) params.set(key, String(value));
+    }
+    const res = await fetch(`${BASE_URL}/replay-control?${params}`, {
+        method: 'POST',
+        headers: { "Content-Type": "application/json" },
+    });
+    if (!res.ok) throw new Error(await res.text());
+    return res.json();
+}
+
+export type RecordingInfo = {
+    filename: string;
+    start_time: number | null; // us since epoch
+    end_time: number | null;
+    duration: number | null; // us
+    num_frames: number | null;
+    num_samples: number | null;
+    tx_rx_ids: number[];
+    config_hash: string | null;
+    bytes: number;
+    error: string | null;
+};
+
+export type RecordingPage = {
+    total: number;
+    offset: number;
+    items: RecordingInfo[];
+};
+
+export type LogsQuery = {
+    offset?: number;
+    limit?: number;
+    sort?: 'filename' | 'start_time' | 'end_time' | 'duration' | 'num_frames' | 'num_samples' | 'bytes';
+    order?: 'asc' | 'desc';
+    name?: string;
+    tx_rx_id?: number;
+};
+
+export async function getLogs(query: LogsQuery = {}): Promise<RecordingPage> {
+    const params = new URLSearchParams();
+    for (const [key, value] of Object.entries(query)) {
+        if (value !== undefined && value !== '') params.set(key, String(value));
+    }
+    const res = await fetch(`${BASE_URL}/logs?${params.toString()}`);
+    if (!res.ok) throw new Error(await res.text());
+    return res.json();
+}
+
+export type LogPreview = {
+    tx_rx_ids: number[];
+    tx_rx_id: number;
+    level: number;
+    num_levels: number;
+    frames_per_bin: number;
+    samples_per_bin: number;
+    time: number[]; // us since epoch, start of each time bin
+    min: number[][]; // [time bin][depth bin]
+    max: number[][];
+};
+
+export async function getLogPreview(filename: string, tx_rx_id?: number, max_width = 256): Promise<LogPreview> {
+    const params = new URLSearchParams({ max_width: String(max_width) });
+    if (tx_rx_id !== undefined) params.set('tx_rx_id', String(tx_rx_id));
+    const res = await fetch(`${BASE_URL}/logs/${encodeURIComponent(filename)}/preview?${params.toString()}`);
     if (!res.ok) throw new Error(await res.text());
     return res.json();
 }
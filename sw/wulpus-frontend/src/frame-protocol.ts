@@ -0,0 +1,113 @@
+// Binary live frame format, mirrors wulpus/frame_protocol.py
+
+import type { DataFrame } from './websocket-types';
+
+// Offered to the server in order of preference, JSON is the fallback
+export const WS_PROTOCOLS = ['wulpus.binary.v1', 'wulpus.json'];
+
+const MSG_FRAME = 1;
+const MSG_BATCH = 2;
+const MSG_GAP = 3;
+const MSG_BMODE = 4;
+const BINARY_VERSION = 1;
+const DTYPE_INT16 = 1;
+// Decimated frame: uint16 sample indices followed by the int16 values
+const DTYPE_INT16_INDEXED = 2;
+const HEADER_SIZE = 20;
+const BATCH_HEADER_SIZE = 8;
+const GAP_SIZE = 12;
+const BMODE_HEADER_SIZE = 16;
+
+// Frames that were dropped before they reached this client (inclusive)
+export type FrameGap = { type: 'gap'; from_seq: number; to_seq: number };
+export type LiveStream = 'raw' | 'filtered' | 'envelope';
+// Stream ids of binary batch messages
+const STREAMS: LiveStream[] = ['raw', 'filtered', 'envelope'];
+export type FrameBatch = { type: 'batch'; stream: LiveStream; frames: DataFrame[] };
+// Log-compressed B-mode image, one row per tx_rx_id, 0..255
+export type BModeImage = { type: 'bmode'; time: number; dynamic_range_db: number; image: number[][] };
+
+function maskToChannels(mask: number): number[] {
+    const channels: number[] = [];
+    for (let ch = 0; ch < 8; ch++) {
+        if ((mask >> ch) & 1) channels.push(ch);
+    }
+    return channels;
+}
+
+export function decodeBinaryFrame(buffer: ArrayBuffer, offset = 0): DataFrame | null {
+    if (buffer.byteLength < offset + HEADER_SIZE) return null;
+    const view = new DataView(buffer, offset);
+    const dtype = view.getUint8(2);
+    if (view.getUint8(0) !== MSG_FRAME || view.getUint8(1) !== BINARY_VERSION
+        || (dtype !== DTYPE_INT16 && dtype !== DTYPE_INT16_INDEXED)) {
+        return null;
+    }
+    const numSamples = view.getUint16(6, true);
+    let start = offset + HEADER_SIZE;
+    let index: number[] | undefined;
+    // Frames inside a batch aren't necessarily 2-byte aligned, copy the arrays out
+    if (dtype === DTYPE_INT16_INDEXED) {
+        index = Array.from(new Uint16Array(buffer.slice(start, start + 2 * numSamples)));
+        start += 2 * numSamples;
+    }
+    const samples = new Int16Array(buffer.slice(start, start + 2 * numSamples));
+    return {
+        data: Array.from(samples),
+        time: Number(view.getBigUint64(12, true)),
+        tx: maskToChannels(view.getUint8(4)),
+        rx: maskToChannels(view.getUint8(5)),
+        seq: view.getUint32(8, true),
+        tx_rx_id: view.getUint8(3),
+        index,
+    };
+}
+
+function encodedSize(frame: DataFrame): number {
+    return HEADER_SIZE + 2 * frame.data.length * (frame.index ? 2 : 1);
+}
+
+export function decodeBinaryMessage(buffer: ArrayBuffer): FrameBatch | FrameGap | BModeImage | null {
+    if (buffer.byteLength < BATCH_HEADER_SIZE) return null;
+    const view = new DataView(buffer);
+    if (view.getUint8(1) !== BINARY_VERSION) return null;
+    switch (view.getUint8(0)) {
+        case MSG_GAP:
+            if (buffer.byteLength < GAP_SIZE) return null;
+            return { type: 'gap', from_seq: view.getUint32(4, true), to_seq: view.getUint32(8, true) };
+        case MSG_BATCH: {
+            const stream = STREAMS[view.getUint16(2, true)];
+            if (!stream) return null;
+            const frames: DataFrame[] = [];
+            let offset = BATCH_HEADER_SIZE;
+            const count = view.getUint32(4, true);
+            for (let i = 0; i < count; i++) {
+                const frame = decodeBinaryFrame(buffer, offset);
+                if (!frame) return null;
+                frames.push(frame);
+                offset += encodedSize(frame);
+            }
+            return { type: 'batch', stream, frames };
+        }
+        case MSG_BMODE: {
+            if (buffer.byteLength < BMODE_HEADER_SIZE) return null;
+            const rows = view.getUint16(2, true);
+            const columns = view.getUint16(4, true);
+            const pixels = new Uint8Array(buffer, BMODE_HEADER_SIZE, rows * columns);
+            const image: number[][] = [];
+            for (let row = 0; row < rows; row++) {
+                image.push(Array.from(pixels.subarray(row * columns, (row + 1) * columns)));
+            }
+            return {
+                type: 'bmode', time: Number(view.getBigUint64(8, true)),
+                dynamic_range_db: view.getUint16(6, true), image,
+            };
+        }
+        case MSG_FRAME: {
+            const frame = decodeBinaryFrame(buffer);
+            return frame ? { type: 'batch', stream: 'raw', frames: [frame] } : null;
+        }
+        default:
+            return null;
+    }
+}
@@ -34,8 +34,20 @@ export type WulpusConfig = {
     us_config: UsConfig;
 };
 
+// Multiple of the recorded rate, 'max' = as fast as possible
+export type ReplaySpeed = number | 'max';
+
+export type ReplayState = {
+    speed: ReplaySpeed;
+    paused: boolean;
+    num_frames: number;
+    start_time: number | null; // us since epoch
+    end_time: number | null;
+};
+
 export type Status = {
     mock?: boolean;
+    replay?: ReplayState; // only while a recording is replayed
     status: number; // 0.., maps to backend Status enum
     bluetooth: string;
     us_config: UsConfig | null;
@@ -45,7 +57,10 @@ export type Status = {
 
 export type DataFrame = {
     data: number[]
-    time: number[]
+    time: number // us since epoch
     tx: number[]
     rx: number[]
+    seq?: number
+    tx_rx_id?: number
+    index?: number[] // sample index of every value if the frame was decimated
 }
\ No newline at end of file
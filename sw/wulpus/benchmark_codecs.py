@@ -0,0 +1,83 @@
+"""
+Compare recording codecs on real recordings.
+
+    python -m wulpus.benchmark_codecs wulpus/measurements/*.zip
+
+Reports compression ratio (raw int16 bytes / parquet bytes) and encode/decode
+throughput in MB/s of raw sample data for every codec in CODECS.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import time
+from typing import List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from wulpus.helper import RecordingData, load_recording, table_to_recording_data
+from wulpus.recording import write_parquet
+from wulpus.recording_codec import RecordingCodec
+
+CODECS: List[RecordingCodec] = [
+    RecordingCodec(compression='none'),
+    RecordingCodec(),
+    RecordingCodec(compression='zstd', level=1),
+    RecordingCodec(compression='zstd', level=9),
+    RecordingCodec(compression='lz4'),
+    RecordingCodec(shuffle=True, compression='zstd', level=3),
+    RecordingCodec(shuffle=True, compression='lz4'),
+    RecordingCodec(delta='column', compression='zstd', level=3),
+    RecordingCodec(delta='sample', compression='zstd', level=3),
+    RecordingCodec(delta='sample', shuffle=True, compression='zstd', level=3),
+    RecordingCodec(delta='frame', compression='zstd', level=3),
+    RecordingCodec(delta='frame', shuffle=True, compression='zstd', level=3),
+    RecordingCodec(delta='frame', shuffle=True, compression='lz4'),
+]
+
+
+def codec_name(codec: RecordingCodec) -> str:
+    level = '' if codec.level is None else f"-{codec.level}"
+    shuffle = '+shuffle' if codec.shuffle else ''
+    return f"{codec.delta}{shuffle}/{codec.compression}{level}"
+
+
+def benchmark(data: RecordingData, codec: RecordingCodec, repeat: int = 3) -> dict:
+    raw_bytes = data.samples.nbytes
+    encode_s, decode_s = float('inf'), float('inf')
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        t0 = time.perf_counter()
+        write_parquet(buffer, data, codec)
+        encode_s = min(encode_s, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        table = pq.read_table(pa.BufferReader(buffer.getvalue()))
+        table_to_recording_data(table, data.config)
+        decode_s = min(decode_s, time.perf_counter() - t0)
+    size = len(buffer.getvalue())
+    return {
+        'ratio': raw_bytes / size,
+        'encode_mb_s': raw_bytes / 1e6 / encode_s,
+        'decode_mb_s': raw_bytes / 1e6 / decode_s,
+        'bytes': size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recording codecs.")
+    parser.add_argument('files', nargs='+', help="measurement .zip files")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per codec, the fastest one is reported")
+    args = parser.parse_args()
+
+    for file in args.files:
+        data = load_recording(file)
+        print(f"{file}: {data.samples.shape[0]} frames x {data.samples.shape[1]} samples, "
+              f"{data.samples.nbytes / 1e6:.1f} MB raw")
+        print(f"{'codec':<32}{'ratio':>8}{'enc MB/s':>11}{'dec MB/s':>11}{'size MB':>10}")
+        for codec in CODECS:
+            result = benchmark(data, codec, args.repeat)
+            print(f"{codec_name(codec):<32}{result['ratio']:>8.2f}{result['encode_mb_s']:>11.1f}"
+                  f"{result['decode_mb_s']:>11.1f}{result['bytes'] / 1e6:>10.2f}")
+        print()
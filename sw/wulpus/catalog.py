@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import List, Literal, Optional, Tuple, get_args
+
+from pydantic import BaseModel
+from wulpus.recording import Recording
+
+CATALOG_FILE = '.catalog.sqlite'
+# Bump when the stored metadata changes, existing entries are re-scanned
+CATALOG_VERSION = 1
+
+SORT_COLUMNS = Literal['filename', 'start_time', 'end_time', 'duration',
+                       'num_frames', 'num_samples', 'bytes']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    filename TEXT PRIMARY KEY,
+    start_time INTEGER,
+    end_time INTEGER,
+    duration INTEGER,
+    num_frames INTEGER,
+    num_samples INTEGER,
+    config_hash TEXT,
+    config TEXT,
+    bytes INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS recording_tx_rx (
+    filename TEXT NOT NULL REFERENCES recordings(filename) ON DELETE CASCADE,
+    tx_rx_id INTEGER NOT NULL,
+    PRIMARY KEY (filename, tx_rx_id)
+);
+CREATE INDEX IF NOT EXISTS idx_recordings_start ON recordings(start_time);
+CREATE INDEX IF NOT EXISTS idx_recordings_frames ON recordings(num_frames);
+CREATE INDEX IF NOT EXISTS idx_recordings_bytes ON recordings(bytes);
+CREATE INDEX IF NOT EXISTS idx_recordings_config ON recordings(config_hash);
+CREATE INDEX IF NOT EXISTS idx_tx_rx_id ON recording_tx_rx(tx_rx_id);
+"""
+
+
+class RecordingInfo(BaseModel):
+    filename: str
+    # Timestamps in us since epoch
+    start_time: Optional[int] = None
+    end_time: Optional[int] = None
+    duration: Optional[int] = None
+    num_frames: Optional[int] = None
+    num_samples: Optional[int] = None
+    tx_rx_ids: List[int] = []
+    config_hash: Optional[str] = None
+    bytes: int
+    # Set if the file could not be read
+    error: Optional[str] = None
+
+
+class RecordingPage(BaseModel):
+    total: int
+    offset: int
+    items: List[RecordingInfo]
+
+
+def config_hash(config_json: str) -> str:
+    return hashlib.sha256(config_json.encode('utf-8')).hexdigest()[:16]
+
+
+def scan_recording(path: str) -> Tuple[dict, List[int]]:
+    """Read the catalog metadata of a recording (parquet footer and tx_rx_id column only)."""
+    stat = os.stat(path)
+    row = {
+        'filename': os.path.basename(path),
+        'bytes': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    try:
+        with Recording(path) as rec:
+            start, end = rec.time_bounds()
+            config_json = rec.config.model_dump_json()
+            tx_rx_ids = rec.tx_rx_ids()
+            row.update({
+                'start_time': start,
+                'end_time': end,
+                'duration': end - start if start is not None else None,
+                'num_frames': rec.num_frames,
+                'num_samples': rec.num_samples,
+                'config_hash': config_hash(config_json),
+                'config': config_json,
+            })
+    except Exception as e:
+        # Keep unreadable files listed, so they can still be downloaded
+        row['error'] = str(e) or type(e).__name__
+        tx_rx_ids = []
+    return row, tx_rx_ids
+
+
+class RecordingCatalog:
+    """SQLite index of the recordings in a directory.
+
+    Entries are added when a recording is saved (`add`) and `sync` backfills
+    or drops entries for files that were changed outside of the server.
+    """
+
+    def __init__(self, directory: str, db_path: Optional[str] = None):
+        self.directory = directory
+        self.db_path = db_path or os.path.join(directory, CATALOG_FILE)
+        self._write_lock = threading.Lock()
+        with closing(self._connect()) as con, con:
+            con.executescript(_SCHEMA)
+            version = con.execute('PRAGMA user_version').fetchone()[0]
+            if version != CATALOG_VERSION:
+                con.execute('DELETE FROM recordings')
+                con.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.db_path, timeout=30)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('PRAGMA foreign_keys = ON')
+        return con
+
+    def _store(self, con: sqlite3.Connection, row: dict, tx_rx_ids: List[int]):
+        con.execute('DELETE FROM recordings WHERE filename = ?',
+                    (row['filename'],))
+        columns = ', '.join(row.keys())
+        placeholders = ', '.join('?' for _ in row)
+        con.execute(f'INSERT INTO recordings ({columns}) VALUES ({placeholders})',
+                    tuple(row.values()))
+        con.executemany('INSERT INTO recording_tx_rx (filename, tx_rx_id) VALUES (?, ?)',
+                        [(row['filename'], int(i)) for i in tx_rx_ids])
+
+    def add(self, path: str):
+        """Add or refresh the entry of a single recording."""
+        row, tx_rx_ids = scan_recording(path)
+        with self._write_lock, closing(self._connect()) as con, con:
+            self._store(con, row, tx_rx_ids)
+
+    def remove(self, filename: str):
+        with self._write_lock, closing(self._connect()) as con, con:
+            con.execute('DELETE FROM recordings WHERE filename = ?', (filename,))
+
+    def sync(self, extension: str = '.zip') -> int:
+        """Bring the catalog in line with the directory.
+
+        Only new or modified files (size/mtime) are scanned.
+
+        Returns:
+            int: Number of scanned files.
+        """
+        files = {}
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.lower().endswith(extension):
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime)
+
+        with closing(self._connect()) as con:
+            known = {r['filename']: (r['bytes'], r['mtime'])
+                     for r in con.execute('SELECT filename, bytes, mtime FROM recordings')}
+        to_scan = [name for name, sig in files.items() if known.get(name) != sig]
+        removed = [name for name in known if name not in files]
+
+        scanned = [scan_recording(os.path.join(self.directory, name))
+                   for name in to_scan]
+        with self._write_lock, closing(self._connect()) as con, con:
+            con.executemany('DELETE FROM recordings WHERE filename = ?',
+                            [(name,) for name in removed])
+            for row, tx_rx_ids in scanned:
+                self._store(con, row, tx_rx_ids)
+        return len(scanned)
+
+    def query(self,
+              offset: int = 0,
+              limit: int = 100,
+              sort: SORT_COLUMNS = 'filename',
+              order: Literal['asc', 'desc'] = 'desc',
+              name: Optional[str] = None,
+              start_after: Optional[int] = None,
+              start_before: Optional[int] = None,
+              min_frames: Optional[int] = None,
+              tx_rx_id: Optional[int] = None,
+              config_hash: Optional[str] = None) -> RecordingPage:
+        """Return one page of recordings matching all given filters."""
+        if sort not in get_args(SORT_COLUMNS):
+            raise ValueError(f"Can't sort by {sort}")
+        where, params = [], []
+        if name:
+            where.append("filename LIKE ? ESCAPE '\\'")
+            escaped = name.replace('\\', '\\\\').replace(
+                '%', '\\%').replace('_', '\\_')
+            params.append(f'%{escaped}%')
+        if start_after is not None:
+            where.append('start_time >= ?')
+            params.append(start_after)
+        if start_before is not None:
+            where.append('start_time < ?')
+            params.append(start_before)
+        if min_frames is not None:
+            where.append('num_frames >= ?')
+            params.append(min_frames)
+        if tx_rx_id is not None:
+            where.append('filename IN (SELECT filename FROM recording_tx_rx WHERE tx_rx_id = ?)')
+            params.append(tx_rx_id)
+        if config_hash is not None:
+            where.append('config_hash = ?')
+            params.append(config_hash)
+        where_sql = ('WHERE ' + ' AND '.join(where)) if where else ''
+        direction = 'DESC' if order == 'desc' else 'ASC'
+
+        with closing(self._connect()) as con:
+            total = con.execute(f'SELECT COUNT(*) FROM recordings {where_sql}',
+                                params).fetchone()[0]
+            rows = con.execute(
+                f'SELECT * FROM recordings {where_sql} '
+                f'ORDER BY {sort} {direction}, filename {direction} LIMIT ? OFFSET ?',
+                params + [limit, offset]).fetchall()
+            ids = {}
+            if rows:
+                names = [r['filename'] for r in rows]
+                for r in con.execute(
+                        'SELECT filename, tx_rx_id FROM recording_tx_rx WHERE filename IN '
+                        f'({", ".join("?" for _ in names)}) ORDER BY tx_rx_id', names):
+                    ids.setdefault(r['filename'], []).append(r['tx_rx_id'])
+
+        items = [RecordingInfo(tx_rx_ids=ids.get(r['filename'], []),
+                               **{k: r[k] for k in r.keys() if k in RecordingInfo.model_fields})
+                 for r in rows]
+        return RecordingPage(total=total, offset=offset, items=items)
+
+    def get_config(self, filename: str) -> Optional[dict]:
+        with closing(self._connect()) as con:
+            row = con.execute('SELECT config FROM recordings WHERE filename = ?',
+                              (filename,)).fetchone()
+        if row is None or row['config'] is None:
+            return None
+        return json.loads(row['config'])
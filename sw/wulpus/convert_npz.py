@@ -0,0 +1,187 @@
+"""
+Convert legacy recordings of the jupyter notebook GUI (`np.savez_compressed`
+with data_arr, acq_num_arr, tx_rx_id_arr and record_start) into the
+measurement zip format, in parallel.
+
+    python -m wulpus.convert_npz old_measurements/ --out-dir wulpus/measurements \\
+        --tx-rx-config tx_rx_configs.json --us-config uss_config.json
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from wulpus.helper import RecordingData, ensure_dir
+from wulpus.recording import write_recording
+from wulpus.recording_codec import DEFAULT_CODEC, RecordingCodec
+from wulpus.wulpus_api import DATA_FILE_EXTENSION
+from wulpus.wulpus_config_models import (TxRxConfig, UsConfig,
+                                         WulpusConfig)
+
+LEGACY_EXTENSION = '.npz'
+# Legacy file names end with the recording start, e.g. data_2024-02-21_10-15-00.npz
+LEGACY_TIME_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+
+
+def load_legacy_config(config: Union[str, None] = None,
+                       tx_rx_config: Union[str, None] = None,
+                       us_config: Union[str, None] = None) -> Union[WulpusConfig, None]:
+    """Load either a WulpusConfig json or the two legacy notebook config files."""
+    if config is not None:
+        with open(config, 'r', encoding='utf-8') as f:
+            return WulpusConfig.model_validate(json.load(f))
+    if tx_rx_config is None and us_config is None:
+        return None
+    tx_rx = [TxRxConfig()]
+    if tx_rx_config is not None:
+        with open(tx_rx_config, 'r', encoding='utf-8') as f:
+            tx_rx = [TxRxConfig.model_validate(c) for c in json.load(f)['configs']]
+    us = UsConfig(num_txrx_configs=len(tx_rx))
+    if us_config is not None:
+        with open(us_config, 'r', encoding='utf-8') as f:
+            us = UsConfig.model_validate(json.load(f))
+    return WulpusConfig(tx_rx_config=tx_rx, us_config=us)
+
+
+def _record_start_us(path: str, npz) -> int:
+    if 'record_start' in npz.files:
+        return int(float(npz['record_start'][0]) * 1e6)
+    match = LEGACY_TIME_PATTERN.search(os.path.basename(path))
+    if match is not None:
+        return int(time.mktime(time.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S")) * 1e6)
+    print(f"{path}: no record_start, using the file modification time")
+    return int(os.path.getmtime(path) * 1e6)
+
+
+def convert_npz(path: str, out_path: str, config: Union[WulpusConfig, None] = None,
+                period_us: Union[int, None] = None,
+                codec: RecordingCodec = DEFAULT_CODEC) -> int:
+    """Convert a single legacy file.
+
+    Frame timestamps are reconstructed as record_start + i * period_us, where
+    period_us defaults to the measurement period of the config.
+
+    Returns:
+        int: Number of converted frames.
+    """
+    with np.load(path) as npz:
+        samples = np.ascontiguousarray(npz['data_arr'].T, dtype='<i2')
+        num_frames, num_samples = samples.shape
+        acq_nr = npz['acq_num_arr'][:num_frames].astype('<u2') if 'acq_num_arr' in npz.files \
+            else np.arange(num_frames, dtype='<u2')
+        tx_rx_id = npz['tx_rx_id_arr'][:num_frames].astype(np.uint8) if 'tx_rx_id_arr' in npz.files \
+            else np.zeros(num_frames, dtype=np.uint8)
+        start_us = _record_start_us(path, npz)
+
+    num_ids = int(tx_rx_id.max()) + 1 if num_frames > 0 else 1
+    if config is None:
+        # Channels are unknown, keep at least the ids so frames can be told apart
+        config = WulpusConfig(tx_rx_config=[TxRxConfig(config_id=i) for i in range(num_ids)],
+                              us_config=UsConfig(num_txrx_configs=num_ids))
+    elif len(config.tx_rx_config) < num_ids:
+        raise ValueError(f"{path} uses tx_rx_id {num_ids - 1}, "
+                         f"but the config only has {len(config.tx_rx_config)} TX/RX configs")
+    config = config.model_copy(deep=True)
+    config.us_config.num_acqs = num_frames
+    config.us_config.num_samples = num_samples
+
+    if period_us is None:
+        period_us = config.us_config.meas_period
+    frame_time = start_us + np.arange(num_frames, dtype=np.uint64) * np.uint64(period_us)
+
+    write_recording(out_path, RecordingData(samples=samples, acq_nr=acq_nr, tx_rx_id=tx_rx_id,
+                                            time=frame_time, config=config), codec)
+    return num_frames
+
+
+def find_legacy_files(inputs: List[str]) -> List[Tuple[str, str]]:
+    """Return (file, path relative to its input directory) of every .npz in `inputs`.
+
+    Files given directly are relative to their own folder, i.e. just the file name.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for file in sorted(glob.glob(os.path.join(item, '**', '*' + LEGACY_EXTENSION),
+                                         recursive=True)):
+                files.append((file, os.path.relpath(file, item)))
+        else:
+            files.append((item, os.path.basename(item)))
+    return files
+
+
+def output_paths(files: List[Tuple[str, str]], out_dir: str) -> Dict[str, str]:
+    """Map every input file to its zip under `out_dir`, keeping the subfolders of directory inputs.
+
+    Raises ValueError if two inputs would be written to the same zip.
+    """
+    outputs: Dict[str, str] = {}
+    sources: Dict[str, str] = {}
+    for file, relative in files:
+        out_path = os.path.join(out_dir, os.path.splitext(relative)[0] + DATA_FILE_EXTENSION)
+        key = os.path.normcase(os.path.abspath(out_path))
+        if key in sources:
+            if os.path.normcase(os.path.abspath(sources[key])) == os.path.normcase(os.path.abspath(file)):
+                continue  # The same file given twice
+            raise ValueError(f"{sources[key]} and {file} would both be converted to {out_path}")
+        sources[key] = file
+        outputs[file] = out_path
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert legacy .npz recordings into measurement zips.")
+    parser.add_argument('inputs', nargs='+', help=".npz files or directories")
+    parser.add_argument('--out-dir', required=True,
+                        help="directory for the zips, subfolders of input directories are kept")
+    parser.add_argument('--config', help="WulpusConfig json (as saved by the web GUI)")
+    parser.add_argument('--tx-rx-config', help="legacy TX/RX config json")
+    parser.add_argument('--us-config', help="legacy ultrasound config json")
+    parser.add_argument('--period-us', type=int, default=None,
+                        help="time between frames (default: meas_period of the config)")
+    parser.add_argument('--compression', default=DEFAULT_CODEC.compression,
+                        help="parquet compression of the output")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes (default: number of CPUs)")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="replace zips that already exist")
+    args = parser.parse_args()
+
+    config = load_legacy_config(args.config, args.tx_rx_config, args.us_config)
+    if config is None:
+        print("No config given, TX/RX channels will be empty in the converted files")
+    codec = RecordingCodec(compression=args.compression)
+    ensure_dir(args.out_dir)
+
+    try:
+        outputs = output_paths(find_legacy_files(args.inputs), args.out_dir)
+    except ValueError as e:
+        raise SystemExit(f"Nothing converted: {e}") from e
+
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for file, out_path in outputs.items():
+            if os.path.exists(out_path) and not args.overwrite:
+                print(f"Skipping {file}, {out_path} exists")
+                continue
+            ensure_dir(os.path.dirname(out_path))
+            jobs[pool.submit(convert_npz, file, out_path, config,
+                             args.period_us, codec)] = (file, out_path)
+
+        failed = 0
+        for future in as_completed(jobs):
+            file, out_path = jobs[future]
+            try:
+                print(f"Converted {file} -> {out_path} ({future.result()} frames)")
+            except Exception as e:
+                failed += 1
+                print(f"Failed to convert {file}: {e}")
+    print(f"Done: {len(jobs) - failed} converted, {failed} failed")
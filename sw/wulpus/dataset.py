@@ -0,0 +1,204 @@
+"""
+Query a directory of recordings as one table.
+
+    rds = RecordingDataset('wulpus/measurements')
+    table = rds.to_table(columns=[rds.time_column, 'tx_rx_id', '0', '1'],
+                         filter=rds.filter_expression(dates=(date(2025, 3, 3), date(2025, 3, 10)),
+                                                      tx_rx_ids=[1]))
+
+Every recording is a fragment of a `pyarrow.dataset` with the virtual
+partition columns `date` (local date of the first frame) and `recording`
+(file name), so filters on them skip whole files. Frames of all TX/RX
+configs are interleaved inside a file, so `tx_rx_id` (like time and
+acquisition number) is pushed down to the parquet row-group statistics
+instead. Scans are multithreaded.
+"""
+from __future__ import annotations
+
+import datetime
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from wulpus.helper import get_sample_columns, get_time_column, open_zip_member
+from wulpus.recording import DATA_MEMBER, Range, Recording
+from wulpus.recording_codec import codec_from_metadata, decode_samples
+from wulpus.wulpus_api import DATA_FILE_EXTENSION
+
+DateRange = Tuple[Union[datetime.date, None], Union[datetime.date, None]]
+
+PARTITION_FIELDS = [pa.field('date', pa.date32()),
+                    pa.field('recording', pa.string())]
+
+
+def _recording_fragment(path: str, file_format: ds.ParquetFileFormat):
+    """Return (fragment, needs decoding) for one recording zip."""
+    with Recording(path) as rec:
+        start, _ = rec.time_bounds()
+        delta = rec.codec.delta != 'none'
+    partition = ds.field('recording') == os.path.basename(path)
+    if start is not None:
+        date = datetime.date.fromtimestamp(start / 1e6)
+        partition &= ds.field('date') == pa.scalar(date, pa.date32())
+    # Zero-copy view on the stored parquet member, kept alive by the fragment
+    buffer = open_zip_member(path, DATA_MEMBER).read_buffer()
+    return file_format.make_fragment(buffer, partition_expression=partition), delta
+
+
+def _decode_table(table: pa.Table) -> pa.Table:
+    """Undo the delta encoding of the sample columns of one row group."""
+    codec, segment = codec_from_metadata(table.schema.metadata)
+    sample_cols = get_sample_columns(table.column_names)
+    samples = np.empty((table.num_rows, len(sample_cols)), dtype='<i2')
+    for i, col in enumerate(sample_cols):
+        samples[:, i] = table.column(col).to_numpy()
+    tx_rx_id = table.column('tx_rx_id').to_numpy().astype(np.uint8)
+    samples = np.asfortranarray(decode_samples(samples, tx_rx_id, codec, segment))
+    decoded = dict(zip(sample_cols, samples.T))
+    return pa.Table.from_arrays(
+        [pa.array(decoded[name]) if name in decoded else table.column(name)
+         for name in table.column_names], schema=table.schema)
+
+
+class RecordingDataset:
+    """A set of recordings as one logical `pyarrow.dataset`.
+
+    Recordings with a delta codec are decoded one row group at a time when
+    sample columns are requested, everything else is read by the dataset
+    scanner directly.
+    """
+
+    def __init__(self, source: Union[str, Iterable[str]], max_workers: Union[int, None] = None):
+        """
+        Args:
+            source: Directory with recording zips, or a list of zip paths.
+        """
+        if isinstance(source, str):
+            paths = sorted(glob.glob(os.path.join(source, '*' + DATA_FILE_EXTENSION)))
+        else:
+            paths = list(source)
+        self._format = ds.ParquetFileFormat()
+        self._max_workers = max_workers
+
+        def open_fragment(path):
+            try:
+                return _recording_fragment(path, self._format)
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            opened = [f for f in pool.map(open_fragment, paths) if f is not None]
+        self.fragments = [frag for frag, _ in opened]
+        self._needs_decoding = [delta for _, delta in opened]
+
+        schemas = [frag.physical_schema for frag in self.fragments]
+        schema = pa.unify_schemas(schemas) if schemas else pa.schema([])
+        for field in PARTITION_FIELDS:
+            schema = schema.append(field)
+        self.schema = schema
+        self.dataset = ds.FileSystemDataset(self.fragments, schema, self._format)
+        self.sample_columns = get_sample_columns(schema.names)
+        self.time_column = get_time_column(schema) if schemas else None
+
+    @property
+    def num_recordings(self) -> int:
+        return len(self.fragments)
+
+    def filter_expression(self,
+                          time_range: Union[Range, None] = None,
+                          tx_rx_ids: Union[Iterable[int], None] = None,
+                          acq_range: Union[Range, None] = None,
+                          dates: Union[DateRange, None] = None,
+                          recordings: Union[Iterable[str], None] = None) -> Union[ds.Expression, None]:
+        """Build a filter from the common selections (ranges are half-open [start, stop))."""
+        parts = []
+        for name, value_range in ((self.time_column, time_range), ('aq_number', acq_range),
+                                  ('date', dates)):
+            if value_range is None or name is None:
+                continue
+            start, stop = value_range
+            if start is not None:
+                parts.append(ds.field(name) >= start)
+            if stop is not None:
+                parts.append(ds.field(name) < stop)
+        if tx_rx_ids is not None:
+            parts.append(ds.field('tx_rx_id').isin(list(tx_rx_ids)))
+        if recordings is not None:
+            parts.append(ds.field('recording').isin(list(recordings)))
+        if not parts:
+            return None
+        expression = parts[0]
+        for part in parts[1:]:
+            expression &= part
+        return expression
+
+    def count_rows(self, filter: Union[ds.Expression, None] = None) -> int:
+        return self.dataset.count_rows(filter=filter)
+
+    def to_table(self, columns: Union[List[str], None] = None,
+                 filter: Union[ds.Expression, None] = None,
+                 use_threads: bool = True) -> pa.Table:
+        """Read the selected columns of all matching frames.
+
+        Rows are in recording order, and in acquisition order within a recording.
+        """
+        if columns is None:
+            columns = self.schema.names
+        all_samples = set(self.sample_columns)
+        needed_samples = [c for c in columns if c in all_samples]
+        if not needed_samples or not any(self._needs_decoding):
+            return self.dataset.to_table(columns=columns, filter=filter,
+                                         use_threads=use_threads)
+
+        def read_fragment(i: int) -> pa.Table:
+            fragment = self.fragments[i]
+            if not self._needs_decoding[i]:
+                return fragment.to_table(schema=self.schema, columns=columns, filter=filter)
+            # Decoding needs whole row groups, filter only after decoding
+            physical = fragment.physical_schema
+            codec, _ = codec_from_metadata(physical.metadata)
+            own_samples = get_sample_columns(physical.names)
+            present = set(own_samples)
+            missing = [c for c in needed_samples if c not in present]
+            if codec.delta == 'sample':
+                last = max((int(c) for c in needed_samples if c in present), default=-1)
+                read_samples = own_samples[:last + 1]
+            else:
+                read_samples = [c for c in needed_samples if c in present]
+            read_cols = [c for c in self.schema.names if c not in all_samples] + read_samples
+            tables = []
+            for row_group in fragment.split_by_row_group(filter, schema=self.schema):
+                table = _decode_table(row_group.to_table(schema=self.schema, columns=read_cols)
+                                      .replace_schema_metadata(physical.metadata))
+                if filter is not None:
+                    table = table.filter(filter)
+                for c in missing:
+                    table = table.append_column(
+                        c, pa.nulls(table.num_rows, self.schema.field(c).type))
+                tables.append(table.select(columns))
+            if not tables:
+                return self.schema.empty_table().select(columns)
+            return pa.concat_tables(tables)
+
+        if use_threads:
+            with ThreadPoolExecutor(self._max_workers) as pool:
+                tables = list(pool.map(read_fragment, range(len(self.fragments))))
+        else:
+            tables = [read_fragment(i) for i in range(len(self.fragments))]
+        if not tables:
+            return self.schema.empty_table().select(columns)
+        return pa.concat_tables([t.cast(tables[0].schema) for t in tables])
+
+    def frame_counts(self, filter: Union[ds.Expression, None] = None) -> pa.Table:
+        """Number of frames per recording and tx_rx_id."""
+        table = self.dataset.to_table(columns=['recording', 'tx_rx_id'], filter=filter)
+        counts = table.group_by(['recording', 'tx_rx_id']).aggregate([('tx_rx_id', 'count')])
+        return pa.table({'recording': counts['recording'], 'tx_rx_id': counts['tx_rx_id'],
+                         'frames': counts['tx_rx_id_count']}) \
+            .sort_by([('recording', 'ascending'), ('tx_rx_id', 'ascending')])
+
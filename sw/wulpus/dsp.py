@@ -0,0 +1,103 @@
+"""
+Batch signal processing of ultrasound frames.
+
+All functions take (n_frames, n_samples) arrays, or any array with the
+samples on the last axis, so a whole recording (`RecordingData.samples`) or
+a live batch is processed in one vectorized call. Results are float64.
+
+    bandpass   zero-phase equiripple FIR bandpass (taps cached per band)
+    envelope   magnitude of the analytic signal (Hilbert transform)
+    decimate   anti-aliased, zero-phase downsampling
+    tgc        time gain compensation, later echoes are amplified
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Tuple, Union
+
+import numpy as np
+import scipy.signal as ss
+
+# Same filter as the jupyter notebook GUI
+DEFAULT_NUM_TAPS = 31
+DEFAULT_TRANS_WIDTH = 0.2e6
+
+Band = Tuple[float, float]
+
+
+def default_band(sampling_freq: float) -> Band:
+    """10% to 90% of the Nyquist frequency."""
+    return sampling_freq / 2 * 0.1, sampling_freq / 2 * 0.9
+
+
+@lru_cache(maxsize=64)
+def bandpass_taps(sampling_freq: float, low_hz: float, high_hz: float,
+                  num_taps: int = DEFAULT_NUM_TAPS,
+                  trans_width: float = DEFAULT_TRANS_WIDTH) -> np.ndarray:
+    """Equiripple (remez) FIR bandpass, designed once per sampling frequency and band."""
+    nyquist = sampling_freq / 2
+    if not 0 < low_hz < high_hz < nyquist:
+        raise ValueError(f"Band {low_hz}-{high_hz} Hz must be within 0-{nyquist} Hz")
+    # Narrow the transition bands if the band is close to 0 Hz or the Nyquist frequency
+    trans_width = min(trans_width, low_hz / 2, (nyquist - high_hz) / 2)
+    taps = ss.remez(num_taps,
+                    [0, low_hz - trans_width, low_hz, high_hz, high_hz + trans_width, nyquist],
+                    [0, 1, 0], fs=sampling_freq, maxiter=2500)
+    # Cached and shared, so make sure nobody changes it
+    taps.setflags(write=False)
+    return taps
+
+
+def bandpass(samples: np.ndarray, taps: np.ndarray) -> np.ndarray:
+    """Zero-phase filter every frame of `samples` (frames, num_samples)."""
+    num_samples = samples.shape[-1]
+    if num_samples < 2:
+        return samples.astype(np.float64)
+    return ss.filtfilt(taps, 1, samples, axis=-1,
+                       padlen=min(3 * len(taps), num_samples - 1))
+
+
+def bandpass_filter(samples: np.ndarray, sampling_freq: float,
+                    band: Union[Band, None] = None,
+                    num_taps: int = DEFAULT_NUM_TAPS) -> np.ndarray:
+    """Bandpass every frame with the (cached) filter for `band`, the default band if None."""
+    low_hz, high_hz = default_band(sampling_freq) if band is None else band
+    return bandpass(samples, bandpass_taps(sampling_freq, low_hz, high_hz, num_taps))
+
+
+def envelope(samples: np.ndarray) -> np.ndarray:
+    """Envelope of every frame, the magnitude of the analytic signal."""
+    return np.abs(ss.hilbert(samples, axis=-1))
+
+
+def decimate(samples: np.ndarray, factor: int) -> np.ndarray:
+    """Keep every `factor`-th sample after a zero-phase anti-aliasing FIR lowpass.
+
+    The sampling frequency of the result is sampling_freq / factor.
+    """
+    if factor < 1:
+        raise ValueError("The decimation factor has to be at least 1")
+    if factor == 1:
+        return samples.astype(np.float64)
+    return ss.decimate(samples, factor, ftype='fir', axis=-1, zero_phase=True)
+
+
+@lru_cache(maxsize=64)
+def tgc_gain(num_samples: int, sampling_freq: float, db_per_us: float,
+             max_db: Union[float, None] = None) -> np.ndarray:
+    """Linear gain of every sample, rising by `db_per_us` per us after the start of the frame.
+
+    The gain is capped at `max_db`, if given.
+    """
+    gain_db = np.arange(num_samples) / sampling_freq * 1e6 * db_per_us
+    if max_db is not None:
+        np.minimum(gain_db, max_db, out=gain_db)
+    gain = 10 ** (gain_db / 20)
+    gain.setflags(write=False)
+    return gain
+
+
+def tgc(samples: np.ndarray, sampling_freq: float, db_per_us: float,
+        max_db: Union[float, None] = None) -> np.ndarray:
+    """Time gain compensation, makes up for the attenuation of echoes from deeper tissue."""
+    return samples * tgc_gain(samples.shape[-1], sampling_freq, db_per_us, max_db)
@@ -0,0 +1,142 @@
+"""
+Stream a slice of a recording in analysis formats.
+
+All writers read the recording one row group at a time (`Recording.iter_chunks`)
+and yield encoded bytes per chunk, so the full result is never in memory.
+
+    arrow  Arrow IPC stream, columns time, acq_nr, tx_rx_id and samples
+           (fixed size list of int16), config json in the schema metadata
+    npy    one structured array with the fields time, acq_nr, tx_rx_id and
+           samples (int16, num_samples), np.load(...)['samples'] is (frames, samples)
+    csv    time, acq_nr, tx_rx_id and one column per sample
+"""
+from __future__ import annotations
+
+import io
+from typing import Iterable, Iterator, Literal, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from wulpus.helper import RecordingData
+from wulpus.recording import Range, Recording
+
+EXPORT_FORMAT = Literal['arrow', 'npy', 'csv']
+
+MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'npy': 'application/octet-stream',
+    'csv': 'text/csv',
+}
+FILE_EXTENSIONS = {'arrow': '.arrows', 'npy': '.npy', 'csv': '.csv'}
+
+
+class ExportSlice:
+    """Selection of a recording to export, see `Recording.read` for the ranges.
+
+    `decimate` keeps every n-th of the selected frames.
+    """
+
+    def __init__(self,
+                 time_range: Union[Range, None] = None,
+                 tx_rx_ids: Union[Iterable[int], None] = None,
+                 sample_crop: Union[slice, None] = None,
+                 decimate: int = 1):
+        if decimate < 1:
+            raise ValueError("decimate has to be at least 1")
+        self.time_range = time_range
+        self.tx_rx_ids = None if tx_rx_ids is None else list(tx_rx_ids)
+        self.sample_crop = sample_crop
+        self.decimate = decimate
+
+    def iter_chunks(self, rec: Recording, sample_crop: Union[slice, None] = None) -> Iterator[RecordingData]:
+        if sample_crop is None:
+            sample_crop = self.sample_crop
+        seen = 0
+        for chunk in rec.iter_chunks(time_range=self.time_range, tx_rx_ids=self.tx_rx_ids,
+                                     sample_crop=sample_crop):
+            if self.decimate > 1:
+                # Keep the stride across chunk borders
+                keep = slice((-seen) % self.decimate, None, self.decimate)
+                seen += len(chunk.time)
+                chunk = chunk._replace(samples=chunk.samples[keep], acq_nr=chunk.acq_nr[keep],
+                                       tx_rx_id=chunk.tx_rx_id[keep], time=chunk.time[keep])
+            if len(chunk.time) > 0:
+                yield chunk
+
+    def count_frames(self, rec: Recording) -> int:
+        """Number of exported frames, reads no sample columns."""
+        return sum(len(c.time) for c in self.iter_chunks(rec, slice(0, 0)))
+
+    def num_samples(self, rec: Recording) -> int:
+        crop = self.sample_crop or slice(None)
+        return len(range(rec.num_samples)[crop])
+
+
+def _chunk_table(chunk: RecordingData, num_samples: int) -> pa.Table:
+    samples = pa.FixedSizeListArray.from_arrays(
+        pa.array(np.ascontiguousarray(chunk.samples).ravel()), num_samples)
+    return pa.table({'time': chunk.time, 'acq_nr': chunk.acq_nr,
+                     'tx_rx_id': chunk.tx_rx_id, 'samples': samples})
+
+
+def export_arrow(rec: Recording, selection: ExportSlice) -> Iterator[bytes]:
+    num_samples = selection.num_samples(rec)
+    schema = pa.schema([('time', pa.uint64()), ('acq_nr', pa.uint16()),
+                        ('tx_rx_id', pa.uint8()),
+                        ('samples', pa.list_(pa.int16(), num_samples))],
+                       metadata={'wulpus.config': rec.config.model_dump_json()})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk in selection.iter_chunks(rec):
+            writer.write_table(_chunk_table(chunk, num_samples))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def export_npy(rec: Recording, selection: ExportSlice) -> Iterator[bytes]:
+    num_samples = selection.num_samples(rec)
+    dtype = np.dtype([('time', '<u8'), ('acq_nr', '<u2'), ('tx_rx_id', 'u1'),
+                      ('samples', '<i2', (num_samples,))])
+    header = io.BytesIO()
+    # The header needs the shape, so the frames are counted first (metadata columns only)
+    np.lib.format.write_array_header_1_0(header, {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': (selection.count_frames(rec),),
+    })
+    yield header.getvalue()
+    for chunk in selection.iter_chunks(rec):
+        out = np.empty(len(chunk.time), dtype=dtype)
+        out['time'] = chunk.time
+        out['acq_nr'] = chunk.acq_nr
+        out['tx_rx_id'] = chunk.tx_rx_id
+        out['samples'] = chunk.samples
+        yield out.tobytes()
+
+
+def export_csv(rec: Recording, selection: ExportSlice) -> Iterator[bytes]:
+    sample_names = [str(i) for i in range(rec.num_samples)][selection.sample_crop or slice(None)]
+    include_header = True
+    for chunk in selection.iter_chunks(rec):
+        columns = {'time': chunk.time, 'acq_nr': chunk.acq_nr, 'tx_rx_id': chunk.tx_rx_id}
+        columns.update(zip(sample_names, np.asfortranarray(chunk.samples).T))
+        sink = io.BytesIO()
+        pa_csv.write_csv(pa.table(columns), sink,
+                         pa_csv.WriteOptions(include_header=include_header))
+        include_header = False
+        yield sink.getvalue()
+    if include_header:
+        yield (','.join(['time', 'acq_nr', 'tx_rx_id'] + sample_names) + '\n').encode('utf-8')
+
+
+EXPORTERS = {'arrow': export_arrow, 'npy': export_npy, 'csv': export_csv}
+
+
+def export_recording(path: str, export_format: EXPORT_FORMAT,
+                     selection: ExportSlice) -> Iterator[bytes]:
+    """Yield the selected part of a recording encoded as `export_format`."""
+    with Recording(path) as rec:
+        yield from EXPORTERS[export_format](rec, selection)
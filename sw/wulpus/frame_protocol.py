@@ -0,0 +1,248 @@
+"""
+Wire format of live frames sent over the WebSocket.
+
+The format is negotiated per client with the WebSocket subprotocol. Clients
+that offer `wulpus.binary.v1` get binary messages, all others (including
+clients that don't offer any subprotocol) get the JSON `Measurement`.
+Status and other messages stay JSON text in both cases.
+
+Binary frame message (little-endian):
+
+    offset  type    field
+    0       uint8   message type (1 = frame)
+    1       uint8   protocol version (1)
+    2       uint8   sample dtype (1 = int16)
+    3       uint8   tx_rx_id
+    4       uint8   TX channel bitmask
+    5       uint8   RX channel bitmask
+    6       uint16  number of samples
+    8       uint32  sequence number
+    12      uint64  time in us since epoch
+    20      int16[] samples
+
+Decimated frames (dtype 2) carry the number of points instead of samples,
+followed by the uint16 sample index of every point and then the int16
+values.
+
+Frames are sent in batches, a batch message is a header followed by the
+frame messages back to back (each one is self-describing):
+
+    0       uint8   message type (2 = batch)
+    1       uint8   protocol version (1)
+    2       uint16  stream (0 = raw, 1 = filtered, 2 = envelope)
+    4       uint32  number of frames
+
+Frames that a client missed are announced by a gap message before the next
+batch:
+
+    0       uint8   message type (3 = gap)
+    1       uint8   protocol version (1)
+    2       uint16  reserved
+    4       uint32  first missing sequence number
+    8       uint32  last missing sequence number
+
+B-mode images (uint8, one row per tx_rx_id, 255 = brightest) are:
+
+    0       uint8   message type (4 = B-mode image)
+    1       uint8   protocol version (1)
+    2       uint16  rows
+    4       uint16  columns (samples)
+    6       uint16  dynamic range in dB
+    8       uint64  time of the latest frame in us since epoch
+    16      uint8[] image, row by row
+
+In JSON these are {"type": "batch", "stream": "raw", "frames": [Measurement, ...]},
+{"type": "gap", "from_seq": ..., "to_seq": ...} and
+{"type": "bmode", "time": ..., "dynamic_range_db": ..., "image": [[...], ...]}.
+"""
+from __future__ import annotations
+
+import json
+import struct
+from typing import (Iterable, List, Literal, NamedTuple, Tuple, TypedDict,
+                    Union, get_args)
+
+import numpy as np
+
+PROTOCOL_BINARY = 'wulpus.binary.v1'
+PROTOCOL_JSON = 'wulpus.json'
+# In order of preference
+SUPPORTED_PROTOCOLS = (PROTOCOL_BINARY, PROTOCOL_JSON)
+
+BINARY_VERSION = 1
+MSG_FRAME = 1
+MSG_BATCH = 2
+MSG_GAP = 3
+MSG_BMODE = 4
+DTYPE_INT16 = 1
+DTYPE_INT16_INDEXED = 2
+
+FRAME_HEADER = struct.Struct('<BBBBBBHIQ')
+BATCH_HEADER = struct.Struct('<BBHI')
+GAP_MESSAGE = struct.Struct('<BBHII')
+BMODE_HEADER = struct.Struct('<BBHHHQ')
+
+# Raw samples, bandpass filtered samples or their envelope
+LIVE_STREAM = Literal['raw', 'filtered', 'envelope']
+STREAM_IDS = {stream: i for i, stream in enumerate(get_args(LIVE_STREAM))}
+
+
+class _MeasurementFields(TypedDict):
+    data: list[float]
+    time: int
+    tx: list[int]
+    rx: list[int]
+    seq: int
+    tx_rx_id: int
+
+
+class Measurement(_MeasurementFields, total=False):
+    # Sample index of every value, only for decimated frames
+    index: List[int]
+
+
+class LiveFrame(NamedTuple):
+    """One received frame, kept as NumPy until it is encoded for a client."""
+    seq: int
+    time: int
+    tx_rx_id: int
+    data: np.ndarray
+    tx: List[int]
+    rx: List[int]
+    # Sample index of every value if the frame was decimated
+    index: Union[np.ndarray, None] = None
+
+
+def select_protocol(offered: Iterable[str]) -> Union[str, None]:
+    """Pick the subprotocol to accept, None if the client didn't offer a known one."""
+    offered = list(offered)
+    for protocol in SUPPORTED_PROTOCOLS:
+        if protocol in offered:
+            return protocol
+    return None
+
+
+def channel_mask(channels: Union[Iterable[int], None]) -> int:
+    """Bitmask of the channels, 0 for an empty or missing channel list."""
+    mask = 0
+    for ch in channels or ():
+        mask |= 1 << ch
+    return mask
+
+
+def encode_binary(frame: LiveFrame) -> bytes:
+    samples = np.ascontiguousarray(frame.data, dtype='<i2')
+    dtype = DTYPE_INT16 if frame.index is None else DTYPE_INT16_INDEXED
+    header = FRAME_HEADER.pack(MSG_FRAME, BINARY_VERSION, dtype, frame.tx_rx_id,
+                               channel_mask(frame.tx), channel_mask(frame.rx),
+                               len(samples), frame.seq & 0xFFFFFFFF, frame.time)
+    if frame.index is None:
+        return header + samples.tobytes()
+    return header + np.asarray(frame.index, dtype='<u2').tobytes() + samples.tobytes()
+
+
+def to_measurement(frame: LiveFrame) -> Measurement:
+    measurement = Measurement(data=frame.data.tolist(), time=int(frame.time),
+                              tx=list(frame.tx or []), rx=list(frame.rx or []),
+                              seq=frame.seq, tx_rx_id=frame.tx_rx_id)
+    if frame.index is not None:
+        measurement['index'] = frame.index.tolist()
+    return measurement
+
+
+def encode_json(frame: LiveFrame) -> str:
+    return json.dumps(to_measurement(frame))
+
+
+def encode_frame(frame: LiveFrame, protocol: str) -> Union[bytes, str]:
+    """Encode a frame for a client, bytes for binary messages and str for text messages."""
+    if protocol == PROTOCOL_BINARY:
+        return encode_binary(frame)
+    return encode_json(frame)
+
+
+def encode_batch(frames: List[LiveFrame], protocol: str,
+                 stream: LIVE_STREAM = 'raw') -> Union[bytes, str]:
+    if protocol == PROTOCOL_BINARY:
+        header = BATCH_HEADER.pack(MSG_BATCH, BINARY_VERSION, STREAM_IDS[stream], len(frames))
+        return b''.join([header] + [encode_binary(frame) for frame in frames])
+    return json.dumps({'type': 'batch', 'stream': stream,
+                       'frames': [to_measurement(f) for f in frames]})
+
+
+def encode_gap(from_seq: int, to_seq: int, protocol: str) -> Union[bytes, str]:
+    if protocol == PROTOCOL_BINARY:
+        return GAP_MESSAGE.pack(MSG_GAP, BINARY_VERSION, 0,
+                                from_seq & 0xFFFFFFFF, to_seq & 0xFFFFFFFF)
+    return json.dumps({'type': 'gap', 'from_seq': from_seq, 'to_seq': to_seq})
+
+
+def encode_bmode(image: np.ndarray, time: int, dynamic_range_db: float,
+                 protocol: str) -> Union[bytes, str]:
+    if protocol == PROTOCOL_BINARY:
+        rows, columns = image.shape
+        header = BMODE_HEADER.pack(MSG_BMODE, BINARY_VERSION, rows, columns,
+                                   round(dynamic_range_db), int(time))
+        return header + np.ascontiguousarray(image, dtype=np.uint8).tobytes()
+    return json.dumps({'type': 'bmode', 'time': int(time),
+                       'dynamic_range_db': dynamic_range_db, 'image': image.tolist()})
+
+
+def decode_bmode(message: bytes) -> Tuple[np.ndarray, int, int]:
+    """Inverse of the binary `encode_bmode`, returns (image, time, dynamic_range_db)."""
+    msg_type, version, rows, columns, dynamic_range_db, time = BMODE_HEADER.unpack_from(message, 0)
+    if msg_type != MSG_BMODE or version != BINARY_VERSION:
+        raise ValueError("Not a B-mode message")
+    image = np.frombuffer(message, dtype=np.uint8, count=rows * columns,
+                          offset=BMODE_HEADER.size).reshape(rows, columns)
+    return image, time, dynamic_range_db
+
+
+def decode_binary(message: bytes, offset: int = 0) -> LiveFrame:
+    """Inverse of `encode_binary` (for Python clients and tests)."""
+    (msg_type, version, dtype, tx_rx_id, tx_mask, rx_mask,
+     num_samples, seq, time) = FRAME_HEADER.unpack_from(message, offset)
+    if msg_type != MSG_FRAME or version != BINARY_VERSION or \
+            dtype not in (DTYPE_INT16, DTYPE_INT16_INDEXED):
+        raise ValueError("Unsupported frame message")
+    offset += FRAME_HEADER.size
+    index = None
+    if dtype == DTYPE_INT16_INDEXED:
+        index = np.frombuffer(message, dtype='<u2', count=num_samples, offset=offset)
+        offset += 2 * num_samples
+    data = np.frombuffer(message, dtype='<i2', count=num_samples, offset=offset)
+    return LiveFrame(seq=seq, time=time, tx_rx_id=tx_rx_id, data=data,
+                     tx=[ch for ch in range(8) if tx_mask >> ch & 1],
+                     rx=[ch for ch in range(8) if rx_mask >> ch & 1], index=index)
+
+
+def encoded_size(frame: LiveFrame) -> int:
+    """Size of the binary message of a frame."""
+    points = 2 * len(frame.data)
+    return FRAME_HEADER.size + (points if frame.index is None else 2 * points)
+
+
+def decode_message(message: bytes) -> Union[List[LiveFrame], Tuple[int, int]]:
+    """Decode a binary message into its frames, or (from_seq, to_seq) for a gap.
+
+    Use `message_stream` for the stream of a batch.
+    """
+    msg_type = message[0]
+    if msg_type == MSG_GAP:
+        _, _, _, from_seq, to_seq = GAP_MESSAGE.unpack_from(message, 0)
+        return from_seq, to_seq
+    if msg_type == MSG_BATCH:
+        _, _, _, count = BATCH_HEADER.unpack_from(message, 0)
+        frames, offset = [], BATCH_HEADER.size
+        for _ in range(count):
+            frame = decode_binary(message, offset)
+            frames.append(frame)
+            offset += encoded_size(frame)
+        return frames
+    return [decode_binary(message)]
+
+
+def message_stream(message: bytes) -> LIVE_STREAM:
+    """Stream of a binary batch message."""
+    _, _, stream_id, _ = BATCH_HEADER.unpack_from(message, 0)
+    return get_args(LIVE_STREAM)[stream_id]
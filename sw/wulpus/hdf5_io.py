@@ -0,0 +1,152 @@
+"""
+Export recordings to HDF5 (PyTables) and import them back.
+
+Layout of an exported file:
+
+    /frames         int16 EArray (num_frames, num_samples), chunked along frames
+    /frame_info     Table with time (us since epoch), acq_nr and tx_rx_id per frame
+    /tx_rx_config   Table with the TX/RX configs, channel lists padded with -1
+    root attributes format, version, config (WulpusConfig json) and us_config fields
+
+Only standard HDF5 filters (zlib + shuffle) are used by default, so the files
+can be read by h5py, MATLAB and others without plugins. Both directions work
+one chunk at a time, so memory use doesn't depend on the recording length.
+
+    python -m wulpus.hdf5_io export wulpus/measurements/data_0.zip
+    python -m wulpus.hdf5_io import data_0.h5 --out data_0.zip
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from typing import Iterator, Union
+
+import numpy as np
+import tables
+from wulpus.helper import RecordingData
+from wulpus.recording import ROW_GROUP_SIZE, Recording, RecordingWriter
+from wulpus.recording_codec import DEFAULT_CODEC, RecordingCodec
+from wulpus.wulpus_config_models import MAX_CH_ID, WulpusConfig
+
+HDF5_EXTENSION = '.h5'
+HDF5_FORMAT = 'wulpus-hdf5'
+HDF5_FORMAT_VERSION = 1
+
+# Frames per HDF5 chunk (and per read/write step)
+CHUNK_FRAMES = ROW_GROUP_SIZE
+
+DEFAULT_FILTERS = tables.Filters(complevel=4, complib='zlib', shuffle=True)
+
+
+class FrameInfo(tables.IsDescription):
+    time = tables.UInt64Col(pos=0)
+    acq_nr = tables.UInt16Col(pos=1)
+    tx_rx_id = tables.UInt8Col(pos=2)
+
+
+class TxRxConfigRow(tables.IsDescription):
+    config_id = tables.UInt8Col(pos=0)
+    tx_channels = tables.Int8Col(shape=(MAX_CH_ID + 1,), pos=1)
+    rx_channels = tables.Int8Col(shape=(MAX_CH_ID + 1,), pos=2)
+    optimized_switching = tables.BoolCol(pos=3)
+
+
+def _padded_channels(channels) -> np.ndarray:
+    padded = np.full(MAX_CH_ID + 1, -1, dtype=np.int8)
+    padded[:len(channels)] = channels
+    return padded
+
+
+def export_hdf5(zip_path: str, h5_path: Union[str, None] = None,
+                filters: tables.Filters = DEFAULT_FILTERS) -> str:
+    """Convert a measurement zip into an HDF5 file, one row group at a time.
+
+    Returns:
+        str: The path of the written file.
+    """
+    if h5_path is None:
+        h5_path = os.path.splitext(zip_path)[0] + HDF5_EXTENSION
+    with Recording(zip_path) as rec, tables.open_file(h5_path, 'w') as h5:
+        config = rec.config
+        attrs = h5.root._v_attrs
+        attrs.format = HDF5_FORMAT
+        attrs.version = HDF5_FORMAT_VERSION
+        attrs.config = config.model_dump_json()
+        for name, value in config.us_config.model_dump().items():
+            setattr(attrs, name, value)
+
+        tx_rx = h5.create_table('/', 'tx_rx_config', TxRxConfigRow,
+                                "TX/RX configs (channels padded with -1)")
+        for cfg in config.tx_rx_config:
+            tx_rx.append([(cfg.config_id, _padded_channels(cfg.tx_channels),
+                           _padded_channels(cfg.rx_channels), cfg.optimized_switching)])
+
+        frames = h5.create_earray('/', 'frames', tables.Int16Atom(),
+                                  shape=(0, rec.num_samples), title="Samples per frame",
+                                  filters=filters, expectedrows=rec.num_frames,
+                                  chunkshape=(CHUNK_FRAMES, max(rec.num_samples, 1)))
+        frame_info = h5.create_table('/', 'frame_info', FrameInfo, "Metadata per frame",
+                                     filters=filters, expectedrows=rec.num_frames)
+        for chunk in rec.iter_chunks():
+            frames.append(chunk.samples)
+            info = np.empty(len(chunk.time), dtype=frame_info.dtype)
+            info['time'] = chunk.time
+            info['acq_nr'] = chunk.acq_nr
+            info['tx_rx_id'] = chunk.tx_rx_id
+            frame_info.append(info)
+    return h5_path
+
+
+def iter_hdf5_chunks(h5_path: str, chunk_frames: int = CHUNK_FRAMES) -> Iterator[RecordingData]:
+    """Yield the frames of an exported HDF5 file in chunks."""
+    with tables.open_file(h5_path, 'r') as h5:
+        attrs = h5.root._v_attrs
+        if getattr(attrs, 'format', None) != HDF5_FORMAT:
+            raise ValueError(f"{h5_path} is not a wulpus HDF5 export")
+        config = WulpusConfig.model_validate_json(attrs.config)
+        frames = h5.root.frames
+        frame_info = h5.root.frame_info
+        for start in range(0, frames.nrows, chunk_frames):
+            stop = min(start + chunk_frames, frames.nrows)
+            info = frame_info.read(start, stop)
+            yield RecordingData(samples=np.ascontiguousarray(frames[start:stop], dtype='<i2'),
+                                acq_nr=info['acq_nr'].astype('<u2'),
+                                tx_rx_id=info['tx_rx_id'].astype(np.uint8),
+                                time=info['time'].astype(np.uint64),
+                                config=config)
+
+
+def import_hdf5(h5_path: str, zip_path: Union[str, None] = None,
+                codec: RecordingCodec = DEFAULT_CODEC) -> str:
+    """Convert an exported HDF5 file back into a measurement zip.
+
+    Returns:
+        str: The path of the written zip.
+    """
+    if zip_path is None:
+        zip_path = os.path.splitext(h5_path)[0] + '.zip'
+    with tables.open_file(h5_path, 'r') as h5:
+        config = WulpusConfig.model_validate_json(h5.root._v_attrs.config)
+    with RecordingWriter(zip_path, config, codec) as writer:
+        for chunk in iter_hdf5_chunks(h5_path):
+            writer.write(chunk)
+    return zip_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert recordings between the zip and the HDF5 format.")
+    parser.add_argument('direction', choices=['export', 'import'],
+                        help="export: zip -> HDF5, import: HDF5 -> zip")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--out', help="output path (only with a single input file)")
+    args = parser.parse_args()
+    if args.out is not None and len(args.files) > 1:
+        parser.error("--out can only be used with a single input file")
+
+    for file in args.files:
+        if args.direction == 'export':
+            out = export_hdf5(file, args.out)
+        else:
+            out = import_hdf5(file, args.out)
+        print(f"{file} -> {out}")
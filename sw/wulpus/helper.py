@@ -2,15 +2,18 @@ from __future__ import annotations
 
 import glob
 import inspect
-import io
 import json
 import os
-from typing import Tuple
-from zipfile import ZipFile
+import struct
+from typing import Iterable, List, NamedTuple, Tuple, Union
+from zipfile import ZIP_STORED, ZipFile
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from fastapi import HTTPException
+from wulpus.recording_codec import codec_from_metadata, decode_samples
 from wulpus.wulpus_config_models import WulpusConfig
 
 import wulpus as wulpus_pkg
@@ -38,35 +41,148 @@ def check_if_filereq_is_legitimate(req_name: str, system_dir: str, allowed_endin
     return path
 
 
-def zip_to_dataframe(path: str) -> Tuple[pd.DataFrame, object]:
-    with ZipFile(path, 'r') as zf:
-        config_raw = json.loads(zf.read('config-0.json').decode('utf-8'))
-        df_flat = pd.read_parquet(io.BytesIO(zf.read('data.parquet')))
+# Columns created by save, everything else is a sample column
+META_COLUMNS = ('tx', 'rx', 'aq_number', 'tx_rx_id', 'log_version')
 
-    # Columns created by save
-    meta_cols = {'tx', 'rx', 'aq_number', 'tx_rx_id', 'log_version'}
-    sample_cols = [c for c in df_flat.columns if c not in meta_cols]
 
-    # Ensure numeric order for sample columns (they were saved as strings)
-    sample_cols = sorted(sample_cols, key=lambda c: int(c))
+class RecordingData(NamedTuple):
+    """Plain NumPy view of a recording.
 
-    # Rebuild `measurement` as a Series per row
-    measurements = list(
-        pd.Series(row[sample_cols].to_numpy(copy=False))
-        for _, row in df_flat.iterrows()
+    samples has shape (n_frames, n_samples), all other arrays have length n_frames.
+    tx, rx (object arrays of channel lists) and log_version hold the stored
+    columns if they were read, otherwise they are rebuilt from the config.
+    """
+    samples: np.ndarray
+    acq_nr: np.ndarray
+    tx_rx_id: np.ndarray
+    time: np.ndarray
+    config: WulpusConfig
+    tx: Union[np.ndarray, None] = None
+    rx: Union[np.ndarray, None] = None
+    log_version: Union[np.ndarray, None] = None
+    # Name of the time index in the DataFrame view
+    time_name: Union[str, None] = None
+
+    def channels(self, name: str) -> list:
+        """Per-frame 'tx' or 'rx' channel lists, looked up in the config if not stored."""
+        stored = getattr(self, name)
+        if stored is not None:
+            return list(stored)
+        lists = [getattr(cfg, name + '_channels') for cfg in self.config.tx_rx_config]
+        return [lists[i] for i in self.tx_rx_id]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Build the (slow) DataFrame view with one `measurement` Series per row."""
+        return pd.DataFrame({
+            'measurement': [pd.Series(row) for row in self.samples],
+            'tx': self.channels('tx'),
+            'rx': self.channels('rx'),
+            'aq_number': self.acq_nr,
+            'tx_rx_id': self.tx_rx_id,
+            'log_version': (self.log_version if self.log_version is not None
+                            else np.full(len(self.acq_nr), 1, dtype=int)),
+        }, index=pd.Index(self.time, name=self.time_name))
+
+
+def get_sample_columns(column_names: Iterable[str]) -> List[str]:
+    """Return the sample columns of a saved recording in numeric order."""
+    return sorted((c for c in column_names
+                   if c not in META_COLUMNS and c.isdigit()), key=int)
+
+
+def get_time_column(schema: pa.Schema) -> Union[str, None]:
+    """Return the name of the column holding the timestamps (the pandas index)."""
+    pandas_meta = schema.pandas_metadata or {}
+    for col in pandas_meta.get('index_columns', []):
+        if isinstance(col, str) and col in schema.names:
+            return col
+    return None
+
+
+def get_time_name(schema: pa.Schema, time_col: Union[str, None]) -> Union[str, None]:
+    """Return the pandas name of the time index (None if it was unnamed)."""
+    pandas_meta = schema.pandas_metadata or {}
+    for col in pandas_meta.get('columns', []):
+        if col.get('field_name') == time_col:
+            return col.get('name')
+    return None
+
+
+def table_to_recording_data(table: pa.Table, config: WulpusConfig,
+                            time_col: Union[str, None] = None) -> RecordingData:
+    """Convert a recording table into NumPy arrays without any per-row Python work.
+
+    Delta encoded samples are decoded, so `table` has to start at a row-group boundary.
+    The tx, rx and log_version columns are kept if `table` has them.
+    """
+    n_frames = table.num_rows
+    sample_cols = get_sample_columns(table.column_names)
+    samples = np.empty((n_frames, len(sample_cols)), dtype='<i2')
+    for i, col in enumerate(sample_cols):
+        samples[:, i] = table.column(col).to_numpy()
+
+    names = table.column_names
+    if time_col is None:
+        time_col = get_time_column(table.schema)
+    # Without tx_rx_ids every frame counts as its own config, so they may exceed uint8
+    tx_rx_id = table.column('tx_rx_id').to_numpy().astype(np.uint8) \
+        if 'tx_rx_id' in names else np.arange(n_frames, dtype=np.int64)
+    codec, segment = codec_from_metadata(table.schema.metadata)
+    return RecordingData(
+        samples=decode_samples(samples, tx_rx_id, codec, segment),
+        acq_nr=table.column('aq_number').to_numpy().astype('<u2'),
+        tx_rx_id=tx_rx_id,
+        time=(table.column(time_col).to_numpy().astype(np.uint64)
+              if time_col in names else np.arange(n_frames, dtype=np.uint64)),
+        config=config,
+        tx=table.column('tx').to_numpy() if 'tx' in names else None,
+        rx=table.column('rx').to_numpy() if 'rx' in names else None,
+        log_version=table.column('log_version').to_numpy() if 'log_version' in names else None,
+        time_name=get_time_name(table.schema, time_col),
     )
 
-    df = pd.DataFrame({
-        'measurement': measurements,
-        'tx': df_flat['tx'].tolist(),
-        'rx': df_flat['rx'].tolist(),
-        'aq_number': df_flat['aq_number'].to_numpy(),
-        'tx_rx_id': df_flat['tx_rx_id'].to_numpy() if 'tx_rx_id' in df_flat else np.arange(len(df_flat)),
-        'log_version': df_flat['log_version'].to_numpy() if 'log_version' in df_flat else np.full(len(df_flat), 1, dtype=int),
-    }, index=df_flat.index)
-
-    config = WulpusConfig.model_validate(config_raw)
-    return df, config
+
+# Size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def open_zip_member(path: str, name: str) -> pa.NativeFile:
+    """Open a member of a zip as a seekable pyarrow file.
+
+    Stored (uncompressed) members are a zero-copy view on a memory map of the
+    zip, so readers only touch the bytes they need. Compressed members of old
+    recordings are inflated into memory. The zip itself is closed before
+    returning; the map is released with the returned reader and the buffers
+    read from it, so drop them to unlock the file (on Windows).
+    """
+    with ZipFile(path, 'r') as zf:
+        info = zf.getinfo(name)
+        if info.compress_type != ZIP_STORED:
+            return pa.BufferReader(zf.read(name))
+
+    with pa.memory_map(path, 'r') as source:
+        source.seek(info.header_offset)
+        header = _ZIP_LOCAL_HEADER.unpack(source.read(_ZIP_LOCAL_HEADER.size))
+        if header[0] != b'PK\x03\x04':
+            raise ValueError(f"Bad zip local header for {name} in {path}")
+        name_len, extra_len = header[9], header[10]
+        source.seek(info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len)
+        # The buffer keeps the mapped region alive after the file is closed
+        member = source.read_buffer(info.file_size)
+    return pa.BufferReader(member)
+
+
+def load_recording(path: str) -> RecordingData:
+    """Load a measurement zip straight into NumPy arrays."""
+    with ZipFile(path, 'r') as zf:
+        config = WulpusConfig.model_validate_json(zf.read('config-0.json'))
+    table = pq.read_table(open_zip_member(path, 'data.parquet'))
+    return table_to_recording_data(table, config)
+
+
+def zip_to_dataframe(path: str) -> Tuple[pd.DataFrame, object]:
+    data = load_recording(path)
+    return data.to_dataframe(), data.config
 
 
 def find_latest_measurement_zip() -> str:
@@ -0,0 +1,122 @@
+"""
+Live frames over plain HTTP, for consumers that don't speak WebSocket.
+
+The response is chunked and only ends when the client disconnects. Every
+`interval` the frames that arrived since the last chunk are read from the
+frame log, so sequence numbers, gaps and tx_rx_id/stream filtering are the
+same as on the WebSocket (see `websocket_manager.Subscription`).
+
+    ndjson  one message per line, the same messages as the WebSocket JSON
+            protocol: {"type": "batch", "stream": ..., "frames": [...]} and
+            {"type": "gap", "from_seq": ..., "to_seq": ...}
+    arrow   Arrow IPC stream, one record batch per stream and interval with
+            the columns seq, time, tx_rx_id, stream and samples (list of
+            int16); missing frames show as a jump in seq
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+from typing import AsyncIterator, List, Literal, Union
+
+import numpy as np
+import pyarrow as pa
+from wulpus.frame_protocol import (LIVE_STREAM, PROTOCOL_JSON, LiveFrame,
+                                   encode_batch, encode_gap)
+from wulpus.live_stream import BatchStreams, Gap
+from wulpus.websocket_manager import (MAX_BATCH_FRAMES, Subscription,
+                                      WebsocketManager)
+
+LIVE_HTTP_FORMAT = Literal['ndjson', 'arrow']
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Seconds between two chunks
+DEFAULT_INTERVAL = 0.1
+MIN_INTERVAL = 0.01
+
+ARROW_SCHEMA = pa.schema([('seq', pa.uint64()), ('time', pa.uint64()),
+                          ('tx_rx_id', pa.uint8()), ('stream', pa.string()),
+                          ('samples', pa.list_(pa.int16()))])
+
+
+class NdjsonEncoder:
+    def start(self) -> bytes:
+        return b''
+
+    def gap(self, gap: Gap) -> bytes:
+        return encode_gap(gap[0], gap[1], PROTOCOL_JSON).encode('utf-8') + b'\n'
+
+    def batch(self, frames: List[LiveFrame], stream: LIVE_STREAM) -> bytes:
+        return encode_batch(frames, PROTOCOL_JSON, stream).encode('utf-8') + b'\n'
+
+
+class ArrowEncoder:
+    def __init__(self):
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, ARROW_SCHEMA)
+
+    def _flush(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def start(self) -> bytes:
+        return self._flush()
+
+    def gap(self, gap: Gap) -> bytes:
+        return b''
+
+    def batch(self, frames: List[LiveFrame], stream: LIVE_STREAM) -> bytes:
+        lengths = np.array([len(f.data) for f in frames])
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+        samples = pa.ListArray.from_arrays(
+            pa.array(offsets), pa.array(np.concatenate([f.data for f in frames]), pa.int16()))
+        self._writer.write_batch(pa.record_batch([
+            pa.array([f.seq for f in frames], pa.uint64()),
+            pa.array([f.time for f in frames], pa.uint64()),
+            pa.array([f.tx_rx_id for f in frames], pa.uint8()),
+            pa.array([stream] * len(frames), pa.string()),
+            samples,
+        ], schema=ARROW_SCHEMA))
+        return self._flush()
+
+
+async def stream_live(manager: WebsocketManager, subscription: Subscription,
+                      live_format: LIVE_HTTP_FORMAT = 'ndjson',
+                      interval: float = DEFAULT_INTERVAL,
+                      from_seq: Union[int, None] = None) -> AsyncIterator[bytes]:
+    """Yield live frames as `live_format`, from `from_seq` on (None = from now on).
+
+    Only `streams`, `tx_rx_ids` and the band of the subscription apply, the
+    frames are always sent at full resolution. Frames that left the frame
+    log before they could be sent are reported as a gap.
+    """
+    encoder = ArrowEncoder() if live_format == 'arrow' else NdjsonEncoder()
+    yield encoder.start()
+    next_seq = manager.get_wulpus().get_frame_log().next_seq
+    if from_seq is not None:
+        next_seq = min(from_seq, next_seq)
+    while True:
+        frames, gap = manager.get_wulpus().get_frame_log().since(next_seq, MAX_BATCH_FRAMES)
+        chunk = []
+        if gap is not None:
+            chunk.append(encoder.gap(gap))
+            next_seq = gap[1] + 1
+        if frames:
+            next_seq = frames[-1].seq + 1
+            selected = [f for f in frames if subscription.wants(f)]
+            streams = BatchStreams(selected, manager.sampling_freq())
+            for stream in dict.fromkeys(subscription.streams) if selected else ():
+                if stream != 'raw' and streams.sampling_freq is None:
+                    continue
+                chunk.append(encoder.batch(streams.get(stream, subscription.band), stream))
+        if chunk:
+            yield b''.join(chunk)
+        # A full batch means the consumer is behind, continue right away
+        if len(frames) < MAX_BATCH_FRAMES:
+            await asyncio.sleep(interval)
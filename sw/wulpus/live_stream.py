@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from wulpus.dsp import Band, bandpass, bandpass_taps, default_band, envelope
+from wulpus.frame_protocol import LIVE_STREAM, LiveFrame
+
+# Frames kept for clients that fall behind between two sends
+DEFAULT_LOG_SIZE = 4096
+# Recent frames a new client gets on connect
+DEFAULT_BACKFILL_FRAMES = 64
+
+# Inclusive range of sequence numbers that were lost
+Gap = Tuple[int, int]
+
+# B-mode images are sent at this rate (Hz) if they changed
+BMODE_RATE = 10.0
+DEFAULT_DYNAMIC_RANGE_DB = 40.0
+
+
+class FrameLog:
+    """Ring buffer of the latest live frames, numbered without holes.
+
+    Shared by all Wulpus instances (real and mock), so sequence numbers stay
+    monotonic when the server switches between them. The latest frame of
+    every tx_rx_id is kept as well, even if it dropped out of the buffer.
+    """
+
+    def __init__(self, size: int = DEFAULT_LOG_SIZE):
+        self._frames: deque[LiveFrame] = deque(maxlen=size)
+        self._latest: Dict[int, LiveFrame] = {}
+        self.next_seq = 0
+
+    def append(self, frame: LiveFrame) -> LiveFrame:
+        """Store a frame under the next sequence number and return it."""
+        frame = frame._replace(seq=self.next_seq)
+        self._frames.append(frame)
+        self._latest[frame.tx_rx_id] = frame
+        self.next_seq += 1
+        return frame
+
+    @property
+    def first_seq(self) -> int:
+        return self._frames[0].seq if self._frames else self.next_seq
+
+    def since(self, seq: int, limit: Union[int, None] = None) -> Tuple[List[LiveFrame], Union[Gap, None]]:
+        """Return the frames from `seq` on (at most `limit`).
+
+        If frames before the oldest retained one were requested, the missing
+        range is returned as gap.
+        """
+        gap = None
+        first = self.first_seq
+        if seq < first:
+            gap = (seq, first - 1)
+            seq = first
+        start = seq - first
+        stop = len(self._frames) if limit is None else min(len(self._frames), start + limit)
+        return list(islice(self._frames, start, stop)), gap
+
+    def backfill(self, count: int) -> List[LiveFrame]:
+        """The last `count` frames plus the latest frame of every tx_rx_id, in sequence order."""
+        count = min(count, len(self._frames))
+        recent = list(islice(self._frames, len(self._frames) - count, None))
+        first = recent[0].seq if recent else self.next_seq
+        older = [f for f in self._latest.values() if f.seq < first]
+        return sorted(older, key=lambda f: f.seq) + recent
+
+
+def m4_decimate(samples: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Min/max preserving (M4) decimation of frames to `width` pixel columns.
+
+    `samples` is (frames, num_samples). Every column keeps its first, minimum,
+    maximum and last sample, so a line plot of the result draws the same
+    pixels as one of the full frame. Returns (indices, values), both
+    (frames, 4 * columns), indices into the original samples in ascending
+    order. Frames that are short enough are returned unchanged.
+    """
+    num_frames, num_samples = samples.shape
+    if num_samples <= 4 * width:
+        return np.broadcast_to(np.arange(num_samples), samples.shape), samples
+    per_column = -(-num_samples // width)
+    columns = -(-num_samples // per_column)
+    # Pad the last column with the last sample, it never wins against the real one
+    padded = np.pad(samples, ((0, 0), (0, columns * per_column - num_samples)), mode='edge')
+    blocks = padded.reshape(num_frames, columns, per_column)
+    start = np.arange(columns) * per_column
+    indices = np.empty((num_frames, columns, 4), dtype=np.int64)
+    indices[:, :, 0] = start
+    indices[:, :, 1] = start + blocks.argmin(axis=2)
+    indices[:, :, 2] = start + blocks.argmax(axis=2)
+    indices[:, :, 3] = np.minimum(start + per_column, num_samples) - 1
+    indices = np.minimum(indices, num_samples - 1)
+    indices.sort(axis=2)
+    indices = indices.reshape(num_frames, 4 * columns)
+    return indices, np.take_along_axis(samples, indices, axis=1)
+
+
+def decimate_frames(frames: List[LiveFrame], width: Union[int, None]) -> List[LiveFrame]:
+    """Decimate a batch of frames for a client that plots `width` pixels wide (None = full)."""
+    if not width:
+        return frames
+    out = list(frames)
+    # Frames of one measurement have the same length, so this is usually one group
+    lengths = np.array([len(f.data) for f in frames])
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        if length <= 4 * width:
+            continue
+        indices, values = m4_decimate(np.stack([frames[i].data for i in group]), width)
+        for row, i in enumerate(group):
+            out[i] = frames[i]._replace(data=values[row], index=indices[row])
+    return out
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    info = np.iinfo(np.int16)
+    return np.clip(np.rint(samples), info.min, info.max).astype('<i2')
+
+
+def _apply_stacked(arrays: List[np.ndarray], func) -> List[np.ndarray]:
+    """Apply `func` to stacks of equally long arrays (frames, samples), rows in input order."""
+    out = [None] * len(arrays)
+    lengths = np.array([len(a) for a in arrays])
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        result = func(np.stack([arrays[i] for i in group]))
+        for row, i in enumerate(group):
+            out[i] = result[row]
+    return out
+
+
+class BatchStreams:
+    """The streams clients subscribed to for one batch of frames.
+
+    Every (stream, band) is computed at most once per batch, vectorized over
+    all frames of the same length, and decimated at most once per width.
+    Filtered and envelope frames are rounded to int16 like the raw samples.
+    """
+
+    def __init__(self, frames: List[LiveFrame], sampling_freq: Union[float, None]):
+        self.frames = frames
+        self.sampling_freq = sampling_freq
+        self._streams: Dict[tuple, List[LiveFrame]] = {}
+        self._filtered: Dict[Band, List[np.ndarray]] = {}
+
+    def resolve_band(self, band: Union[Band, None]) -> Union[Band, None]:
+        """The band to filter with, the default band if none or one outside 0 Hz to Nyquist is given."""
+        if self.sampling_freq is None:
+            return None
+        if band is None or not 0 < band[0] < band[1] < self.sampling_freq / 2:
+            return default_band(self.sampling_freq)
+        return band
+
+    def _bandpassed(self, band: Band) -> List[np.ndarray]:
+        if band not in self._filtered:
+            taps = bandpass_taps(self.sampling_freq, *band)
+            self._filtered[band] = _apply_stacked(
+                [f.data for f in self.frames], lambda x: bandpass(x, taps))
+        return self._filtered[band]
+
+    def get(self, stream: LIVE_STREAM, band: Union[Band, None] = None,
+            width: Union[int, None] = None) -> List[LiveFrame]:
+        """Frames of a stream, min/max decimated to `width` if given."""
+        band = self.resolve_band(band) if stream != 'raw' else None
+        key = (stream, band, width)
+        if key in self._streams:
+            return self._streams[key]
+        if width:
+            frames = decimate_frames(self.get(stream, band), width)
+        elif stream == 'raw':
+            frames = self.frames
+        elif band is None:
+            raise ValueError("Filtered streams need the sampling frequency")
+        else:
+            derived = self._bandpassed(band)
+            if stream == 'envelope':
+                derived = _apply_stacked(derived, envelope)
+            frames = [f._replace(data=_to_int16(d)) for f, d in zip(self.frames, derived)]
+        self._streams[key] = frames
+        return frames
+
+
+class BModeImage:
+    """Latest envelope per tx_rx_id, one image row each (like the notebook GUI's B-mode).
+
+    `version` increments on every update, so senders can skip unchanged images.
+    """
+
+    def __init__(self):
+        self._rows: Dict[int, np.ndarray] = {}
+        self.time = 0
+        self.version = 0
+
+    def update(self, envelope_frames: List[LiveFrame]):
+        if not envelope_frames:
+            return
+        for frame in envelope_frames:
+            # A new measurement with another length starts a new image
+            if self._rows and len(frame.data) != len(next(iter(self._rows.values()))):
+                self._rows.clear()
+            self._rows[frame.tx_rx_id] = frame.data
+        self.time = envelope_frames[-1].time
+        self.version += 1
+
+    def render(self, dynamic_range_db: float = DEFAULT_DYNAMIC_RANGE_DB) -> np.ndarray:
+        """Log-compressed image (tx_rx_ids, samples) quantized to uint8.
+
+        0 dB is the brightest pixel of the image, everything `dynamic_range_db`
+        below it is black. Rows of tx_rx_ids without a frame are black.
+        """
+        if not self._rows:
+            return np.zeros((0, 0), dtype=np.uint8)
+        image = np.zeros((max(self._rows) + 1, len(next(iter(self._rows.values())))),
+                         dtype=np.float32)
+        for tx_rx_id, row in self._rows.items():
+            image[tx_rx_id] = row
+        np.maximum(image, 1, out=image)
+        db = 20 * np.log10(image / image.max())
+        scaled = (db + dynamic_range_db) * (255 / dynamic_range_db)
+        return np.clip(np.rint(scaled), 0, 255).astype(np.uint8)
@@ -0,0 +1,235 @@
+"""
+Load test of the live WebSocket fan-out.
+
+    python -m wulpus.loadtest --clients 20 --slow 2 --rate 200 --duration 20
+
+Starts the server (uvicorn) in a subprocess, opens the clients and lets the
+mock replay a synthetic recording at `--rate` frames per second (or
+`--recording`, a file in the measurements folder, at `--speed`). Slow
+clients sleep `--slow-delay` seconds after every message. Reported per
+client: delivered frames per second, latency percentiles, frames announced
+as dropped (gap messages) and received MB/s, and the CPU load of the server
+process (psutil if installed, /proc otherwise).
+
+Latency is measured against the replay schedule: a frame is due at its
+recorded time divided by the speed, relative to the fastest delivery any
+client saw. So it includes the server falling behind the schedule, but not
+the constant part of the delay. All clients run in this process, compare
+against a run with fewer clients before blaming the server.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List, Union
+from urllib.error import URLError
+
+import numpy as np
+from websockets.asyncio.client import connect
+from wulpus.frame_protocol import (MSG_BATCH, MSG_FRAME, MSG_GAP,
+                                   PROTOCOL_BINARY, decode_message)
+from wulpus.helper import RecordingData
+from wulpus.recording import Recording, write_recording
+from wulpus.wulpus_api import DATA_FILE_EXTENSION
+from wulpus.wulpus_config_models import TxRxConfig, UsConfig, WulpusConfig
+
+import wulpus as wulpus_pkg
+
+MEASUREMENTS_DIR = os.path.join(os.path.dirname(inspect.getfile(wulpus_pkg)), 'measurements')
+SYNTHETIC_RECORDING = 'loadtest-synthetic' + DATA_FILE_EXTENSION
+SERVER_STARTUP_TIMEOUT = 30.0
+
+
+def write_synthetic_recording(path: str, num_frames: int, rate: float,
+                              num_samples: int = 400, num_tx_rx_ids: int = 4):
+    """Random frames, cycling through the tx_rx_ids, recorded at `rate` frames per second."""
+    rng = np.random.default_rng(0)
+    config = WulpusConfig(
+        tx_rx_config=[TxRxConfig(config_id=i) for i in range(num_tx_rx_ids)],
+        us_config=UsConfig(num_txrx_configs=num_tx_rx_ids, num_acqs=num_frames,
+                           num_samples=num_samples))
+    index = np.arange(num_frames)
+    start_us = int(time.time() * 1e6)
+    write_recording(path, RecordingData(
+        samples=rng.integers(-1000, 1000, (num_frames, num_samples), dtype='<i2'),
+        acq_nr=(index % 65536).astype('<u2'),
+        tx_rx_id=(index % num_tx_rx_ids).astype(np.uint8),
+        time=(start_us + index * 1e6 / rate).astype(np.uint64),
+        config=config))
+
+
+def cpu_seconds(pid: int) -> Union[float, None]:
+    """User + system CPU time of a process, None if it can't be read on this platform."""
+    try:
+        import psutil
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except ImportError:
+        pass
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the command name, utime and stime are the 14th and 15th field
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError):
+        return None
+
+
+def _post(url: str):
+    request = urllib.request.Request(url, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def start_server(port: int) -> subprocess.Popen:
+    package_root = os.path.dirname(os.path.dirname(inspect.getfile(wulpus_pkg)))
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'wulpus.main:app',
+                             '--port', str(port), '--log-level', 'warning'],
+                            cwd=package_root)
+
+
+def wait_for_server(base_url: str, process: subprocess.Popen):
+    deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{base_url}/api/configs").read()
+            return
+        except URLError:
+            time.sleep(0.2)
+    raise TimeoutError("Server did not start")
+
+
+class ClientStats:
+    def __init__(self, name: str, slow_delay: float):
+        self.name = name
+        self.slow_delay = slow_delay
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.last_seq = -1
+        # Receive time minus due time (relative to the first recorded frame) of every frame
+        self.offsets: List[float] = []
+
+    def add(self, received: float, frames, first_time: int, speed: float):
+        for frame in frames:
+            # Other streams of the same frames carry the same seq
+            if frame.seq <= self.last_seq:
+                continue
+            self.last_seq = frame.seq
+            self.frames += 1
+            self.offsets.append(received - (frame.time - first_time) / 1e6 / speed)
+
+
+async def run_client(url: str, stats: ClientStats, first_time: int, speed: float):
+    async with connect(url, subprotocols=[PROTOCOL_BINARY], max_size=None) as websocket:
+        async for message in websocket:
+            received = time.perf_counter()
+            stats.bytes += len(message)
+            if isinstance(message, bytes):
+                if message[0] == MSG_GAP:
+                    from_seq, to_seq = decode_message(message)
+                    stats.dropped += to_seq - from_seq + 1
+                elif message[0] in (MSG_FRAME, MSG_BATCH):
+                    stats.add(received, decode_message(message), first_time, speed)
+            if stats.slow_delay:
+                await asyncio.sleep(stats.slow_delay)
+
+
+def report(clients: List[ClientStats], duration: float, cpu: Union[float, None]):
+    offsets = [o for c in clients for o in c.offsets]
+    anchor = min(offsets) if offsets else 0.0
+    published = max((c.last_seq for c in clients), default=-1) + 1
+    print(f"{'client':<12}{'frames/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>9}{'dropped':>9}{'MB/s':>8}")
+    for c in clients:
+        if c.offsets:
+            latency = (np.array(c.offsets) - anchor) * 1e3
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+            worst = latency.max()
+        else:
+            p50 = p95 = p99 = worst = float('nan')
+        print(f"{c.name:<12}{c.frames / duration:>10.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+              f"{worst:>9.1f}{c.dropped:>9}{c.bytes / 1e6 / duration:>8.2f}")
+    cpu_text = 'n/a' if cpu is None else f"{cpu / duration * 100:.0f}% of one core"
+    print(f"server: {published / duration:.1f} frames/s published, CPU {cpu_text}")
+
+
+async def run(args: argparse.Namespace):
+    base_url = f"http://127.0.0.1:{args.port}"
+    speed = args.speed
+    if args.recording is None:
+        filename = SYNTHETIC_RECORDING
+        path = os.path.join(MEASUREMENTS_DIR, filename)
+        # A few seconds more than needed, the replay must not end during the test
+        write_synthetic_recording(path, int(args.rate * (args.duration + 5)), args.rate,
+                                  args.samples, args.tx_rx_ids)
+    else:
+        filename = args.recording
+        path = os.path.join(MEASUREMENTS_DIR, filename)
+    with Recording(path) as recording:
+        first_time = recording.time_bounds()[0] or 0
+
+    server = start_server(args.port)
+    try:
+        await asyncio.to_thread(wait_for_server, base_url, server)
+        url = f"ws://127.0.0.1:{args.port}/ws?backfill=0"
+        if args.ws_query:
+            url += '&' + args.ws_query
+        clients = [ClientStats(f"slow-{i}" if i < args.slow else f"fast-{i}",
+                               args.slow_delay if i < args.slow else 0.0)
+                   for i in range(args.clients)]
+        tasks = [asyncio.create_task(run_client(url, c, first_time, speed)) for c in clients]
+        await asyncio.sleep(1.0)
+
+        # Returns when the replay starts
+        await asyncio.to_thread(_post, f"{base_url}/api/replay/{filename}?speed={speed}")
+        cpu_start, start = cpu_seconds(server.pid), time.perf_counter()
+        await asyncio.sleep(args.duration)
+        cpu_end, duration = cpu_seconds(server.pid), time.perf_counter() - start
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(_post, f"{base_url}/api/stop")
+        if args.recording is None:
+            os.remove(path)
+            await asyncio.to_thread(_post, f"{base_url}/api/logs/rescan")
+    finally:
+        server.terminate()
+        server.wait()
+        if args.recording is None and os.path.exists(path):
+            os.remove(path)
+
+    cpu = None if cpu_start is None or cpu_end is None else cpu_end - cpu_start
+    print(f"{args.clients} clients ({args.slow} slow), {duration:.1f} s")
+    report(clients, duration, cpu)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the live WebSocket fan-out.")
+    parser.add_argument('--clients', type=int, default=10, help="number of WebSocket clients")
+    parser.add_argument('--slow', type=int, default=0, help="how many of them are slow")
+    parser.add_argument('--slow-delay', type=float, default=0.2,
+                        help="seconds a slow client sleeps after every message")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to measure")
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help="frames per second of the synthetic recording")
+    parser.add_argument('--samples', type=int, default=400,
+                        help="samples per frame of the synthetic recording")
+    parser.add_argument('--tx-rx-ids', type=int, default=4,
+                        help="tx_rx_ids of the synthetic recording")
+    parser.add_argument('--recording', default=None,
+                        help="replay this file from the measurements folder instead")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed")
+    parser.add_argument('--ws-query', default='',
+                        help="extra /ws query parameters, e.g. 'width=1000&stream=envelope'")
+    parser.add_argument('--port', type=int, default=8123)
+    asyncio.run(run(parser.parse_args()))
@@ -3,16 +3,31 @@ import inspect
 import json
 import os
 import time
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Union
 
 import uvicorn
-from fastapi import (FastAPI, File, HTTPException, Request, UploadFile,
+from fastapi import (FastAPI, File, HTTPException, Query, Request, UploadFile,
                      WebSocket, WebSocketDisconnect)
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import ValidationError
+from wulpus.catalog import SORT_COLUMNS, RecordingCatalog, RecordingPage
+from wulpus.export import (EXPORT_FORMAT, FILE_EXTENSIONS, MEDIA_TYPES,
+                           ExportSlice, export_recording)
+from wulpus.frame_protocol import LIVE_STREAM
+from wulpus.preview import get_preview, preview_level
+from wulpus.replay import DEFAULT_SPEED, MIN_SPEED
 from wulpus.wulpus_api import CONFIG_FILE_EXTENSION, DATA_FILE_EXTENSION
 from wulpus.helper import check_if_filereq_is_legitimate, ensure_dir
-from wulpus.websocket_manager import WebsocketManager
+from wulpus.live_http import DEFAULT_INTERVAL, LIVE_HTTP_FORMAT, MIN_INTERVAL
+from wulpus.live_http import MEDIA_TYPES as LIVE_MEDIA_TYPES
+from wulpus.live_http import stream_live
+from wulpus.live_stream import (DEFAULT_BACKFILL_FRAMES, DEFAULT_DYNAMIC_RANGE_DB,
+                                FrameLog)
+from wulpus.websocket_manager import (DEFAULT_DROP_POLICY, DEFAULT_QUEUE_SIZE,
+                                      DROP_POLICY, Subscription,
+                                      WebsocketManager)
 from wulpus.wulpus_config_models import (ComPort, TxRxConfig, UsConfig,
                                          WulpusConfig)
 from wulpus.wulpus_mock import WulpusMock
@@ -27,12 +42,33 @@ CONFIG_DIR = os.path.join(os.path.dirname(
 FRONTEND_DIR = os.path.join(os.path.dirname(
     inspect.getfile(wulpus_pkg)), 'production-frontend')
 
+ensure_dir(MEASUREMENTS_DIR)
+catalog = RecordingCatalog(MEASUREMENTS_DIR)
+
 wulpus = Wulpus()
 wulpus_mock = WulpusMock()
+wulpus.set_recording_catalog(catalog)
+wulpus_mock.set_recording_catalog(catalog)
+# One sequence of live frames, no matter if they come from the device or the mock
+frame_log = FrameLog()
+wulpus.set_frame_log(frame_log)
+wulpus_mock.set_frame_log(frame_log)
 
 manager = WebsocketManager(wulpus)
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Backfill the catalog with recordings that were made while the server was not running
+    sync_task = asyncio.create_task(
+        asyncio.to_thread(catalog.sync, DATA_FILE_EXTENSION))
+    yield
+    sync_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 global_send_data_task = None
+global_send_bmode_task = None
+global_send_status_task = None
 
 
 @app.post("/api/start")
@@ -47,7 +83,7 @@ async def start(config: WulpusConfig):
 
 
 @app.post("/api/stop")
-def stop():
+async def stop():
     manager.get_wulpus().stop()
     return {"ok": "ok"}
 
@@ -68,10 +104,46 @@ def disconnect():
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    global global_send_data_task
-    await manager.connect(websocket)
-    asyncio.create_task(manager.send_status(websocket))
+async def websocket_endpoint(websocket: WebSocket,
+                             drop_policy: DROP_POLICY = DEFAULT_DROP_POLICY,
+                             queue_size: int = Query(DEFAULT_QUEUE_SIZE, ge=1, le=4096),
+                             width: Optional[int] = None,
+                             stream: List[LIVE_STREAM] = Query(['raw']),
+                             tx_rx_id: Optional[List[int]] = Query(None),
+                             low_hz: Optional[float] = None,
+                             high_hz: Optional[float] = None,
+                             bmode: bool = False,
+                             dynamic_range_db: float = DEFAULT_DYNAMIC_RANGE_DB,
+                             max_rate: Optional[float] = None,
+                             backfill: int = DEFAULT_BACKFILL_FRAMES):
+    """Live stream of sequenced frame batches.
+
+    The query parameters set the initial `Subscription`, a client changes it
+    by sending {"type": "subscribe", <fields to change>}, which is answered
+    with {"type": "subscribed", "subscription": {...}} or {"type": "error", ...}.
+
+    Frames a client can't keep up with are dropped per `drop_policy` and
+    announced with a gap message. With `width` (plot width in pixels) frames
+    longer than 4 * width are min/max decimated, with the sample index of
+    every point. `stream` selects raw, bandpass filtered (`low_hz` to
+    `high_hz`, default 10% to 90% of Nyquist) and envelope frames, each
+    stream is a separate batch message, `tx_rx_id` the tx_rx_ids. With
+    `bmode` the client gets the log-compressed B-mode image (latest envelope
+    per tx_rx_id) as uint8 at a fixed rate. On connect the client gets the
+    last `backfill` frames and the latest frame of every tx_rx_id.
+    """
+    global global_send_data_task, global_send_bmode_task, global_send_status_task
+    try:
+        subscription = Subscription(
+            streams=stream, tx_rx_ids=tx_rx_id, width=width, low_hz=low_hz, high_hz=high_hz,
+            bmode=bmode, dynamic_range_db=dynamic_range_db, max_rate=max_rate,
+            backfill=backfill)
+    except ValidationError as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    await manager.connect(websocket, drop_policy, queue_size, subscription)
+    if global_send_status_task is None or global_send_status_task.done():
+        global_send_status_task = asyncio.create_task(manager.send_status())
     if global_send_data_task is None or global_send_data_task.done():
         new_measurement_event = asyncio.Event()
 
@@ -80,30 +152,80 @@ async def websocket_endpoint(websocket: WebSocket):
 
         global_send_data_task = asyncio.create_task(
             manager.send_data(new_measurement_event))
+    if global_send_bmode_task is None or global_send_bmode_task.done():
+        global_send_bmode_task = asyncio.create_task(manager.send_bmode())
 
-    latest_frame = manager.get_wulpus().get_latest_frame()
-    if latest_frame is not None:
-        await manager.broadcast_json(latest_frame)
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.broadcast_text(f"Client says: {data}")
+            received = await websocket.receive()
+            if received['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(received.get('code', 1000))
+            try:
+                if received.get('text') is None:
+                    raise ValueError('Expected a text message')
+                message = json.loads(received['text'])
+                if not isinstance(message, dict) or message.pop('type', None) != 'subscribe':
+                    raise ValueError('Expected {"type": "subscribe", ...}')
+                subscription = manager.subscribe(websocket, message)
+                reply = {'type': 'subscribed', 'subscription': subscription.model_dump()}
+            except (ValueError, ValidationError) as e:  # includes invalid JSON
+                reply = {'type': 'error', 'detail': str(e)}
+            await manager.send_single_client(json.dumps(reply), websocket)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Also on unexpected errors, so the client's queue isn't fed forever
         manager.disconnect(websocket)
-        await manager.broadcast_text("A Client left the chat")
 
 
-@app.get("/api/logs", response_model=List[str])
-def list_logs() -> List[str]:
-    """Return list of saved measurement files (npz) relative names."""
-    ensure_dir(MEASUREMENTS_DIR)
+@app.get("/api/live")
+async def live_http(format: LIVE_HTTP_FORMAT = 'ndjson',
+                    interval: float = Query(DEFAULT_INTERVAL, ge=MIN_INTERVAL),
+                    from_seq: Optional[int] = Query(None, ge=0),
+                    stream: List[LIVE_STREAM] = Query(['raw']),
+                    tx_rx_id: Optional[List[int]] = Query(None),
+                    low_hz: Optional[float] = None,
+                    high_hz: Optional[float] = None):
+    """Chunked live stream for consumers without WebSocket, as NDJSON or Arrow IPC stream.
+
+    Every `interval` seconds the new frames are sent, with the same sequence
+    numbers, gaps, `stream`, `tx_rx_id` and band selection as /ws. Pass the
+    last received seq + 1 as `from_seq` to resume after a reconnect.
+    """
     try:
-        files = [f for f in os.listdir(
-            MEASUREMENTS_DIR) if f.lower().endswith(DATA_FILE_EXTENSION)]
-        files.sort(reverse=True)
-        return files
-    except FileNotFoundError:
-        return []
+        subscription = Subscription(streams=stream, tx_rx_ids=tx_rx_id,
+                                    low_hz=low_hz, high_hz=high_hz)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    return StreamingResponse(stream_live(manager, subscription, format, interval, from_seq),
+                             media_type=LIVE_MEDIA_TYPES[format])
+
+
+@app.get("/api/logs", response_model=RecordingPage)
+def list_logs(offset: int = Query(0, ge=0),
+              limit: int = Query(100, ge=1, le=1000),
+              sort: SORT_COLUMNS = 'filename',
+              order: Literal['asc', 'desc'] = 'desc',
+              name: Optional[str] = None,
+              start_after: Optional[int] = None,
+              start_before: Optional[int] = None,
+              min_frames: Optional[int] = None,
+              tx_rx_id: Optional[int] = None,
+              config_hash: Optional[str] = None) -> RecordingPage:
+    """Return one page of saved measurement files with their metadata from the catalog.
+
+    Timestamps (start_after, start_before) are in us since epoch.
+    """
+    return catalog.query(offset=offset, limit=limit, sort=sort, order=order, name=name,
+                         start_after=start_after, start_before=start_before,
+                         min_frames=min_frames, tx_rx_id=tx_rx_id, config_hash=config_hash)
+
+
+@app.post("/api/logs/rescan")
+async def rescan_logs():
+    """Re-scan the measurement folder for files added, changed or removed by hand."""
+    scanned = await asyncio.to_thread(catalog.sync, DATA_FILE_EXTENSION)
+    return {"scanned": scanned}
 
 
 @app.get("/logs/{filename}")
@@ -115,6 +237,49 @@ def download_log(filename: str):
     return FileResponse(filepath, media_type='application/octet-stream', filename=filename)
 
 
+@app.get("/api/logs/{filename}/export")
+def export_log(filename: str,
+               format: EXPORT_FORMAT = 'arrow',
+               start_time: Optional[int] = None,
+               end_time: Optional[int] = None,
+               tx_rx_id: Optional[List[int]] = Query(None),
+               sample_start: Optional[int] = Query(None, ge=0),
+               sample_stop: Optional[int] = Query(None, ge=0),
+               sample_step: int = Query(1, ge=1),
+               decimate: int = Query(1, ge=1)):
+    """Stream a slice of a recording as Arrow IPC stream, .npy or CSV.
+
+    Frames in [start_time, end_time) (us since epoch) with the given tx_rx_ids,
+    samples cropped to sample_start:sample_stop:sample_step and every
+    `decimate`-th frame. The response is generated row group by row group.
+    """
+    filepath = check_if_filereq_is_legitimate(
+        filename, MEASUREMENTS_DIR, DATA_FILE_EXTENSION)
+    selection = ExportSlice(time_range=(start_time, end_time), tx_rx_ids=tx_rx_id,
+                            sample_crop=slice(sample_start, sample_stop, sample_step),
+                            decimate=decimate)
+    export_name = os.path.splitext(filename)[0] + FILE_EXTENSIONS[format]
+    return StreamingResponse(
+        export_recording(filepath, format, selection), media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{export_name}"'})
+
+
+@app.get("/api/logs/{filename}/preview")
+async def log_preview(filename: str, tx_rx_id: Optional[int] = None,
+                      max_width: int = Query(256, ge=1)):
+    """Min/max overview of a recording for one tx_rx_id, (time bins x depth bins).
+
+    Computed once per recording and cached in the measurement folder.
+    """
+    filepath = check_if_filereq_is_legitimate(
+        filename, MEASUREMENTS_DIR, DATA_FILE_EXTENSION)
+    try:
+        preview = await asyncio.to_thread(get_preview, filepath)
+        return preview_level(preview, tx_rx_id, max_width)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+
+
 @app.get("/api/configs", response_model=List[str])
 def list_configs() -> List[str]:
     """Return list of saved config files (json) relative names."""
@@ -186,14 +351,51 @@ def activate_mock():
 
 
 @app.post("/api/deactivate-mock")
-def deactivate_mock():
+async def deactivate_mock():
     wulpus_mock.stop()
     manager.set_wulpus(wulpus)
     return {"ok": "ok"}
 
 
+@app.post("/api/replay-control")
+async def replay_control(speed: Union[float, Literal['max'], None] = None,
+                   paused: Optional[bool] = None,
+                   seek_index: Optional[int] = Query(None, ge=0),
+                   seek_time: Optional[int] = None):
+    """Change the running replay: speed (multiple of the recorded rate or 'max'),
+    pause/resume and seek to a frame index or a time (us since epoch).
+
+    Async, so the replay is changed on the event loop its `frames` runs on."""
+    replay = wulpus_mock.get_replay()
+    if replay is None:
+        raise HTTPException(status_code=409, detail="No replay running")
+    # Check everything before changing anything, so a rejected request has no effect
+    seek = seek_index is not None or seek_time is not None
+    try:
+        if speed is not None:
+            replay.check_speed(speed)
+        if seek:
+            seek_index = replay.seek_target(index=seek_index, time_us=seek_time)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if speed is not None:
+        replay.set_speed(speed)
+    if seek:
+        replay.seek(index=seek_index)
+    if paused:
+        replay.pause()
+    elif paused is not None:
+        replay.resume()
+    return {**replay.state(), "position": replay.position}
+
+
 @app.post("/api/replay/{filename}")
-async def replay_file(filename: str):
+async def replay_file(filename: str, speed: Union[float, Literal['max']] = DEFAULT_SPEED):
+    """Replay a recording through the mock, paced by its timestamps at `speed`
+    times the recorded rate ('max' = as fast as possible)."""
+    if speed != 'max' and speed < MIN_SPEED:
+        raise HTTPException(status_code=400,
+                            detail=f"Replay speed has to be at least {MIN_SPEED} or 'max'")
     # Build a minimal default config: one empty TxRxConfig and a UsConfig with its own defaults
     default_config = WulpusConfig(
         tx_rx_config=[TxRxConfig()], us_config=UsConfig())
@@ -203,7 +405,7 @@ async def replay_file(filename: str):
     filepath = check_if_filereq_is_legitimate(
         filename, MEASUREMENTS_DIR, DATA_FILE_EXTENSION)
     wulpus_mock.set_config(default_config)
-    wulpus_mock.set_replay_file(filepath)
+    wulpus_mock.set_replay_file(filepath, speed)
     await wulpus_mock.start()
 
 app.mount("/assets", StaticFiles(directory=os.path.join(FRONTEND_DIR,
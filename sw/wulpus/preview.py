@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, Union
+
+import numpy as np
+from wulpus.helper import RecordingData, ensure_dir
+from wulpus.recording import Recording
+
+# Previews are cached next to the recordings in this sub-folder
+PREVIEW_DIR = '.previews'
+PREVIEW_VERSION = 1
+
+# Size of the finest pyramid level per tx_rx_id (time bins x depth bins)
+MAX_TIME_BINS = 1024
+MAX_DEPTH_BINS = 128
+# Coarsening stops once both axes are at most this size
+MIN_LEVEL_SIZE = 8
+
+
+def _downsample(lo: np.ndarray, hi: np.ndarray):
+    """Merge 2x2 blocks of a min/max level (odd edges are kept as they are)."""
+    for axis in (0, 1):
+        if lo.shape[axis] <= 1:
+            continue
+        n = lo.shape[axis] // 2 * 2
+        even = [slice(None)] * 2
+        odd = [slice(None)] * 2
+        even[axis] = slice(0, n, 2)
+        odd[axis] = slice(1, n, 2)
+        rest = [slice(None)] * 2
+        rest[axis] = slice(n, None)
+        lo = np.concatenate([np.minimum(lo[tuple(even)], lo[tuple(odd)]),
+                             lo[tuple(rest)]], axis=axis)
+        hi = np.concatenate([np.maximum(hi[tuple(even)], hi[tuple(odd)]),
+                             hi[tuple(rest)]], axis=axis)
+    return lo, hi
+
+
+class PreviewBuilder:
+    """Streaming min/max envelope overview, one pyramid per tx_rx_id.
+
+    Frames are fed in acquisition order with `add`, so a whole recording can
+    be reduced chunk by chunk.
+    """
+
+    def __init__(self, frame_counts: Dict[int, int], num_samples: int):
+        self.samples_per_bin = max(1, -(-num_samples // MAX_DEPTH_BINS))
+        self.depth_edges = np.arange(0, num_samples, self.samples_per_bin)
+        n_depth = len(self.depth_edges)
+        self.frames_per_bin = {}
+        self._seen = {}
+        self._min = {}
+        self._max = {}
+        self._time = {}
+        for tx_rx_id, count in frame_counts.items():
+            per_bin = max(1, -(-count // MAX_TIME_BINS))
+            n_bins = max(1, -(-count // per_bin))
+            self.frames_per_bin[tx_rx_id] = per_bin
+            self._seen[tx_rx_id] = 0
+            self._min[tx_rx_id] = np.full((n_bins, n_depth), np.iinfo(np.int16).max, dtype=np.int16)
+            self._max[tx_rx_id] = np.full((n_bins, n_depth), np.iinfo(np.int16).min, dtype=np.int16)
+            self._time[tx_rx_id] = np.zeros(n_bins, dtype=np.uint64)
+
+    def add(self, chunk: RecordingData):
+        if len(self.depth_edges) == 0:
+            return
+        for tx_rx_id in np.unique(chunk.tx_rx_id):
+            tx_rx_id = int(tx_rx_id)
+            if tx_rx_id not in self.frames_per_bin:
+                continue
+            sel = chunk.tx_rx_id == tx_rx_id
+            frames = chunk.samples[sel]
+            per_bin = self.frames_per_bin[tx_rx_id]
+            idx = self._seen[tx_rx_id] + np.arange(len(frames))
+            bins = idx // per_bin
+
+            depth_min = np.minimum.reduceat(frames, self.depth_edges, axis=1)
+            depth_max = np.maximum.reduceat(frames, self.depth_edges, axis=1)
+            starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+            used = bins[starts]
+            acc_min, acc_max = self._min[tx_rx_id], self._max[tx_rx_id]
+            acc_min[used] = np.minimum(acc_min[used],
+                                       np.minimum.reduceat(depth_min, starts, axis=0))
+            acc_max[used] = np.maximum(acc_max[used],
+                                       np.maximum.reduceat(depth_max, starts, axis=0))
+            first_in_bin = idx % per_bin == 0
+            self._time[tx_rx_id][bins[first_in_bin]] = chunk.time[sel][first_in_bin]
+            self._seen[tx_rx_id] += len(frames)
+
+    def finish(self) -> Dict[str, np.ndarray]:
+        """Return the preview as flat dict of arrays (the npz layout)."""
+        out = {
+            'version': np.array(PREVIEW_VERSION),
+            'tx_rx_ids': np.array(sorted(self._min), dtype=np.int64),
+            'samples_per_bin': np.array(self.samples_per_bin),
+        }
+        for tx_rx_id in self._min:
+            seen = self._seen[tx_rx_id]
+            n_bins = max(1, -(-seen // self.frames_per_bin[tx_rx_id]))
+            lo = self._min[tx_rx_id][:n_bins]
+            hi = self._max[tx_rx_id][:n_bins]
+            out[f'frames_per_bin_{tx_rx_id}'] = np.array(self.frames_per_bin[tx_rx_id])
+            out[f'time_{tx_rx_id}'] = self._time[tx_rx_id][:n_bins]
+            level = 0
+            while True:
+                out[f'min_{tx_rx_id}_{level}'] = lo
+                out[f'max_{tx_rx_id}_{level}'] = hi
+                if max(lo.shape) <= MIN_LEVEL_SIZE:
+                    break
+                lo, hi = _downsample(lo, hi)
+                level += 1
+            out[f'levels_{tx_rx_id}'] = np.array(level + 1)
+        return out
+
+
+def compute_preview(data: RecordingData) -> Dict[str, np.ndarray]:
+    """Compute the preview of recording data that is already in memory."""
+    ids, counts = np.unique(data.tx_rx_id, return_counts=True)
+    builder = PreviewBuilder(dict(zip(ids.tolist(), counts.tolist())),
+                             data.samples.shape[1])
+    builder.add(data)
+    return builder.finish()
+
+
+def compute_preview_from_file(path: str) -> Dict[str, np.ndarray]:
+    """Compute the preview of a recording zip, one row group at a time."""
+    with Recording(path) as rec:
+        builder = PreviewBuilder(rec.frame_counts(), rec.num_samples)
+        for chunk in rec.iter_chunks():
+            builder.add(chunk)
+    return builder.finish()
+
+
+def preview_path(recording_path: str) -> str:
+    directory, filename = os.path.split(recording_path)
+    return os.path.join(directory, PREVIEW_DIR, filename + '.npz')
+
+
+def save_preview(recording_path: str, preview: Dict[str, np.ndarray]):
+    path = preview_path(recording_path)
+    ensure_dir(os.path.dirname(path))
+    # Write next to the target and rename, so readers never see half a file
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **preview)
+    os.replace(tmp_path, path)
+
+
+def load_preview(recording_path: str) -> Union[Dict[str, np.ndarray], None]:
+    """Return the cached preview, None if missing or older than the recording."""
+    path = preview_path(recording_path)
+    if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(recording_path):
+        return None
+    with np.load(path) as npz:
+        if int(npz['version']) != PREVIEW_VERSION:
+            return None
+        return {k: npz[k] for k in npz.files}
+
+
+def get_preview(recording_path: str) -> Dict[str, np.ndarray]:
+    """Return the cached preview of a recording, computing it if needed."""
+    preview = load_preview(recording_path)
+    if preview is None:
+        preview = compute_preview_from_file(recording_path)
+        save_preview(recording_path, preview)
+    return preview
+
+
+def preview_level(preview: Dict[str, np.ndarray], tx_rx_id: Union[int, None] = None,
+                  max_width: int = 256) -> dict:
+    """Pick the finest level of one tx_rx_id with at most `max_width` time bins.
+
+    min and max are (time bins, depth bins).
+    """
+    ids = preview['tx_rx_ids'].tolist()
+    if tx_rx_id is None:
+        if not ids:
+            raise ValueError("Recording has no frames")
+        tx_rx_id = ids[0]
+    if tx_rx_id not in ids:
+        raise ValueError(f"No frames with tx_rx_id {tx_rx_id}")
+    num_levels = int(preview[f'levels_{tx_rx_id}'])
+    level = 0
+    while level < num_levels - 1 and preview[f'min_{tx_rx_id}_{level}'].shape[0] > max_width:
+        level += 1
+    lo = preview[f'min_{tx_rx_id}_{level}']
+    scale = 2 ** level
+    return {
+        'tx_rx_ids': ids,
+        'tx_rx_id': tx_rx_id,
+        'level': level,
+        'num_levels': num_levels,
+        'frames_per_bin': int(preview[f'frames_per_bin_{tx_rx_id}']) * scale,
+        'samples_per_bin': int(preview['samples_per_bin']) * scale,
+        'time': preview[f'time_{tx_rx_id}'][::scale][:lo.shape[0]].tolist(),
+        'min': lo.tolist(),
+        'max': preview[f'max_{tx_rx_id}_{level}'].tolist(),
+    }
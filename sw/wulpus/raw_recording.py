@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+from wulpus.helper import RecordingData, ensure_dir, load_recording
+from wulpus.recording import Range
+from wulpus.wulpus_config_models import WulpusConfig
+
+RAW_RECORDING_EXTENSION = '.wulpusraw'
+RAW_FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+
+# name -> (file, little-endian dtype), samples is (num_frames, num_samples), all others (num_frames,)
+RAW_ARRAYS = {
+    'samples': ('samples.i16', '<i2'),
+    'acq_nr': ('acq_nr.u16', '<u2'),
+    'tx_rx_id': ('tx_rx_id.u8', 'u1'),
+    'time': ('time.u64', '<u8'),
+}
+# tx_rx_ids that don't fit in uint8 (recordings without them count the frames instead)
+WIDE_TX_RX_ID = ('tx_rx_id.i64', '<i8')
+
+
+def _array_spec(name: str, values: np.ndarray) -> Tuple[str, str]:
+    """File and dtype an array is stored with, wider than RAW_ARRAYS if its values need it."""
+    filename, dtype = RAW_ARRAYS[name]
+    if name == 'tx_rx_id' and len(values) > 0:
+        limits = np.iinfo(dtype)
+        if values.min() < limits.min or values.max() > limits.max:
+            return WIDE_TX_RX_ID
+    return filename, dtype
+
+
+def save_raw_recording(path: str, data: RecordingData) -> str:
+    """Write `data` as a raw recording directory.
+
+    The header is written last, so a directory without header.json is incomplete.
+
+    Returns:
+        str: The path of the written directory.
+    """
+    ensure_dir(path)
+    num_frames, num_samples = data.samples.shape
+    specs = {name: _array_spec(name, np.asarray(getattr(data, name))) for name in RAW_ARRAYS}
+    for name, (filename, dtype) in specs.items():
+        np.ascontiguousarray(getattr(data, name), dtype=dtype).tofile(
+            os.path.join(path, filename))
+
+    header = {
+        'format': 'wulpus-raw',
+        'version': RAW_FORMAT_VERSION,
+        'num_frames': num_frames,
+        'num_samples': num_samples,
+        'arrays': {name: {'file': filename, 'dtype': dtype}
+                   for name, (filename, dtype) in specs.items()},
+        'config': data.config.model_dump(),
+    }
+    with open(os.path.join(path, HEADER_FILE), 'w', encoding='utf-8') as f:
+        json.dump(header, f, indent=2)
+    return path
+
+
+class RawRecording:
+    """Memory-mapped raw recording.
+
+    Opening only parses the header, all arrays are `np.memmap`s in read-only
+    mode so pages are loaded on access and shared between processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        header_path = os.path.join(path, HEADER_FILE)
+        if not os.path.isfile(header_path):
+            raise FileNotFoundError(f"No raw recording header in {path}")
+        with open(header_path, 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get('format') != 'wulpus-raw' or self.header.get('version') != RAW_FORMAT_VERSION:
+            raise ValueError(f"Unsupported raw recording format in {path}")
+
+        self.config = WulpusConfig.model_validate(self.header['config'])
+        self.num_frames = self.header['num_frames']
+        self.num_samples = self.header['num_samples']
+
+        arrays = {}
+        for name, spec in self.header['arrays'].items():
+            shape = (self.num_frames, self.num_samples) if name == 'samples' \
+                else (self.num_frames,)
+            if self.num_frames == 0:
+                # np.memmap can't map empty files
+                arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                arrays[name] = np.memmap(os.path.join(path, spec['file']),
+                                         dtype=spec['dtype'], mode='r', shape=shape)
+        self.data = RecordingData(config=self.config, **arrays)
+
+    def read(self,
+             time_range: Union[Range, None] = None,
+             tx_rx_ids: Union[Iterable[int], None] = None,
+             acq_range: Union[Range, None] = None,
+             sample_crop: Union[int, slice, None] = None) -> RecordingData:
+        """Slice the recording, same arguments as `Recording.read`.
+
+        Time ranges and sample crops are zero-copy views, tx_rx_id and acquisition
+        filters copy the selected frames.
+        """
+        data = self.data
+        rows = slice(None)
+        if time_range is not None:
+            # Frames are stored in acquisition order, so timestamps are sorted
+            start, stop = time_range
+            lo = 0 if start is None else int(np.searchsorted(data.time, start, 'left'))
+            hi = self.num_frames if stop is None else int(
+                np.searchsorted(data.time, stop, 'left'))
+            rows = slice(lo, hi)
+
+        if tx_rx_ids is not None or acq_range is not None:
+            mask = np.ones(len(data.time[rows]), dtype=bool)
+            if tx_rx_ids is not None:
+                mask &= np.isin(data.tx_rx_id[rows], list(tx_rx_ids))
+            if acq_range is not None:
+                acq = data.acq_nr[rows]
+                if acq_range[0] is not None:
+                    mask &= acq >= acq_range[0]
+                if acq_range[1] is not None:
+                    mask &= acq < acq_range[1]
+            rows = np.arange(self.num_frames)[rows][mask]
+
+        if isinstance(sample_crop, int):
+            sample_crop = slice(0, sample_crop)
+        samples = data.samples[rows]
+        if sample_crop is not None:
+            samples = samples[:, sample_crop]
+        return RecordingData(samples=samples, acq_nr=data.acq_nr[rows],
+                             tx_rx_id=data.tx_rx_id[rows], time=data.time[rows],
+                             config=self.config)
+
+
+def convert_zip_to_raw(zip_path: str, out_path: Union[str, None] = None) -> str:
+    """Convert a measurement zip into a raw recording directory next to it."""
+    if out_path is None:
+        out_path = os.path.splitext(zip_path)[0] + RAW_RECORDING_EXTENSION
+    return save_raw_recording(out_path, load_recording(zip_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert measurement zips into memory-mappable raw recordings.")
+    parser.add_argument('files', nargs='+', help="measurement .zip files")
+    parser.add_argument('--out-dir', default=None,
+                        help="output directory (default: next to the input)")
+    args = parser.parse_args()
+    for file in args.files:
+        out = None
+        if args.out_dir is not None:
+            ensure_dir(args.out_dir)
+            out = os.path.join(args.out_dir, os.path.splitext(
+                os.path.basename(file))[0] + RAW_RECORDING_EXTENSION)
+        print('Converted ' + file + ' -> ' + convert_zip_to_raw(file, out))
@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple, Union
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from wulpus.helper import (RecordingData, get_sample_columns, get_time_column,
+                           open_zip_member, table_to_recording_data)
+from wulpus.recording_codec import (CODEC_METADATA_KEY, DEFAULT_CODEC,
+                                    RecordingCodec, codec_from_metadata,
+                                    encode_samples)
+from wulpus.wulpus_config_models import WulpusConfig
+
+# Frames per parquet row group. Smaller groups allow finer slicing, larger ones compress better.
+ROW_GROUP_SIZE = 1024
+
+CONFIG_MEMBER = 'config-0.json'
+DATA_MEMBER = 'data.parquet'
+# A recording is written next to its final path and renamed when complete
+TMP_EXTENSION = '.tmp'
+
+# Half-open [start, stop) range, either end may be None
+Range = Tuple[Union[int, None], Union[int, None]]
+
+
+def _in_range(values: np.ndarray, value_range: Range) -> np.ndarray:
+    start, stop = value_range
+    mask = np.ones(len(values), dtype=bool)
+    if start is not None:
+        mask &= values >= start
+    if stop is not None:
+        mask &= values < stop
+    return mask
+
+
+def _overlaps(stats_min, stats_max, value_range: Range) -> bool:
+    start, stop = value_range
+    if start is not None and stats_max < start:
+        return False
+    if stop is not None and stats_min >= stop:
+        return False
+    return True
+
+
+def recording_data_to_table(data: RecordingData,
+                            codec: RecordingCodec = DEFAULT_CODEC,
+                            segment: int = ROW_GROUP_SIZE) -> pa.Table:
+    """Build the parquet table of a recording (same layout as the pandas based writer)."""
+    num_frames, num_samples = data.samples.shape
+    samples = encode_samples(data.samples, data.tx_rx_id, codec, segment)
+    df = pd.DataFrame(samples, index=pd.Index(data.time, dtype=np.uint64, name=data.time_name),
+                      columns=[str(i) for i in range(num_samples)])
+    meta = pd.DataFrame({
+        'aq_number': data.acq_nr,
+        'log_version': (data.log_version if data.log_version is not None
+                        else np.full(num_frames, 1, dtype=np.int64)),
+        'tx_rx_id': data.tx_rx_id,
+    }, index=df.index)
+    table = pa.Table.from_pandas(pd.concat([meta, df], axis=1))
+
+    # Channel lists per frame, looked up from the config without a python loop
+    for name in ('rx', 'tx'):
+        stored = getattr(data, name)
+        if stored is not None:
+            table = table.add_column(0, name, pa.array(list(stored), type=pa.list_(pa.int64())))
+            continue
+        channels = [getattr(cfg, name + '_channels')
+                    for cfg in data.config.tx_rx_config]
+        lengths = np.array([len(c) for c in channels], dtype=np.int32)
+        padded = np.zeros((len(channels), max(lengths.max(), 1)), dtype=np.int64)
+        for i, c in enumerate(channels):
+            padded[i, :len(c)] = c
+        frame_lengths = lengths[data.tx_rx_id]
+        offsets = np.zeros(num_frames + 1, dtype=np.int32)
+        np.cumsum(frame_lengths, out=offsets[1:])
+        values = padded[data.tx_rx_id][np.arange(padded.shape[1]) < frame_lengths[:, None]]
+        table = table.add_column(0, name, pa.ListArray.from_arrays(
+            pa.array(offsets), pa.array(values, type=pa.int64())))
+
+    return table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        CODEC_METADATA_KEY: codec.to_metadata(segment),
+    })
+
+
+def _parquet_options(codec: RecordingCodec, column_names: List[str]) -> dict:
+    """Keyword arguments for the parquet writer of `codec`."""
+    # Page checksums let readers (and `wulpus.recover`) detect damaged row groups
+    kwargs = {'compression': codec.compression,
+              'compression_level': codec.level,
+              'write_page_checksum': True}
+    encoding = codec.column_encoding()
+    if encoding is not None:
+        sample_cols = get_sample_columns(column_names)
+        kwargs['use_dictionary'] = [c for c in column_names
+                                    if c not in sample_cols]
+        kwargs['column_encoding'] = {c: encoding for c in sample_cols}
+    return kwargs
+
+
+def write_parquet(sink: Union[str, BinaryIO], data: RecordingData,
+                  codec: RecordingCodec = DEFAULT_CODEC,
+                  row_group_size: int = ROW_GROUP_SIZE):
+    """Write the recording data as parquet with the given codec."""
+    table = recording_data_to_table(data, codec, row_group_size)
+    pq.write_table(table, sink, row_group_size=row_group_size,
+                   **_parquet_options(codec, table.column_names))
+
+
+# Per-frame fields of RecordingData, the optional ones may be None
+_FRAME_FIELDS = ('samples', 'acq_nr', 'tx_rx_id', 'time', 'tx', 'rx', 'log_version')
+
+
+def _concat_chunks(chunks: List[RecordingData]) -> RecordingData:
+    if len(chunks) == 1:
+        return chunks[0]
+    # Optional columns are only kept if every chunk has them
+    return chunks[0]._replace(**{
+        name: None if any(getattr(c, name) is None for c in chunks)
+        else np.concatenate([getattr(c, name) for c in chunks])
+        for name in _FRAME_FIELDS})
+
+
+def _slice_chunk(data: RecordingData, part: Union[slice, np.ndarray]) -> RecordingData:
+    return data._replace(**{name: getattr(data, name)[part] for name in _FRAME_FIELDS
+                            if getattr(data, name) is not None})
+
+
+class RecordingWriter:
+    """Incremental writer for a measurement zip.
+
+    Frames can be passed in chunks of any size, they are buffered until a full
+    row group is available, so memory use is bounded by one row group.
+    The zip is written to a temporary file that only replaces `path` once
+    it is complete.
+
+        with RecordingWriter(path, config) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, path: str, config: WulpusConfig,
+                 codec: RecordingCodec = DEFAULT_CODEC,
+                 row_group_size: int = ROW_GROUP_SIZE):
+        self.path = path
+        self.config = config
+        self.codec = codec
+        self.row_group_size = row_group_size
+        self.num_frames = 0
+        self._pending: List[RecordingData] = []
+        self._pending_frames = 0
+        self._writer: Union[pq.ParquetWriter, None] = None
+
+        # The parquet member is already compressed, so it is streamed into the
+        # zip uncompressed (ZIP_STORED). This keeps it seekable for `open_zip_member`.
+        self._tmp_path = path + TMP_EXTENSION
+        self._zip = ZipFile(self._tmp_path, 'w', compression=ZIP_STORED)
+        self._zip.writestr(CONFIG_MEMBER, config.model_dump_json())
+        info = ZipInfo(DATA_MEMBER, date_time=time.localtime()[:6])
+        info.compress_type = ZIP_STORED
+        info.external_attr = 0o644 << 16
+        self._member = self._zip.open(info, 'w', force_zip64=True)
+
+    def __enter__(self) -> RecordingWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data: RecordingData):
+        if len(data.time) == 0:
+            return
+        self._pending.append(data._replace(config=self.config))
+        self._pending_frames += len(data.time)
+        if self._pending_frames >= self.row_group_size:
+            pending = _concat_chunks(self._pending)
+            full = self._pending_frames // self.row_group_size * self.row_group_size
+            for start in range(0, full, self.row_group_size):
+                self._write_row_group(_slice_chunk(
+                    pending, slice(start, start + self.row_group_size)))
+            rest = _slice_chunk(pending, slice(full, None))
+            self._pending = [rest] if len(rest.time) > 0 else []
+            self._pending_frames -= full
+
+    def _write_row_group(self, data: RecordingData):
+        # Every row group starts a new delta segment, so it is encoded on its own
+        table = recording_data_to_table(data, self.codec, self.row_group_size)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self._member, table.schema,
+                **_parquet_options(self.codec, table.column_names))
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.num_frames += table.num_rows
+
+    def close(self):
+        if self._zip is None:
+            return
+        try:
+            if self._pending:
+                self._write_row_group(_concat_chunks(self._pending))
+                self._pending = []
+            if self._writer is None:
+                # No frames, still write a valid (empty) table
+                num_samples = self.config.us_config.num_samples
+                self._write_row_group(RecordingData(
+                    samples=np.zeros((0, num_samples), dtype='<i2'),
+                    acq_nr=np.zeros(0, dtype='<u2'),
+                    tx_rx_id=np.zeros(0, dtype=np.uint8),
+                    time=np.zeros(0, dtype=np.uint64),
+                    config=self.config))
+            self._writer.close()
+            self._member.close()
+            self._zip.close()
+        except BaseException:
+            self.abort()
+            raise
+        self._zip = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Stop writing and delete the incomplete file."""
+        if self._zip is None:
+            return
+        for closable in (self._writer, self._member, self._zip):
+            try:
+                if closable is not None:
+                    closable.close()
+            except Exception:
+                pass
+        self._zip = None
+        os.remove(self._tmp_path)
+
+
+def write_recording(path: str, data: RecordingData,
+                    codec: RecordingCodec = DEFAULT_CODEC):
+    """Write a measurement zip (config + parquet)."""
+    with RecordingWriter(path, data.config, codec) as writer:
+        writer.write(data)
+
+
+class Recording:
+    """Lazy reader for a measurement zip.
+
+    Only the parquet footer is read on open, the data is read through a
+    seekable view into the zip (see `open_zip_member`). `read` uses the row-group
+    statistics to skip everything outside the requested slice and only
+    decodes the needed sample columns.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with ZipFile(path, 'r') as zf:
+            self.config = WulpusConfig.model_validate_json(
+                zf.read(CONFIG_MEMBER))
+        self._fileobj = open_zip_member(path, DATA_MEMBER)
+        self._parquet = pq.ParquetFile(self._fileobj)
+        schema = self._parquet.schema_arrow
+        self.sample_columns = get_sample_columns(schema.names)
+        self.time_column = get_time_column(schema)
+        self.codec, _ = codec_from_metadata(schema.metadata)
+
+    def __enter__(self) -> Recording:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._fileobj is None:
+            return
+        self._parquet.close()
+        self._fileobj.close()
+        # Drop the references to the memory map, so the zip is unmapped
+        self._parquet = None
+        self._fileobj = None
+
+    @property
+    def num_frames(self) -> int:
+        return self._parquet.metadata.num_rows
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.sample_columns)
+
+    @property
+    def num_row_groups(self) -> int:
+        return self._parquet.metadata.num_row_groups
+
+    def row_group_frames(self) -> List[int]:
+        """Number of frames in every row group."""
+        metadata = self._parquet.metadata
+        return [metadata.row_group(rg).num_rows for rg in range(metadata.num_row_groups)]
+
+    def row_group_stats(self, column: str) -> List[Tuple[object, object]]:
+        """Return (min, max) of `column` for every row group, (None, None) if unknown."""
+        metadata = self._parquet.metadata
+        col_idx = self._parquet.schema_arrow.get_field_index(column)
+        stats = []
+        for rg in range(metadata.num_row_groups):
+            col_stats = metadata.row_group(rg).column(col_idx).statistics
+            if col_stats is None or not col_stats.has_min_max:
+                stats.append((None, None))
+            else:
+                stats.append((col_stats.min, col_stats.max))
+        return stats
+
+    def time_bounds(self) -> Tuple[Union[int, None], Union[int, None]]:
+        """Return first and last timestamp (us) based on row-group statistics only."""
+        if self.time_column is None:
+            return None, None
+        stats = [s for s in self.row_group_stats(self.time_column)
+                 if s[0] is not None]
+        if not stats:
+            return None, None
+        return min(s[0] for s in stats), max(s[1] for s in stats)
+
+    def frame_counts(self) -> Dict[int, int]:
+        """Return the number of frames per tx_rx_id (reads only that column)."""
+        if 'tx_rx_id' not in self._parquet.schema_arrow.names:
+            return {}
+        table = self._parquet.read(columns=['tx_rx_id'], use_pandas_metadata=False)
+        ids, counts = np.unique(table.column(0).to_numpy(), return_counts=True)
+        return dict(zip(ids.tolist(), counts.tolist()))
+
+    def tx_rx_ids(self) -> List[int]:
+        """Return the TX/RX config ids used in the recording."""
+        return sorted(self.frame_counts())
+
+    def _select_row_groups(self, time_range: Union[Range, None],
+                           tx_rx_ids: Union[np.ndarray, None],
+                           acq_range: Union[Range, None]) -> List[int]:
+        filters = []
+        if time_range is not None and self.time_column is not None:
+            filters.append((self.row_group_stats(self.time_column),
+                            lambda lo, hi: _overlaps(lo, hi, time_range)))
+        if tx_rx_ids is not None and 'tx_rx_id' in self._parquet.schema_arrow.names:
+            filters.append((self.row_group_stats('tx_rx_id'),
+                            lambda lo, hi: bool(np.any((tx_rx_ids >= lo) & (tx_rx_ids <= hi)))))
+        if acq_range is not None:
+            filters.append((self.row_group_stats('aq_number'),
+                            lambda lo, hi: _overlaps(lo, hi, acq_range)))
+
+        selected = []
+        for rg in range(self.num_row_groups):
+            keep = True
+            for stats, check in filters:
+                lo, hi = stats[rg]
+                if lo is not None and not check(lo, hi):
+                    keep = False
+                    break
+            if keep:
+                selected.append(rg)
+        return selected
+
+    def read(self,
+             time_range: Union[Range, None] = None,
+             tx_rx_ids: Union[Iterable[int], None] = None,
+             acq_range: Union[Range, None] = None,
+             sample_crop: Union[int, slice, None] = None) -> RecordingData:
+        """Materialize a slice of the recording.
+
+        Args:
+            time_range: half-open (start, stop) in us since epoch.
+            tx_rx_ids: only keep frames of these TX/RX configs.
+            acq_range: half-open (start, stop) on the acquisition number.
+            sample_crop: keep the first n samples (int) or a slice of the sample axis.
+        """
+        if tx_rx_ids is not None:
+            tx_rx_ids = np.asarray(list(tx_rx_ids), dtype=np.int64)
+        row_groups = self._select_row_groups(time_range, tx_rx_ids, acq_range)
+        return self._read_row_groups(row_groups, time_range, tx_rx_ids, acq_range, sample_crop)
+
+    def iter_chunks(self,
+                    time_range: Union[Range, None] = None,
+                    tx_rx_ids: Union[Iterable[int], None] = None,
+                    acq_range: Union[Range, None] = None,
+                    sample_crop: Union[int, slice, None] = None) -> Iterator[RecordingData]:
+        """Like `read`, but yield the slice one row group at a time (constant memory)."""
+        if tx_rx_ids is not None:
+            tx_rx_ids = np.asarray(list(tx_rx_ids), dtype=np.int64)
+        for rg in self._select_row_groups(time_range, tx_rx_ids, acq_range):
+            chunk = self._read_row_groups(
+                [rg], time_range, tx_rx_ids, acq_range, sample_crop)
+            if len(chunk.time) > 0:
+                yield chunk
+
+    def read_row_group(self, row_group: int,
+                       sample_crop: Union[int, slice, None] = None) -> RecordingData:
+        """Read one whole row group, for sequential readers like `replay.Replay`."""
+        return self._read_row_groups([row_group], None, None, None, sample_crop)
+
+    def _read_row_groups(self, row_groups: List[int],
+                         time_range: Union[Range, None],
+                         tx_rx_ids: Union[np.ndarray, None],
+                         acq_range: Union[Range, None],
+                         sample_crop: Union[int, slice, None]) -> RecordingData:
+        if isinstance(sample_crop, int):
+            sample_crop = slice(0, sample_crop)
+        sample_cols = self.sample_columns
+        if sample_crop is not None:
+            if self.codec.delta == 'sample':
+                # Decoding needs every sample before the crop, crop afterwards
+                sample_cols = sample_cols[:sample_crop.stop]
+                sample_crop = slice(sample_crop.start, None, sample_crop.step)
+            else:
+                sample_cols = sample_cols[sample_crop]
+                sample_crop = None
+
+        meta_cols = ['aq_number']
+        if 'tx_rx_id' in self._parquet.schema_arrow.names:
+            meta_cols.append('tx_rx_id')
+        if self.time_column is not None:
+            meta_cols.append(self.time_column)
+
+        table = self._parquet.read_row_groups(
+            row_groups, columns=meta_cols + sample_cols, use_pandas_metadata=False)
+        data = table_to_recording_data(table, self.config, self.time_column)
+
+        mask = np.ones(len(data.time), dtype=bool)
+        if time_range is not None and self.time_column is not None:
+            mask &= _in_range(data.time, time_range)
+        if tx_rx_ids is not None and 'tx_rx_id' in table.column_names:
+            mask &= np.isin(data.tx_rx_id, tx_rx_ids)
+        if acq_range is not None:
+            mask &= _in_range(data.acq_nr, acq_range)
+        data = data._replace(
+            samples=data.samples if sample_crop is None else data.samples[:, sample_crop])
+        if mask.all():
+            return data
+        return _slice_chunk(data, mask)
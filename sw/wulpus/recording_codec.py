@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+from typing import Literal, Union
+
+import numpy as np
+from pydantic import BaseModel, model_validator
+
+# Key of the codec description in the parquet schema metadata
+CODEC_METADATA_KEY = b'wulpus.codec'
+
+# none:   samples are stored as they are
+# sample: difference to the previous sample within the same frame
+# frame:  difference to the previous frame with the same tx_rx_id
+#         (restarts every `segment` frames, so row groups can be decoded on their own)
+# column: parquet DELTA_BINARY_PACKED encoding of each sample column (no transform)
+DELTA_MODE = Literal['none', 'sample', 'frame', 'column']
+COMPRESSION = Literal['none', 'snappy', 'lz4', 'zstd', 'gzip', 'brotli']
+
+
+class RecordingCodec(BaseModel):
+    # Delta transform applied to the int16 samples.
+    delta: DELTA_MODE = 'none'
+    # Byte shuffle (parquet BYTE_STREAM_SPLIT) of the sample columns.
+    shuffle: bool = False
+    # Parquet page compression.
+    compression: COMPRESSION = 'snappy'
+    # Compression level, None for the codec default.
+    level: Union[int, None] = None
+
+    @model_validator(mode='after')
+    def validate_encoding(self):
+        if self.delta == 'column' and self.shuffle:
+            raise ValueError(
+                "Column delta and byte shuffle are both parquet column encodings, pick one")
+        return self
+
+    def column_encoding(self) -> Union[str, None]:
+        """Parquet encoding for the sample columns, None for the writer default."""
+        if self.delta == 'column':
+            return 'DELTA_BINARY_PACKED'
+        if self.shuffle:
+            return 'BYTE_STREAM_SPLIT'
+        return None
+
+    def to_metadata(self, segment: int) -> bytes:
+        return json.dumps({**self.model_dump(), 'segment': segment}).encode('utf-8')
+
+
+DEFAULT_CODEC = RecordingCodec()
+
+
+def codec_from_metadata(metadata: Union[dict, None]) -> tuple[RecordingCodec, int]:
+    """Return codec and delta segment length stored in parquet schema metadata."""
+    if not metadata or CODEC_METADATA_KEY not in metadata:
+        return DEFAULT_CODEC, 0
+    raw = json.loads(metadata[CODEC_METADATA_KEY])
+    segment = raw.pop('segment', 0)
+    return RecordingCodec.model_validate(raw), segment
+
+
+def _frame_groups(tx_rx_id: np.ndarray, segment: int):
+    """Return the order that groups frames by (segment, tx_rx_id) and the first row of every group."""
+    n = len(tx_rx_id)
+    seg_idx = np.arange(n, dtype=np.int64) // segment if segment > 0 \
+        else np.zeros(n, dtype=np.int64)
+    keys = seg_idx * 256 + tx_rx_id.astype(np.int64)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    return order, first
+
+
+def encode_samples(samples: np.ndarray, tx_rx_id: np.ndarray,
+                   codec: RecordingCodec, segment: int) -> np.ndarray:
+    """Apply the delta transform of `codec` to (n_frames, n_samples) int16 samples.
+
+    All arithmetic wraps around in int16, so the transform is lossless.
+    """
+    samples = np.asarray(samples, dtype='<i2')
+    if codec.delta == 'sample':
+        out = samples.copy()
+        out[:, 1:] = samples[:, 1:] - samples[:, :-1]
+        return out
+    if codec.delta == 'frame' and len(samples) > 0:
+        order, first = _frame_groups(tx_rx_id, segment)
+        grouped = samples[order]
+        delta = grouped.copy()
+        delta[1:] -= grouped[:-1]
+        delta[first] = grouped[first]
+        out = np.empty_like(samples)
+        out[order] = delta
+        return out
+    return samples
+
+
+def decode_samples(samples: np.ndarray, tx_rx_id: np.ndarray,
+                   codec: RecordingCodec, segment: int) -> np.ndarray:
+    """Inverse of `encode_samples`.
+
+    For `frame` the first row of `samples` has to be the start of a segment.
+    """
+    if codec.delta == 'sample':
+        return np.cumsum(samples, axis=1, dtype='<i2')
+    if codec.delta == 'frame' and len(samples) > 0:
+        order, first = _frame_groups(tx_rx_id, segment)
+        summed = np.cumsum(samples[order], axis=0, dtype='<i2')
+        # Remove what the previous groups contributed to the running sum
+        group_idx = np.cumsum(first) - 1
+        first_rows = np.flatnonzero(first)
+        offsets = np.zeros((len(first_rows), samples.shape[1]), dtype='<i2')
+        offsets[1:] = summed[first_rows[1:] - 1]
+        decoded = summed - offsets[group_idx]
+        out = np.empty_like(decoded)
+        out[order] = decoded
+        return out
+    return samples
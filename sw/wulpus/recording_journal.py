@@ -0,0 +1,169 @@
+"""
+Append-only journal that is written while a measurement is running, so a crash
+only loses the frames since the last chunk.
+
+Layout:
+
+    b'WULPUSJ2', uint32 length, header json {"config": ..., "codec": ...}
+    per chunk: b'WJCK', uint32 index, uint32 crc32, uint64 length, payload
+    trailing index (written by close): json list of chunks,
+        uint64 offset of the index json, uint32 crc32 of it, b'WJIX'
+
+Every payload is a self-contained parquet file of one row group (same
+schema and codec as a recording), so chunks can be verified and decoded
+independently. The trailing index is only a shortcut, a journal without
+it (or with a damaged one) is scanned chunk by chunk. Journals of version 1
+(b'WULPUSJ1') only stored the config json and used the default codec.
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import struct
+import zlib
+from typing import BinaryIO, List, NamedTuple, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from wulpus.helper import RecordingData, table_to_recording_data
+from wulpus.recording import ROW_GROUP_SIZE, write_parquet
+from wulpus.recording_codec import DEFAULT_CODEC, RecordingCodec
+from wulpus.wulpus_config_models import WulpusConfig
+
+JOURNAL_EXTENSION = '.journal'
+JOURNAL_MAGIC = b'WULPUSJ2'
+JOURNAL_MAGIC_V1 = b'WULPUSJ1'
+CHUNK_MAGIC = b'WJCK'
+INDEX_MAGIC = b'WJIX'
+
+_FILE_HEADER = struct.Struct('<8sI')
+_CHUNK_HEADER = struct.Struct('<4sIIQ')
+_INDEX_FOOTER = struct.Struct('<QI4s')
+
+
+class JournalChunk(NamedTuple):
+    index: int
+    # Offset of the payload in the journal
+    offset: int
+    length: int
+    crc32: int
+
+
+class RecordingJournal:
+    """Writer side of the journal.
+
+    Every `append` is flushed and fsynced, so everything appended before a
+    crash can be recovered.
+    """
+
+    def __init__(self, path: str, config: WulpusConfig,
+                 codec: RecordingCodec = DEFAULT_CODEC):
+        self.path = path
+        self.codec = codec
+        self.chunks: List[JournalChunk] = []
+        self._file: Union[BinaryIO, None] = open(path, 'wb')
+        header_json = json.dumps({'config': json.loads(config.model_dump_json()),
+                                  'codec': codec.model_dump()}).encode('utf-8')
+        self._file.write(_FILE_HEADER.pack(JOURNAL_MAGIC, len(header_json)))
+        self._file.write(header_json)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, data: RecordingData):
+        if len(data.time) == 0:
+            return
+        buffer = io.BytesIO()
+        write_parquet(buffer, data, self.codec, ROW_GROUP_SIZE)
+        payload = buffer.getvalue()
+        crc = zlib.crc32(payload)
+        index = len(self.chunks)
+        self._file.write(_CHUNK_HEADER.pack(CHUNK_MAGIC, index, crc, len(payload)))
+        offset = self._file.tell()
+        self._file.write(payload)
+        self._sync()
+        self.chunks.append(JournalChunk(index, offset, len(payload), crc))
+
+    def close(self):
+        """Write the trailing index and close the file."""
+        if self._file is None:
+            return
+        index_json = json.dumps([c._asdict() for c in self.chunks]).encode('utf-8')
+        index_offset = self._file.tell()
+        self._file.write(index_json)
+        self._file.write(_INDEX_FOOTER.pack(index_offset, zlib.crc32(index_json), INDEX_MAGIC))
+        self._sync()
+        self._file.close()
+        self._file = None
+
+    def discard(self):
+        """Close and delete the journal (once the recording is safely written)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.remove(self.path)
+
+
+def read_journal_header(journal: bytes) -> Tuple[WulpusConfig, RecordingCodec]:
+    """Return the config and the codec the journal was written with."""
+    magic, length = _FILE_HEADER.unpack_from(journal, 0)
+    header_json = journal[_FILE_HEADER.size:_FILE_HEADER.size + length]
+    if magic == JOURNAL_MAGIC_V1:
+        return WulpusConfig.model_validate_json(header_json), DEFAULT_CODEC
+    if magic != JOURNAL_MAGIC:
+        raise ValueError("Not a recording journal")
+    header = json.loads(header_json)
+    return (WulpusConfig.model_validate(header['config']),
+            RecordingCodec.model_validate(header['codec']))
+
+
+def _read_index(journal: bytes) -> Union[List[JournalChunk], None]:
+    if len(journal) < _INDEX_FOOTER.size:
+        return None
+    offset, crc, magic = _INDEX_FOOTER.unpack_from(journal, len(journal) - _INDEX_FOOTER.size)
+    if magic != INDEX_MAGIC or offset > len(journal) - _INDEX_FOOTER.size:
+        return None
+    index_json = journal[offset:len(journal) - _INDEX_FOOTER.size]
+    if zlib.crc32(index_json) != crc:
+        return None
+    return [JournalChunk(**c) for c in json.loads(index_json)]
+
+
+def _scan_chunks(journal: bytes, start: int) -> List[JournalChunk]:
+    """Find chunks by their headers, skipping over damaged bytes."""
+    chunks = []
+    pos = journal.find(CHUNK_MAGIC, start)
+    while pos >= 0 and pos + _CHUNK_HEADER.size <= len(journal):
+        _, index, crc, length = _CHUNK_HEADER.unpack_from(journal, pos)
+        offset = pos + _CHUNK_HEADER.size
+        if offset + length <= len(journal):
+            chunks.append(JournalChunk(index, offset, length, crc))
+            pos = journal.find(CHUNK_MAGIC, offset + length)
+        else:
+            # Truncated or corrupt length, look for the next header
+            pos = journal.find(CHUNK_MAGIC, pos + 1)
+    return chunks
+
+
+def find_journal_chunks(journal: bytes) -> List[JournalChunk]:
+    """Return all chunks of a journal, from the trailing index if it is intact.
+
+    The chunks are not verified yet, see `verify_chunk`.
+    """
+    chunks = _read_index(journal)
+    if chunks is None:
+        _, length = _FILE_HEADER.unpack_from(journal, 0)
+        chunks = _scan_chunks(journal, _FILE_HEADER.size + length)
+    return chunks
+
+
+def verify_chunk(journal: bytes, chunk: JournalChunk) -> bool:
+    return zlib.crc32(journal[chunk.offset:chunk.offset + chunk.length]) == chunk.crc32
+
+
+def decode_chunk(journal: bytes, chunk: JournalChunk, config: WulpusConfig) -> RecordingData:
+    payload = pa.py_buffer(journal[chunk.offset:chunk.offset + chunk.length])
+    return table_to_recording_data(pq.read_table(pa.BufferReader(payload)), config)
@@ -0,0 +1,147 @@
+"""
+Rebuild recordings from damaged files.
+
+    python -m wulpus.recover wulpus/measurements/wulpus-2025-03-03_10-00-00.zip.journal
+    python -m wulpus.recover wulpus/measurements/*.zip --workers 8
+
+Journals (left behind if the server stopped during a measurement) are
+rebuilt from every chunk with a valid checksum, with the codec they were
+written with, and then renamed to `<name>.zip.journal.recovered`. Recordings are checked row
+group by row group against the parquet page checksums; if some are damaged,
+the intact ones are written to `<name>_recovered.zip`. If a recording can't
+be opened at all, its journal is used if it still exists.
+
+A crash while the finished recording is saved leaves a partial
+`<name>.zip.tmp` next to the journal. It is never read, the recording is
+rebuilt from the journal and the stale file deleted.
+"""
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+import pyarrow.parquet as pq
+from wulpus.helper import open_zip_member, table_to_recording_data
+from wulpus.recording import (DATA_MEMBER, TMP_EXTENSION, Recording,
+                              RecordingWriter)
+from wulpus.recording_journal import (JOURNAL_EXTENSION, decode_chunk,
+                                      find_journal_chunks, read_journal_header,
+                                      verify_chunk)
+
+RECOVERED_SUFFIX = '_recovered'
+# Appended to a journal once a recording was rebuilt from it
+RECOVERED_JOURNAL_EXTENSION = '.recovered'
+
+
+def _recording_path(journal_path: str) -> str:
+    return journal_path[:-len(JOURNAL_EXTENSION)] if journal_path.endswith(JOURNAL_EXTENSION) \
+        else journal_path
+
+
+def _output_path(path: str) -> str:
+    """Path of the rebuilt recording, never overwriting an existing file."""
+    base = _recording_path(path)
+    root, ext = os.path.splitext(base)
+    if path.endswith(JOURNAL_EXTENSION) and not os.path.exists(base):
+        return base
+    out = root + RECOVERED_SUFFIX + ext
+    while os.path.exists(out):
+        out = os.path.splitext(out)[0] + '_conflict' + ext
+    return out
+
+
+def recover_journal(path: str, out_path: Union[str, None] = None,
+                    workers: Union[int, None] = None) -> Tuple[str, int, int]:
+    """Rebuild a recording from a journal.
+
+    Returns:
+        tuple: (output path, intact chunks, damaged chunks)
+    """
+    out_path = out_path or _output_path(path)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as journal:
+        config, codec = read_journal_header(journal)
+        chunks = find_journal_chunks(journal)
+        with ThreadPoolExecutor(workers) as pool:
+            valid = list(pool.map(lambda c: verify_chunk(journal, c), chunks))
+        intact = sorted((c for c, ok in zip(chunks, valid) if ok), key=lambda c: c.index)
+        with RecordingWriter(out_path, config, codec) as writer:
+            for chunk in intact:
+                writer.write(decode_chunk(journal, chunk, config))
+    # Keep the journal, but don't rebuild it again on the next run
+    os.replace(path, path + RECOVERED_JOURNAL_EXTENSION)
+    # Partial output of a save that was interrupted, superseded by the rebuilt recording
+    stale = _recording_path(path) + TMP_EXTENSION
+    if os.path.isfile(stale):
+        os.remove(stale)
+    return out_path, len(intact), len(chunks) - len(intact)
+
+
+def check_row_groups(path: str, workers: Union[int, None] = None) -> List[bool]:
+    """Verify every row group of a recording (page checksums and decoding)."""
+    with Recording(path) as rec:
+        num_row_groups = rec.num_row_groups
+
+    def check(row_group: int) -> bool:
+        try:
+            with open_zip_member(path, DATA_MEMBER) as source:
+                pq.ParquetFile(source, page_checksum_verification=True) \
+                    .read_row_group(row_group)
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(check, range(num_row_groups)))
+
+
+def recover_recording(path: str, out_path: Union[str, None] = None,
+                      workers: Union[int, None] = None) -> Tuple[Union[str, None], int, int]:
+    """Check a recording and rebuild it from its intact row groups if needed.
+
+    Returns:
+        tuple: (output path or None if the recording is fine, intact row groups, damaged row groups)
+    """
+    try:
+        valid = check_row_groups(path, workers)
+    except Exception:
+        if os.path.isfile(path + JOURNAL_EXTENSION):
+            return recover_journal(path + JOURNAL_EXTENSION, out_path or _output_path(path), workers)
+        raise
+    if all(valid):
+        return None, len(valid), 0
+
+    out_path = out_path or _output_path(path)
+    with Recording(path) as rec, open_zip_member(path, DATA_MEMBER) as source:
+        parquet = pq.ParquetFile(source, page_checksum_verification=True)
+        with RecordingWriter(out_path, rec.config, rec.codec) as writer:
+            for row_group, ok in enumerate(valid):
+                if ok:
+                    writer.write(table_to_recording_data(
+                        parquet.read_row_group(row_group), rec.config, rec.time_column))
+    return out_path, sum(valid), len(valid) - sum(valid)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Verify recordings and rebuild them from intact chunks.")
+    parser.add_argument('files', nargs='+', help="recording .zip or .journal files")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="threads for verifying chunks (default: number of CPUs)")
+    args = parser.parse_args()
+
+    for file in args.files:
+        try:
+            if file.endswith(JOURNAL_EXTENSION):
+                out, intact, damaged = recover_journal(file, workers=args.workers)
+            else:
+                out, intact, damaged = recover_recording(file, workers=args.workers)
+        except Exception as e:
+            print(f"{file}: can't be recovered ({e})")
+            continue
+        if out is None:
+            print(f"{file}: OK ({intact} row groups)")
+        else:
+            print(f"{file}: {intact} intact, {damaged} damaged chunks -> {out}")
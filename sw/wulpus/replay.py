@@ -0,0 +1,198 @@
+"""
+Replay of recordings, paced by their timestamps.
+
+The recording is read one row group at a time (see `Recording`), so a
+replay starts immediately and needs constant memory. Frames are released
+when they are due according to their recorded time divided by the replay
+speed, `'max'` releases them as fast as the consumer takes them. Speed,
+pause and seek can be changed while the replay is running, from the event
+loop `frames` runs on (the methods are not thread-safe).
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import AsyncIterator, Literal, Tuple, Union
+
+import numpy as np
+from wulpus.helper import RecordingData
+from wulpus.recording import Recording
+
+# Replay speed as multiple of the recorded rate, 'max' = unpaced
+REPLAY_SPEED = Union[float, Literal['max']]
+MIN_SPEED = 0.1
+DEFAULT_SPEED = 1.0
+# Recordings without timestamps are paced at this frame interval (us) at 1x
+DEFAULT_FRAME_INTERVAL_US = 100_000
+
+# (samples, tx_rx_id, time in us)
+ReplayFrame = Tuple[np.ndarray, int, int]
+
+
+class Replay:
+    """Timestamp-paced, seekable replay of a measurement zip."""
+
+    def __init__(self, path: str, speed: REPLAY_SPEED = DEFAULT_SPEED):
+        self.recording = Recording(path)
+        self.config = self.recording.config
+        self.start_time, self.end_time = self.recording.time_bounds()
+        # Index of the first frame of every row group
+        self._group_starts = np.cumsum([0] + self.recording.row_group_frames())
+        self._row_group = 0
+        self._offset = 0
+        self._chunk: Union[RecordingData, None] = None
+        self.paused = False
+        self._stopped = False
+        # (wall clock, recorded time) the pacing is relative to, reset by every change
+        self._anchor: Union[Tuple[float, int], None] = None
+        self._changes = 0
+        self._changed = asyncio.Event()
+        self.speed: REPLAY_SPEED = DEFAULT_SPEED
+        self.set_speed(speed)
+
+    def close(self):
+        self.recording.close()
+
+    @property
+    def num_frames(self) -> int:
+        return int(self._group_starts[-1])
+
+    @property
+    def position(self) -> int:
+        """Index of the next frame."""
+        return int(self._group_starts[self._row_group]) + self._offset
+
+    def state(self) -> dict:
+        return {'speed': self.speed, 'paused': self.paused, 'num_frames': self.num_frames,
+                'start_time': self.start_time, 'end_time': self.end_time}
+
+    def _notify(self):
+        self._anchor = None
+        self._changes += 1
+        self._changed.set()
+
+    @staticmethod
+    def check_speed(speed: REPLAY_SPEED):
+        if speed != 'max' and not speed >= MIN_SPEED:
+            raise ValueError(f"Replay speed has to be at least {MIN_SPEED} or 'max'")
+
+    def set_speed(self, speed: REPLAY_SPEED):
+        self.check_speed(speed)
+        self.speed = speed
+        self._notify()
+
+    def pause(self):
+        self.paused = True
+        self._notify()
+
+    def resume(self):
+        self.paused = False
+        self._notify()
+
+    def stop(self):
+        """End `frames`, also if it is waiting."""
+        self._stopped = True
+        self._notify()
+
+    def seek_target(self, index: Union[int, None] = None,
+                    time_us: Union[int, None] = None) -> int:
+        """Frame index `seek` would continue at, without changing the replay.
+
+        Raises ValueError for an index outside [0, num_frames] or a time in a
+        recording without timestamps. A time after the last frame gives num_frames.
+        """
+        if (index is None) == (time_us is None):
+            raise ValueError("Seek to either an index or a time")
+        if time_us is not None:
+            return self._find_time(time_us)
+        if not 0 <= index <= self.num_frames:
+            raise ValueError(f"Seek index has to be between 0 and {self.num_frames}")
+        return index
+
+    def seek(self, index: Union[int, None] = None, time_us: Union[int, None] = None):
+        """Continue at a frame index or at the first frame recorded at or after `time_us`.
+
+        Only the row group containing the target is read. Seeking to the end
+        (index num_frames or a later time) ends the replay.
+        """
+        index = self.seek_target(index, time_us)
+        row_group = int(np.searchsorted(self._group_starts, index, side='right')) - 1
+        if row_group != self._row_group:
+            self._chunk = None
+        self._row_group = row_group
+        self._offset = index - int(self._group_starts[row_group])
+        self._notify()
+
+    def _find_time(self, time_us: int) -> int:
+        if self.recording.time_column is None:
+            raise ValueError("The recording has no timestamps")
+        stats = self.recording.row_group_stats(self.recording.time_column)
+        for row_group, (_, stats_max) in enumerate(stats):
+            if stats_max is not None and stats_max < time_us:
+                continue
+            times = self.recording.read_row_group(row_group, sample_crop=0).time
+            later = np.flatnonzero(times >= time_us)
+            if len(later):
+                return int(self._group_starts[row_group]) + int(later[0])
+        return self.num_frames
+
+    def _current(self) -> Union[ReplayFrame, None]:
+        """The next frame without advancing, None at the end of the recording."""
+        while self._row_group < len(self._group_starts) - 1:
+            if self._chunk is None:
+                self._chunk = self.recording.read_row_group(self._row_group)
+            if self._offset < len(self._chunk.time):
+                i = self._offset
+                return (self._chunk.samples[i], int(self._chunk.tx_rx_id[i]),
+                        int(self._chunk.time[i]))
+            self._row_group += 1
+            self._offset = 0
+            self._chunk = None
+        return None
+
+    def _pacing_time(self, frame_time: int) -> int:
+        if self.recording.time_column is None:
+            return self.position * DEFAULT_FRAME_INTERVAL_US
+        return frame_time
+
+    def _delay(self, frame_time: int) -> float:
+        """Seconds until a frame is due."""
+        if self.speed == 'max':
+            return 0
+        now = time.perf_counter()
+        recorded = self._pacing_time(frame_time)
+        if self._anchor is None:
+            self._anchor = (now, recorded)
+        wall, anchor_time = self._anchor
+        return wall + (recorded - anchor_time) / 1e6 / self.speed - now
+
+    async def _wait_changed(self, timeout: Union[float, None] = None) -> bool:
+        """Wait for a speed, pause, seek or stop change, True if one happened."""
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def frames(self) -> AsyncIterator[ReplayFrame]:
+        """Yield the frames when they are due, until the end of the recording or `stop`."""
+        while not self._stopped:
+            if self.paused:
+                await self._wait_changed()
+                continue
+            frame = self._current()
+            if frame is None:
+                return
+            delay = self._delay(frame[2])
+            if delay > 0:
+                if await self._wait_changed(delay):
+                    continue
+            else:
+                # Let the other tasks run, also when replaying at max speed or catching up
+                changes = self._changes
+                await asyncio.sleep(0)
+                if changes != self._changes:
+                    continue
+            self._offset += 1
+            yield frame
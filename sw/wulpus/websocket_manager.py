@@ -1,20 +1,209 @@
 from __future__ import annotations
 import asyncio
 import json
-from typing import TYPE_CHECKING
+import time
+from collections import deque
+from typing import (TYPE_CHECKING, Any, Dict, List, Literal, NamedTuple,
+                    Optional, Sequence, Tuple, Union, get_args)
 
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.encoders import jsonable_encoder
 from fastapi.websockets import WebSocketState
+from pydantic import BaseModel, ConfigDict, Field
+from wulpus.dsp import Band
+from wulpus.frame_protocol import (LIVE_STREAM, PROTOCOL_JSON, LiveFrame,
+                                   encode_batch, encode_bmode, encode_gap,
+                                   select_protocol)
+from wulpus.live_stream import (BMODE_RATE, DEFAULT_BACKFILL_FRAMES,
+                                DEFAULT_DYNAMIC_RANGE_DB, DEFAULT_LOG_SIZE,
+                                BatchStreams, BModeImage, Gap)
 
 if TYPE_CHECKING:
     from wulpus.wulpus import Wulpus
 
+# What happens to frames when a client can't keep up:
+# keep-latest only keeps the newest frame, drop-oldest keeps the newest `queue_size` frames
+DROP_POLICY = Literal['keep-latest', 'drop-oldest']
+DEFAULT_DROP_POLICY: DROP_POLICY = 'drop-oldest'
+DEFAULT_QUEUE_SIZE = 64
+# Frames are sent in batches, at most this many batches per second
+# (clients can ask for less with `Subscription.max_rate`)
+DEFAULT_MAX_BATCH_RATE = 30.0
+MAX_BATCH_FRAMES = 256
+# The status is checked for changes this often, and sent at least every STATUS_HEARTBEAT seconds
+STATUS_POLL_INTERVAL = 0.1
+STATUS_HEARTBEAT = 5.0
+METRICS_INTERVAL = 1.0
+
+Message = Union[str, bytes]
+
+
+class Subscription(BaseModel):
+    """What a WebSocket client receives.
+
+    Set with the query parameters of /ws and changed with a
+    {"type": "subscribe", ...} message, fields that are left out keep their value.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    # Frame streams, each one is a separate batch message
+    streams: List[LIVE_STREAM] = Field(default_factory=lambda: ['raw'])
+    # Only frames of these tx_rx_ids (None = all)
+    tx_rx_ids: Optional[List[int]] = None
+    # Plot width in pixels, frames are min/max decimated to it (None = full resolution)
+    width: Optional[int] = Field(None, ge=1, le=16384)
+    # Passband of the filtered and envelope streams (None = default band)
+    low_hz: Optional[float] = Field(None, gt=0)
+    high_hz: Optional[float] = Field(None, gt=0)
+    # B-mode images with this dynamic range
+    bmode: bool = False
+    dynamic_range_db: float = Field(DEFAULT_DYNAMIC_RANGE_DB, gt=0, le=120)
+    # Device status (when it changes) and per-client stream metrics (once per second)
+    status: bool = True
+    metrics: bool = False
+    # Frame batches per second (None = as often as the server sends)
+    max_rate: Optional[float] = Field(None, gt=0)
+    # Recent frames sent on connect, in addition to the latest frame of every tx_rx_id
+    backfill: int = Field(DEFAULT_BACKFILL_FRAMES, ge=0, le=DEFAULT_LOG_SIZE)
+
+    @property
+    def band(self) -> Union[Band, None]:
+        if self.low_hz is None or self.high_hz is None:
+            return None
+        return self.low_hz, self.high_hz
+
+    def wants(self, frame: LiveFrame) -> bool:
+        return self.tx_rx_ids is None or frame.tx_rx_id in self.tx_rx_ids
+
+    def updated(self, changes: Dict[str, Any]) -> Subscription:
+        """Validated copy with `changes` applied."""
+        return Subscription.model_validate({**self.model_dump(), **changes})
+
+
+class QueuedFrames(NamedTuple):
+    """A batch, one message per stream (or a gap if messages is None), covering first_seq..last_seq."""
+    first_seq: int
+    last_seq: int
+    messages: Union[Tuple[Message, ...], None]
+
+
+class ClientConnection:
+    """A connected client with its own send queue, drained by its own task.
+
+    Frame batches go into a bounded queue that drops according to
+    `drop_policy`, dropped frames are announced to the client with a gap
+    message before the next batch. Control messages (status, notifications)
+    are never dropped and are sent before pending frames. Of the B-mode
+    images only the newest one waits to be sent.
+    """
+
+    def __init__(self, websocket: WebSocket, protocol: str,
+                 drop_policy: DROP_POLICY = DEFAULT_DROP_POLICY,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 subscription: Union[Subscription, None] = None):
+        if drop_policy not in get_args(DROP_POLICY):
+            raise ValueError(f"Unknown drop policy {drop_policy}")
+        self.websocket = websocket
+        self.protocol = protocol
+        self.subscription = subscription or Subscription()
+        self.drop_policy = drop_policy
+        self.frames: deque[QueuedFrames] = deque(
+            maxlen=1 if drop_policy == 'keep-latest' else max(1, queue_size))
+        self.control: deque[Message] = deque()
+        self.bmode_image: Union[Message, None] = None
+        # Position in the frame log and when the next batch is due (see max_rate)
+        self.next_seq = 0
+        self.next_send = 0.0
+        self.sent_frames = 0
+        self.dropped = 0
+        # Frames that were dropped and not announced yet
+        self._gap: Union[Gap, None] = None
+        self._wakeup = asyncio.Event()
+        self._task: Union[asyncio.Task, None] = None
+
+    def start(self, on_closed):
+        async def run():
+            try:
+                await self._send_loop()
+            except (RuntimeError, WebSocketDisconnect):  # Client disconnected
+                pass
+            on_closed(self)
+        self._task = asyncio.create_task(run())
+
+    def stop(self):
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def push_frames(self, first_seq: int, last_seq: int, messages: Sequence[Message]):
+        self._push(QueuedFrames(first_seq, last_seq, tuple(messages)))
+
+    def push_gap(self, gap: Gap):
+        self._push(QueuedFrames(gap[0], gap[1], None))
+
+    def _push(self, item: QueuedFrames):
+        if len(self.frames) == self.frames.maxlen:
+            evicted = self.frames.popleft()
+            if evicted.messages is not None:
+                self.dropped += evicted.last_seq - evicted.first_seq + 1
+            self._add_gap((evicted.first_seq, evicted.last_seq))
+        self.frames.append(item)
+        self._wakeup.set()
+
+    def _add_gap(self, gap: Gap):
+        # Queued items are in sequence order, so the dropped ranges are contiguous
+        self._gap = gap if self._gap is None else (self._gap[0], gap[1])
+
+    def push_control(self, message: Message):
+        self.control.append(message)
+        self._wakeup.set()
+
+    def push_bmode(self, message: Message):
+        self.bmode_image = message
+        self._wakeup.set()
+
+    def metrics(self) -> dict:
+        return {'type': 'metrics', 'next_seq': self.next_seq, 'sent_frames': self.sent_frames,
+                'dropped_frames': self.dropped, 'queued_batches': len(self.frames)}
+
+    async def _send(self, message: Message):
+        if isinstance(message, bytes):
+            await self.websocket.send_bytes(message)
+        else:
+            await self.websocket.send_text(message)
+
+    async def _send_loop(self):
+        while self.websocket.application_state == WebSocketState.CONNECTED:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.control or self.bmode_image is not None or self.frames:
+                if self.control:
+                    await self._send(self.control.popleft())
+                    continue
+                if self.bmode_image is not None:
+                    message, self.bmode_image = self.bmode_image, None
+                    await self._send(message)
+                    continue
+                item = self.frames.popleft()
+                if item.messages is None:
+                    self._add_gap((item.first_seq, item.last_seq))
+                if self._gap is not None:
+                    gap, self._gap = self._gap, None
+                    await self._send(encode_gap(gap[0], gap[1], self.protocol))
+                for message in item.messages or ():
+                    await self._send(message)
+                if item.messages is not None:
+                    self.sent_frames += item.last_seq - item.first_seq + 1
+
 
 class WebsocketManager:
-    def __init__(self, _wulpus: Wulpus):
+    def __init__(self, _wulpus: Wulpus, max_batch_rate: float = DEFAULT_MAX_BATCH_RATE):
         self.active_connections: list[WebSocket] = []
+        self.clients: dict[WebSocket, ClientConnection] = {}
         self.wulpus = _wulpus
+        self.max_batch_rate = max_batch_rate
+        self.bmode = BModeImage()
+        # Latest serialized status, shared by all clients
+        self._status_message: Union[str, None] = None
 
     def set_wulpus(self, wulpus: Wulpus):
         self.wulpus = wulpus
@@ -22,43 +211,227 @@ class WebsocketManager:
     def get_wulpus(self) -> Wulpus:
         return self.wulpus
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket,
+                      drop_policy: DROP_POLICY = DEFAULT_DROP_POLICY,
+                      queue_size: int = DEFAULT_QUEUE_SIZE,
+                      subscription: Union[Subscription, None] = None):
+        protocol = select_protocol(websocket.scope.get('subprotocols', []))
+        await websocket.accept(subprotocol=protocol)
+        client = ClientConnection(websocket, protocol or PROTOCOL_JSON,
+                                  drop_policy, queue_size, subscription)
+        # Frames from now on, older ones are sent as backfill before any of them
+        client.next_seq = self.wulpus.get_frame_log().next_seq
         self.active_connections.append(websocket)
+        self.clients[websocket] = client
+        self._send_current_status(client)
+        self._send_backfill(client)
+        client.start(lambda c: self.disconnect(c.websocket))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            client.stop()
+
+    def subscribe(self, websocket: WebSocket, changes: Dict[str, Any]) -> Subscription:
+        """Change what a client receives, raises pydantic's ValidationError for invalid changes."""
+        client = self.clients[websocket]
+        subscribed_status = client.subscription.status
+        client.subscription = client.subscription.updated(changes)
+        if client.subscription.status and not subscribed_status:
+            self._send_current_status(client)
+        return client.subscription
 
     async def send_single_client(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.push_control(message)
 
     async def broadcast_text(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except RuntimeError:
-                self.disconnect(connection)
+        for client in list(self.clients.values()):
+            client.push_control(message)
 
     async def broadcast_json(self, message):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except (RuntimeError, WebSocketDisconnect):  # Client disconnected
-                self.disconnect(connection)
-
-    async def send_status(self, websocket: WebSocket):
-        try:
-            while websocket.application_state == WebSocketState.CONNECTED:
-                status = self.wulpus.get_status()
-                await websocket.send_json(jsonable_encoder(status))
-                await asyncio.sleep(1)
-        except (RuntimeError, WebSocketDisconnect):  # Client disconnected
+        await self.broadcast_text(json.dumps(jsonable_encoder(message)))
+
+    def _send_batch(self, frames: List[LiveFrame], gap: Union[Gap, None],
+                    clients: List[ClientConnection]):
+        """Queue a batch of consecutive live frames for clients that are at the same position.
+
+        Only the tx_rx_ids some client wants are processed. Filtered and
+        envelope streams are computed once per band, decimated once per width
+        and encoded once per protocol (see `BatchStreams`). Sending happens in
+        the client tasks, so a slow client doesn't hold up the others.
+        """
+        wanted = None
+        if all(c.subscription.tx_rx_ids is not None for c in clients):
+            wanted = {i for c in clients for i in c.subscription.tx_rx_ids}
+        selected = [f for f in frames if wanted is None or f.tx_rx_id in wanted]
+        streams = BatchStreams(selected, self.sampling_freq())
+        encoded = {}
+        for client in clients:
+            if gap is not None:
+                client.push_gap(gap)
+            if frames:
+                client.push_frames(frames[0].seq, frames[-1].seq,
+                                   self._encode_streams(client, streams, encoded))
+        if streams.sampling_freq is not None and any(c.subscription.bmode for c in clients):
+            self.bmode.update(streams.get('envelope'))
+
+    def sampling_freq(self) -> Union[float, None]:
+        config = self.wulpus.get_config()
+        return config.us_config.sampling_freq if config is not None else None
+
+    @staticmethod
+    def _encode_streams(client: ClientConnection, streams: BatchStreams,
+                        encoded: Union[dict, None] = None) -> List[Message]:
+        """One message per stream the client subscribed to, shared through `encoded`."""
+        encoded = {} if encoded is None else encoded
+        subscription = client.subscription
+        tx_rx_ids = None if subscription.tx_rx_ids is None else tuple(sorted(subscription.tx_rx_ids))
+        messages = []
+        for stream in dict.fromkeys(subscription.streams):
+            if stream != 'raw' and streams.sampling_freq is None:
+                continue
+            band = streams.resolve_band(subscription.band) if stream != 'raw' else None
+            key = (client.protocol, stream, band, subscription.width, tx_rx_ids)
+            if key not in encoded:
+                frames = [f for f in streams.get(stream, band, subscription.width)
+                          if subscription.wants(f)]
+                encoded[key] = encode_batch(frames, client.protocol, stream) if frames else None
+            if encoded[key] is not None:
+                messages.append(encoded[key])
+        return messages
+
+    def _send_backfill(self, client: ClientConnection):
+        """Send recent history to a new client, so its views are populated right away.
+
+        The last `Subscription.backfill` frames and the latest frame of every
+        tx_rx_id go out as one batch per stream, followed by the B-mode image
+        if the client wants it.
+        """
+        frames = [f for f in self.wulpus.get_frame_log().backfill(client.subscription.backfill)
+                  if f.seq < client.next_seq and client.subscription.wants(f)]
+        if not frames:
             return
+        streams = BatchStreams(frames, self.sampling_freq())
+        client.push_frames(frames[0].seq, frames[-1].seq, self._encode_streams(client, streams))
+        if client.subscription.bmode and streams.sampling_freq is not None:
+            # The shared image may be stale if nobody wanted B-mode until now.
+            # These are the latest frames, so updating it only makes it current.
+            self.bmode.update(streams.get('envelope'))
+            dynamic_range_db = client.subscription.dynamic_range_db
+            client.push_bmode(encode_bmode(self.bmode.render(dynamic_range_db), self.bmode.time,
+                                           dynamic_range_db, client.protocol))
+
+    async def send_bmode(self):
+        """Send the B-mode image to subscribed clients, `BMODE_RATE` times per second if it changed.
+
+        The image is rendered and encoded once per (protocol, dynamic range).
+        """
+        sent_version = self.bmode.version
+        while True:
+            await asyncio.sleep(1 / BMODE_RATE)
+            if self.bmode.version == sent_version:
+                continue
+            sent_version = self.bmode.version
+            encoded = {}
+            for client in list(self.clients.values()):
+                subscription = client.subscription
+                if not subscription.bmode:
+                    continue
+                key = (client.protocol, subscription.dynamic_range_db)
+                if key not in encoded:
+                    image = self.bmode.render(subscription.dynamic_range_db)
+                    encoded[key] = encode_bmode(image, self.bmode.time,
+                                                subscription.dynamic_range_db, client.protocol)
+                client.push_bmode(encoded[key])
+
+    @staticmethod
+    def _status_key(status: dict) -> tuple:
+        """Cheap fingerprint of a status, without serializing it.
+
+        Configs are compared by identity (they are replaced, not changed, by
+        `set_config`), progress in steps of 1% and flat dicts by their items.
+        """
+        key = []
+        for name, value in status.items():
+            if name == 'progress':
+                value = round(value, 2)
+            elif isinstance(value, dict):
+                value = tuple(value.items())
+            elif not isinstance(value, (int, float, str, bool, type(None))):
+                value = id(value)
+            key.append((name, value))
+        return tuple(key)
+
+    def _send_current_status(self, client: ClientConnection):
+        if client.subscription.status:
+            if self._status_message is None:
+                self._status_message = json.dumps(jsonable_encoder(self.wulpus.get_status()))
+            client.push_control(self._status_message)
+
+    async def send_status(self):
+        """Single producer of status and metrics messages for all clients.
+
+        The status is serialized once when it changes (or every
+        `STATUS_HEARTBEAT` seconds) and the same message is queued for every
+        subscribed client. Metrics are per client, once per second.
+        """
+        last_key = None
+        sent_at = metrics_at = 0.0
+        while True:
+            now = time.monotonic()
+            status = self.wulpus.get_status()
+            key = self._status_key(status)
+            if key != last_key or now - sent_at >= STATUS_HEARTBEAT:
+                if key != last_key:
+                    self._status_message = json.dumps(jsonable_encoder(status))
+                    last_key = key
+                sent_at = now
+                for client in list(self.clients.values()):
+                    if client.subscription.status:
+                        client.push_control(self._status_message)
+            if now - metrics_at >= METRICS_INTERVAL:
+                metrics_at = now
+                for client in list(self.clients.values()):
+                    if client.subscription.metrics:
+                        client.push_control(json.dumps(client.metrics()))
+            await asyncio.sleep(STATUS_POLL_INTERVAL)
 
     async def send_data(self, new_measurement_event: asyncio.Event):
+        """Forward every frame of the frame log to the clients, in order.
+
+        Every client has its own position in the log. Frames that arrived
+        since a client's last batch are sent as one batch, at most
+        `max_batch_rate` (or the client's `max_rate`) batches per second.
+        Frames that were overwritten in the log before they could be sent
+        are announced as gap.
+        """
+        frame_log = self.wulpus.get_frame_log()
+        interval = 1 / self.max_batch_rate
         while True:
-            await new_measurement_event.wait()
+            if not any(c.next_seq < frame_log.next_seq for c in self.clients.values()):
+                await new_measurement_event.wait()
             new_measurement_event.clear()
-            data = self.wulpus.get_latest_frame()
-            if data is not None:
-                await self.broadcast_json(data)
+            if self.wulpus.get_frame_log() is not frame_log:
+                frame_log = self.wulpus.get_frame_log()
+                for client in self.clients.values():
+                    client.next_seq = frame_log.first_seq
+            tick = time.monotonic()
+            # Clients at the same position share one batch
+            due: Dict[int, List[ClientConnection]] = {}
+            for client in list(self.clients.values()):
+                if client.next_seq < frame_log.next_seq and client.next_send <= tick:
+                    due.setdefault(client.next_seq, []).append(client)
+            for next_seq, clients in due.items():
+                frames, gap = frame_log.since(next_seq, MAX_BATCH_FRAMES)
+                self._send_batch(frames, gap, clients)
+                end = frames[-1].seq + 1 if frames else frame_log.next_seq
+                for client in clients:
+                    client.next_seq = end
+                    max_rate = client.subscription.max_rate
+                    if max_rate is not None and max_rate < self.max_batch_rate:
+                        client.next_send = tick + 1 / max_rate
+            await asyncio.sleep(max(0.0, tick + interval - time.monotonic()))
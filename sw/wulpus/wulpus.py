@@ -12,13 +12,19 @@ from matplotlib import dates
 import numpy as np
 import pandas as pd
 
-from wulpus.helper import ensure_dir
+from wulpus.helper import RecordingData, ensure_dir
 import wulpus
+from wulpus.catalog import RecordingCatalog
 from wulpus.dongle import WulpusDongle
 from wulpus.dongle_mock import WulpusDongleMock
+from wulpus.frame_protocol import LiveFrame
+from wulpus.live_stream import FrameLog
+from wulpus.preview import compute_preview, save_preview
+from wulpus.recording import ROW_GROUP_SIZE, write_recording
+from wulpus.recording_codec import DEFAULT_CODEC, RecordingCodec
+from wulpus.recording_journal import JOURNAL_EXTENSION, RecordingJournal
 from wulpus.wulpus_api import CONFIG_FILE_EXTENSION, DATA_FILE_EXTENSION, gen_conf_package, gen_restart_package
 from wulpus.wulpus_config_models import WulpusConfig
-from typing import TypedDict
 
 
 class Status(IntEnum):
@@ -29,13 +35,6 @@ class Status(IntEnum):
     ERROR = 9
 
 
-class Measurement(TypedDict):
-    data: list[float]
-    time: int
-    tx: list[int]
-    rx: list[int]
-
-
 class Wulpus:
     def __init__(self):
         self._config: Union[WulpusConfig, None] = None
@@ -43,7 +42,9 @@ class Wulpus:
         self._dongle = WulpusDongle()
         # self._dongle = WulpusDongleMock()
         self._last_connection: str = ''
-        self._latest_frame: Union[Measurement, None] = None
+        self._latest_frame: Union[LiveFrame, None] = None
+        # Every live frame gets a sequence number here, so clients can detect lost frames
+        self._frame_log = FrameLog()
         self._data:  Union[np.ndarray, None] = None
         self._data_acq_num:  Union[np.ndarray, None] = None
         self._data_tx_rx_id:  Union[np.ndarray, None] = None
@@ -53,6 +54,10 @@ class Wulpus:
         self._recording_start = time.time()
         self._live_data_cnt = 0
         self._acquisition_running = False
+        self._recording_codec: RecordingCodec = DEFAULT_CODEC
+        self._catalog: Union[RecordingCatalog, None] = None
+        self._recording_path: Union[str, None] = None
+        self._journal: Union[RecordingJournal, None] = None
 
     def get_connection_options(self):
         return self._dongle.get_available()
@@ -88,6 +93,9 @@ class Wulpus:
     def set_config(self, config: WulpusConfig) -> bytes:
         self._config = config
 
+    def get_config(self) -> Union[WulpusConfig, None]:
+        return self._config
+
     async def start(self):
         """
         Start executing the config. Config needs to be set before starting.
@@ -115,9 +123,30 @@ class Wulpus:
         """
         self._acquisition_running = False
 
+    def set_recording_codec(self, codec: RecordingCodec):
+        """
+        Select how the samples of the next recordings are encoded and compressed
+        """
+        self._recording_codec = codec
+
+    def set_recording_catalog(self, catalog: RecordingCatalog):
+        """
+        Catalog that gets updated whenever a recording was saved
+        """
+        self._catalog = catalog
+
     def set_new_measurement_event(self, event: asyncio.Event):
         self._new_measurement = event
 
+    def set_frame_log(self, frame_log: FrameLog):
+        """
+        Log that numbers and keeps the live frames (shared between real and mock device)
+        """
+        self._frame_log = frame_log
+
+    def get_frame_log(self) -> FrameLog:
+        return self._frame_log
+
     async def _measure(self):
         self._recording_start = time.time()
         number_of_acq = self._config.us_config.num_acqs
@@ -126,6 +155,12 @@ class Wulpus:
         self._data_acq_num = np.zeros(number_of_acq, dtype='<u2')
         self._data_tx_rx_id = np.zeros(number_of_acq, dtype=np.uint8)
         self._data_time = np.zeros(number_of_acq, dtype=np.uint64)
+        # Frames are journaled while measuring, so a crash doesn't lose the whole recording
+        self._recording_path = self._new_recording_path()
+        self._journal = RecordingJournal(self._recording_path + JOURNAL_EXTENSION,
+                                         self._config, self._recording_codec)
+        # Journal chunk being written in a worker thread (parquet encoding and fsync)
+        journaling: Union[asyncio.Future, None] = None
         # Acquisition counter
         data_cnt = 0
         self._acquisition_running = True
@@ -134,15 +169,20 @@ class Wulpus:
             data = self._dongle.receive_data()
             timestamp = int(time.time_ns()/1e3)
             if data is not None:
-                self._latest_frame = self._structure_measurement(
-                    data[0], data[2], timestamp)
                 self._data[:, data_cnt] = data[0]
                 self._data_acq_num[data_cnt] = data[1]
                 self._data_tx_rx_id[data_cnt] = data[2]
                 self._data_time[data_cnt] = timestamp
-                self._new_measurement.set()
+                self._publish_frame(data[0], data[2], timestamp)
                 data_cnt += 1
                 self._live_data_cnt = data_cnt
+                if data_cnt % ROW_GROUP_SIZE == 0:
+                    # One chunk at a time, so the chunks stay in order
+                    if journaling is not None:
+                        await journaling
+                    journaling = asyncio.ensure_future(asyncio.to_thread(
+                        self._journal.append,
+                        self._get_recording_data(data_cnt - ROW_GROUP_SIZE, data_cnt)))
             await asyncio.sleep(0.001)
 
         # stop measurement
@@ -154,9 +194,19 @@ class Wulpus:
         self._data_tx_rx_id = self._data_tx_rx_id[:data_cnt]
         self._acquisition_running = False
         self._status = Status.READY
-        self._save_measurement()
+        if journaling is not None:
+            await journaling
+        await asyncio.to_thread(self._journal.append, self._get_recording_data(
+            data_cnt // ROW_GROUP_SIZE * ROW_GROUP_SIZE, data_cnt))
+        await asyncio.to_thread(self._journal.close)
+        # Saved in a worker thread, so the data and status producers keep running.
+        # A new measurement may start meanwhile, so the save gets its own references.
+        journal, self._journal = self._journal, None
+        await asyncio.to_thread(self._save_measurement, self._recording_path,
+                                self._get_recording_data(0, data_cnt), journal,
+                                self._recording_codec)
 
-    def _save_measurement(self):
+    def _new_recording_path(self) -> str:
         start_time = time.localtime(self._recording_start)
         timestring = time.strftime("%Y-%m-%d_%H-%M-%S", start_time)
         filename = "wulpus-" + timestring
@@ -166,43 +216,49 @@ class Wulpus:
         ensure_dir(measurement_path)
         basepath = os.path.join(measurement_path, filename)
 
-        # Check if filename exists (.npz gets added by .savez command)
-        while os.path.isfile(basepath + DATA_FILE_EXTENSION):
+        # Check if filename (or the journal of a crashed recording) exists
+        while os.path.isfile(basepath + DATA_FILE_EXTENSION) or \
+                os.path.isfile(basepath + DATA_FILE_EXTENSION + JOURNAL_EXTENSION):
             basepath = basepath + "_conflict"
+        return basepath + DATA_FILE_EXTENSION
 
-        df = pd.DataFrame({
-            'measurement': [pd.Series(self._data[:, i]) for i in range(self._live_data_cnt)],
-            "tx": [self._config.tx_rx_config[i].tx_channels for i in self._data_tx_rx_id],
-            "rx": [self._config.tx_rx_config[i].rx_channels for i in self._data_tx_rx_id],
-            "aq_number": self._data_acq_num,
-            "log_version": 1,
-            "tx_rx_id": self._data_tx_rx_id
-        }, index=self._data_time)
-
-        # Expand measurement series into columns so they're all included in save-format (parquet)
-        measurement_expanded = pd.DataFrame(
-            [m.values for m in df['measurement']], index=df.index)
-        flattened_df = pd.concat(
-            [df.drop(columns=['measurement']), measurement_expanded], axis=1)
-        flattened_df.columns = [str(col) for col in flattened_df.columns]
-
-        with ZipFile(basepath + DATA_FILE_EXTENSION, 'w') as zf:
-            zf.writestr('config-0.json', self._config.model_dump_json())
-            # Write dataframe as parquet
-            buffer = io.BytesIO()
-            flattened_df.to_parquet(buffer)
-            zf.writestr('data.parquet', buffer.getvalue())
-
-        print('Data saved in ' + basepath + DATA_FILE_EXTENSION)
-
-    def get_latest_frame(self):
+    def _get_recording_data(self, start: int, stop: int) -> RecordingData:
+        return RecordingData(
+            samples=self._data[:, start:stop].T,
+            acq_nr=self._data_acq_num[start:stop],
+            tx_rx_id=self._data_tx_rx_id[start:stop],
+            time=self._data_time[start:stop],
+            config=self._config,
+        )
+
+    def _save_measurement(self, path: str, data: RecordingData, journal: RecordingJournal,
+                          codec: RecordingCodec):
+        write_recording(path, data, codec)
+        # The recording is complete, the journal isn't needed anymore
+        journal.discard()
+
+        print('Data saved in ' + path)
+        save_preview(path, compute_preview(data))
+        if self._catalog is not None:
+            self._catalog.add(path)
+
+    def get_latest_frame(self) -> Union[LiveFrame, None]:
         return self._latest_frame
 
-    def _structure_measurement(self, _data: np.ndarray, _tx_rx_id: int, _time: int) -> Measurement:
+    def _publish_frame(self, _data: np.ndarray, _tx_rx_id: int, _time: int):
+        """Number the frame in the frame log and wake up the WebSocket sender."""
+        self._latest_frame = self._frame_log.append(
+            self._structure_measurement(_data, _tx_rx_id, _time))
+        self._new_measurement.set()
+
+    def _structure_measurement(self, _data: np.ndarray, _tx_rx_id: int, _time: int) -> LiveFrame:
         tx_rx_config = self._config.tx_rx_config[_tx_rx_id]
-        return Measurement(
-            data=_data.tolist(),
+        # Samples stay a NumPy array, they are encoded per client protocol (see frame_protocol)
+        return LiveFrame(
+            seq=0,  # Assigned by the frame log
             time=int(_time),
+            tx_rx_id=int(_tx_rx_id),
+            data=np.array(_data, dtype='<i2'),
             tx=tx_rx_config.tx_channels,
             rx=tx_rx_config.rx_channels
         )
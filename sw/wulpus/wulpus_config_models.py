@@ -95,7 +95,7 @@ class TxRxConfig(BaseModel):
             if not (0 <= ch <= MAX_CH_ID):
                 raise ValueError(
                     f"Channel ID {ch} must be between 0 and {MAX_CH_ID}")
-            return channels
+        return channels
 
 
 class WulpusConfig(BaseModel):
@@ -12,7 +12,7 @@ import numpy as np
 import pandas as pd
 from wulpus.dongle import WulpusDongle
 from wulpus.dongle_mock import WulpusDongleMock
-from wulpus.helper import zip_to_dataframe
+from wulpus.replay import DEFAULT_SPEED, REPLAY_SPEED, Replay
 from wulpus.wulpus_api import gen_conf_package, gen_restart_package
 from wulpus.wulpus_config_models import WulpusConfig
 
@@ -26,13 +26,17 @@ class WulpusMock(Wulpus):
         self._dongle = WulpusDongleMock()
         self._status = Status.READY
         self._replay_file = None
+        self._replay_speed: REPLAY_SPEED = DEFAULT_SPEED
+        self._replay: Union[Replay, None] = None
 
     def get_status(self):
         status = super().get_status()
         status["mock"] = True
+        if self._replay is not None:
+            status["replay"] = self._replay.state()
         return status
 
-    def set_replay_file(self, file_path: Union[str, None]):
+    def set_replay_file(self, file_path: Union[str, None], speed: REPLAY_SPEED = DEFAULT_SPEED):
         if file_path is None:
             self._replay_file = None
             return
@@ -40,6 +44,16 @@ class WulpusMock(Wulpus):
             raise ValueError(f"File {file_path} does not exist.")
         print(f"Replaying file set to {file_path}")
         self._replay_file = file_path
+        self._replay_speed = speed
+
+    def get_replay(self) -> Union[Replay, None]:
+        """The running replay, to change its speed, pause or seek."""
+        return self._replay
+
+    def stop(self):
+        super().stop()
+        if self._replay is not None:
+            self._replay.stop()
 
     async def _measure(self):
         if self._replay_file is None:
@@ -50,31 +64,22 @@ class WulpusMock(Wulpus):
             self._status = Status.RUNNING
             self._acquisition_running = True
 
-            df, config = zip_to_dataframe(self._replay_file)
-
-            self._config = config
-
-            self._data = np.column_stack([
-                np.asarray(m, dtype=np.int16) for m in df['measurement']
-            ])
-            # Cast arrays to expected dtypes
-            self._data_acq_num = df['aq_number'].to_numpy(dtype='<u2')
-            self._data_tx_rx_id = df['tx_rx_id'].to_numpy(dtype=np.uint8)
-            self._data_time = df.index.to_numpy(dtype=np.uint64)
-            # Update number of measurements with actual recorded ones
-            data_cnt = self._data.shape[1]
-            num_samples = self._data.shape[0]
-            self._config.us_config.num_acqs = data_cnt
-            self._config.us_config.num_samples = num_samples
+            # Frames are read lazily and paced by their recorded timestamps
+            self._replay = Replay(self._replay_file, self._replay_speed)
+            try:
+                self._config = self._replay.config
+                # Update number of measurements with actual recorded ones
+                self._config.us_config.num_acqs = self._replay.num_frames
+                self._config.us_config.num_samples = self._replay.recording.num_samples
 
-            index = 0
-            while index < data_cnt and self._acquisition_running:
-                await asyncio.sleep(0.1)
-                self._latest_frame = self._structure_measurement(
-                    self._data[:, index], self._data_tx_rx_id[index], self._data_time[index])
-                self._new_measurement.set()
-                index += 1
-                self._live_data_cnt = index
+                async for data, tx_rx_id, frame_time in self._replay.frames():
+                    if not self._acquisition_running:
+                        break
+                    self._publish_frame(data, tx_rx_id, frame_time)
+                    self._live_data_cnt = self._replay.position
+            finally:
+                self._replay.close()
+                self._replay = None
             self._acquisition_running = False
             self.set_replay_file(None)
             self._status = Status.READY